@@ -0,0 +1,158 @@
+# adapters.py
+"""Adaptadores de formato do serviço unificado.
+
+Cada adaptador sabe reconhecer um formato de entrada (marketplace e layout) a
+partir de uma amostra das primeiras páginas e processá-lo com o extrator e a
+composição certos. A amostra é lida uma única vez com o PyMuPDF, sem OCR, então
+um upload do formato errado é desviado antes de qualquer processamento pesado.
+"""
+import os
+import re
+import json
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+import fitz
+
+import shein
+from pdf_writer import fitz_lock
+from processor import TRACKING_RE, MEL_TRACKING_RE, process_etiqueta
+from text_extraction import normalize_text, words_to_text
+from zip_stream import INDEX_NAME
+
+# Páginas lidas para reconhecer o formato
+DETECT_PAGES = shein.MANIFEST_SNIFF_PAGES
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+MERCADO_LIVRE_RE = re.compile(r"MERCADO\s*(LIVRE|ENVIOS)", re.IGNORECASE)
+DANFE_RE = re.compile(r"\bDANFE\b", re.IGNORECASE)
+
+
+class DocumentSample:
+    """Palavras e texto das primeiras páginas de um upload."""
+
+    def __init__(self, path: str, max_pages: int = DETECT_PAGES):
+        self.path = path
+        self.extension = os.path.splitext(path)[1].lower()
+        self.words: List[list] = []
+        self.texts: List[str] = []
+        self.page_count = 1
+        if self.extension in IMAGE_EXTENSIONS:
+            return
+        with fitz_lock, fitz.open(path) as doc:
+            self.page_count = doc.page_count
+            for i in range(min(max_pages, doc.page_count)):
+                page = doc[i]
+                words = page.get_text("words")
+                self.words.append(words)
+                # Mesmo texto normalizado que o extrator vê no processamento
+                self.texts.append(normalize_text(words_to_text(words)))
+
+    @property
+    def is_image(self) -> bool:
+        return self.extension in IMAGE_EXTENSIONS
+
+    @property
+    def has_text(self) -> bool:
+        return any(text.strip() for text in self.texts)
+
+
+class Detection:
+    """Resultado da detecção: adaptador escolhido, layout e se houve reconhecimento."""
+
+    def __init__(self, adapter: "FormatAdapter", layout: str, detected: bool = True):
+        self.adapter = adapter
+        self.layout = layout
+        self.detected = detected
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'formato': self.adapter.name, 'layout': self.layout, 'detectado': self.detected}
+
+
+class FormatAdapter:
+    """Interface dos adaptadores: detect() reconhece, process() processa."""
+
+    name = ''
+    description = ''
+
+    def detect(self, sample: DocumentSample) -> Optional[str]:
+        """Layout reconhecido na amostra, ou None se o formato não é deste adaptador."""
+        raise NotImplementedError
+
+    def process(self, input_path: str, output_path: str, progress=None, memory=None,
+                progress_path: Optional[str] = None, deadline=None,
+                split_dir: Optional[str] = None) -> Dict[str, Any]:
+        """Processa o upload em output_path ou, com split_dir, um PDF por item em split_dir
+        (listados em result['arquivos'])."""
+        raise NotImplementedError
+
+
+class SheinAdapter(FormatAdapter):
+    """Manifestos Shein: etiquetas intercaladas com DANFEs simplificadas."""
+
+    name = 'shein'
+    description = 'Manifesto Shein (etiquetas + DANFE simplificada com tabela de itens)'
+
+    def detect(self, sample: DocumentSample) -> Optional[str]:
+        if sample.is_image or not shein.manifest_header_in(sample.words):
+            return None
+        return 'manifesto'
+
+    def process(self, input_path, output_path, progress=None, memory=None, progress_path=None,
+                deadline=None, split_dir=None):
+        # Pool de processos, admissão e fila compartilhada do próprio shein
+        total, memoria = shein.process_upload(input_path, output_path, progress, progress_path, split_dir)
+        result = {'danfes': total, 'saida_pdf': output_path if total and not split_dir else None,
+                  'memoria': memoria}
+        if split_dir:
+            # O índice foi gravado pelo processo que compôs os pedidos
+            arquivos = []
+            if total:
+                with open(os.path.join(split_dir, INDEX_NAME), encoding='utf-8') as f:
+                    arquivos = json.load(f)['arquivos']
+            result['arquivos'] = arquivos
+        return result
+
+
+class MercadoLivreAdapter(FormatAdapter):
+    """Etiquetas do Mercado Livre (PDF com texto, digitalizado ou imagem, com ou sem DANFE).
+
+    É também o adaptador padrão: aceita qualquer entrada, usando OCR quando não
+    há texto.
+    """
+
+    name = 'mercadolivre'
+    description = 'Etiquetas Mercado Livre / Correios (PDF ou imagem, com OCR)'
+
+    def __init__(self, produtos_map: Mapping):
+        self.produtos_map = produtos_map
+
+    def detect(self, sample: DocumentSample) -> Optional[str]:
+        if sample.is_image:
+            return 'imagem'
+        if not sample.has_text:
+            return 'digitalizado'
+        joined = "\n".join(sample.texts)
+        if TRACKING_RE.search(joined) or MEL_TRACKING_RE.search(joined) or MERCADO_LIVRE_RE.search(joined):
+            return 'etiqueta'
+        if DANFE_RE.search(joined):
+            return 'danfe'
+        return None
+
+    def process(self, input_path, output_path, progress=None, memory=None, progress_path=None,
+                deadline=None, split_dir=None):
+        return process_etiqueta(input_path, self.produtos_map, out_pdf_path=output_path,
+                                progress=progress, memory=memory, deadline=deadline, split_dir=split_dir)
+
+
+def detect_format(path: str, adapters: Sequence[FormatAdapter]) -> Detection:
+    """Primeiro adaptador (em ordem) que reconhece o arquivo; o último é o padrão."""
+    try:
+        sample = DocumentSample(path)
+    except Exception as e:
+        # Arquivo que o PyMuPDF não abre: o adaptador padrão decide (e reporta o erro)
+        print(f"Detecção de formato falhou para {os.path.basename(path)}: {e}")
+        return Detection(adapters[-1], 'desconhecido', detected=False)
+    for adapter in adapters:
+        layout = adapter.detect(sample)
+        if layout:
+            return Detection(adapter, layout)
+    return Detection(adapters[-1], 'desconhecido', detected=False)
@@ -0,0 +1,152 @@
+# admission.py
+"""Controle de admissão para os endpoints que consomem CPU (OCR, rasterização).
+
+Cada endpoint tem um AdmissionController com uma capacidade em unidades de
+custo: a requisição só executa quando o seu custo estimado cabe no que está
+livre; senão espera (em ordem de chegada) numa fila limitada. Com a fila cheia,
+ou depois de max_wait segundos esperando, a requisição é recusada com
+AdmissionRejected, que as rotas convertem em 429 com Retry-After.
+"""
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+import fitz
+
+from pdf_writer import fitz_lock
+
+# Peso de uma página que precisa de OCR em relação a uma página com texto
+OCR_WEIGHT = int(os.environ.get('ADMISSION_OCR_WEIGHT', 8))
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada por falta de capacidade; retry_after em segundos."""
+
+    def __init__(self, endpoint: str, reason: str, retry_after: int):
+        super().__init__(f"{endpoint}: {reason}")
+        self.endpoint = endpoint
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    # Entrada da fila; comparada por identidade
+    __slots__ = ('cost',)
+
+    def __init__(self, cost: int):
+        self.cost = cost
+
+
+class AdmissionController:
+    """Limitador de concorrência por custo com fila de espera limitada."""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._in_use = 0
+        self._waiting: deque = deque()
+        self._cond = threading.Condition()
+        # Média móvel do tempo de execução por unidade de custo (estimativa do Retry-After)
+        self._seconds_per_unit = 1.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _retry_after(self, cost: int) -> int:
+        # Chamado com o lock adquirido
+        pending = self._in_use + sum(t.cost for t in self._waiting) + cost
+        return max(1, math.ceil(pending * self._seconds_per_unit / self.capacity))
+
+    def _reject(self, reason: str, cost: int) -> AdmissionRejected:
+        # Chamado com o lock adquirido
+        self.rejected += 1
+        retry_after = self._retry_after(cost)
+        print(f"Admissão {self.name}: recusada ({reason}), Retry-After {retry_after}s")
+        return AdmissionRejected(self.name, reason, retry_after)
+
+    def acquire(self, cost: float) -> int:
+        """Bloqueia até haver capacidade para o custo; retorna o custo reservado.
+
+        Custos maiores que a capacidade são limitados a ela: a requisição
+        executa sozinha em vez de nunca ser admitida.
+        """
+        cost = max(1, min(math.ceil(cost), self.capacity))
+        with self._cond:
+            if not self._waiting and self._in_use + cost <= self.capacity:
+                self._in_use += cost
+                self.admitted += 1
+                return cost
+            if len(self._waiting) >= self.max_queue:
+                raise self._reject('fila cheia', cost)
+
+            ticket = _Ticket(cost)
+            self._waiting.append(ticket)
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._waiting[0] is not ticket or self._in_use + cost > self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._reject('tempo de espera esgotado', cost)
+                    self._cond.wait(remaining)
+                self._in_use += cost
+                self.admitted += 1
+                return cost
+            finally:
+                self._waiting.remove(ticket)
+                # O próximo da fila pode ter passado a caber
+                self._cond.notify_all()
+
+    def release(self, cost: int, elapsed: float) -> None:
+        with self._cond:
+            self._in_use -= cost
+            self._seconds_per_unit = 0.8 * self._seconds_per_unit + 0.2 * (elapsed / cost)
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, cost: float) -> Iterator[int]:
+        reserved = self.acquire(cost)
+        start = time.monotonic()
+        try:
+            yield reserved
+        finally:
+            self.release(reserved, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'in_use': self._in_use,
+                'queued': len(self._waiting),
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'seconds_per_unit': round(self._seconds_per_unit, 3),
+            }
+
+
+def estimate_cost(path: str, ocr_weight: int = OCR_WEIGHT) -> int:
+    """Custo estimado do arquivo: páginas x peso do OCR quando não há texto.
+
+    Em PDFs, a necessidade de OCR é inferida das primeiras páginas (sem camada
+    de texto = digitalizado). Imagens sempre passam por OCR.
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return ocr_weight
+    if ext != '.pdf':
+        return 1
+    try:
+        with fitz_lock, fitz.open(str(path)) as doc:
+            pages = doc.page_count
+            needs_ocr = not any(doc[i].get_text().strip() for i in range(min(pages, 3)))
+    except Exception:
+        # PDF inválido: a própria rota recusa o arquivo depois
+        return 1
+    return max(pages, 1) * (ocr_weight if needs_ocr else 1)
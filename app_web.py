@@ -1,23 +1,75 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import os
 import json
+import uuid
+import shutil
+import tempfile
+from functools import partial
 from werkzeug.utils import secure_filename
+import fitz
 from processor import process_etiqueta
+import shein
+from adapters import MercadoLivreAdapter, SheinAdapter, detect_format
+from output_store import OutputStore, PREVIEW_FORMATS
+from pdf_writer import fitz_lock
+from text_extraction import page_text
+from progress import valid_job_id
+from admission import AdmissionController, AdmissionRejected, estimate_cost
+from catalog import ProductCatalog, CatalogError, VersionConflict
+from memory import MemoryTracker, MemoryBudgetExceeded, MB
+from deadline import deadline_from_env
+from zip_stream import stream_zip, zip_response_headers
+from spool import Spool
+import profiling
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# 50MB: o mesmo serviço recebe os manifestos Shein, bem maiores que as etiquetas
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
 
 # Configurações
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'txt'}
+# Limites do armazenamento de saídas (tamanho total e idade máxima)
+OUTPUT_MAX_BYTES = int(os.environ.get('OUTPUT_MAX_MB', 1024)) * 1024 * 1024
+OUTPUT_MAX_AGE = int(os.environ.get('OUTPUT_MAX_AGE_HOURS', 24)) * 3600
+# Cache das miniaturas de /preview (em MB)
+PREVIEW_CACHE_BYTES = int(os.environ.get('PREVIEW_CACHE_MB', 64)) * 1024 * 1024
+# Controle de admissão: capacidade em unidades de custo (páginas, OCR pesa mais),
+# tamanho da fila de espera e tempo máximo de espera por endpoint
+ADMISSION_CAPACITY = int(os.environ.get('ADMISSION_CAPACITY', 16 * (os.cpu_count() or 1)))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 16))
+ADMISSION_MAX_WAIT = float(os.environ.get('ADMISSION_MAX_WAIT', 30))
+# Medição de memória por requisição (também ativável com o campo 'memoria=1')
+# e orçamento de pico do processo em MB (0 = sem limite)
+MEMORY_TRACKING = os.environ.get('MEMORY_TRACKING', '0') == '1'
+MEMORY_BUDGET = int(os.environ.get('MEMORY_BUDGET_MB', 0)) * MB
+# Fila compartilhada: com SPOOL_DIR definido os uploads são processados pelos
+# workers (python spool.py worker) de qualquer máquina que enxergue o diretório
+SPOOL_DIR = os.environ.get('SPOOL_DIR')
+SPOOL_WAIT = float(os.environ.get('SPOOL_WAIT', 300))
+SPOOL_MAX_PENDING = int(os.environ.get('SPOOL_MAX_PENDING', 200))
 
 # Criar diretórios se não existirem
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Mapa de produtos (exemplo)
-PRODUTOS_MAP = {
+output_store = OutputStore(OUTPUT_FOLDER, OUTPUT_MAX_BYTES, OUTPUT_MAX_AGE,
+                           preview_cache_bytes=PREVIEW_CACHE_BYTES)
+output_store.start_sweeper()
+
+# Um único acompanhamento de progresso no processo: /progress atende uploads
+# de qualquer formato, inclusive os recebidos pelas rotas do shein
+progress_tracker = shein.progress_tracker
+
+spool = Spool(SPOOL_DIR) if SPOOL_DIR else None
+_published_catalog = {'etag': None}
+
+upload_admission = AdmissionController('upload', ADMISSION_CAPACITY, ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+demo_admission = AdmissionController('demo', max(1, ADMISSION_CAPACITY // 4), ADMISSION_MAX_QUEUE, ADMISSION_MAX_WAIT)
+
+# Mapa de produtos (exemplo), versionado para sincronização incremental
+PRODUTOS_MAP = ProductCatalog({
     "AM997753439BR": [
         {"sku": "ZX2225_2", "titulo": "Sandália Papete Brilho Luxo Em Eva Com Strass Leve Biaritz", "qtd": 1, "cor": "Preto", "tamanho": "39 BR"}
     ],
@@ -36,11 +88,96 @@ PRODUTOS_MAP = {
     "MEL45595550199LMXDF01": [
         {"sku": "502576", "titulo": "Chinelo Infantil Capivara Slide Capivara Leve Confortavel", "qtd": 1, "cor": "Rosa Bebê/Pink", "tamanho": "28 BR"}
     ]
-}
+})
+
+# Adaptadores de formato em ordem de especificidade; o último é o padrão
+FORMAT_ADAPTERS = [SheinAdapter(), MercadoLivreAdapter(PRODUTOS_MAP)]
+
+# Rotas /processar-pdf do shein servidas pelo mesmo processo (pool e caches compartilhados)
+app.register_blueprint(shein.shein_api)
+# Perfis por amostragem de /upload e /processar-pdf (PROFILE_SAMPLE_RATE ou cabeçalho X-Profile)
+app.register_blueprint(profiling.profiling_api)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def memory_tracker_for(req):
+    """MemoryTracker da requisição, ou None se medição e orçamento estão desligados."""
+    tracking = MEMORY_TRACKING or req.values.get('memoria') == '1'
+    if not tracking and not MEMORY_BUDGET:
+        return None
+    return MemoryTracker(MEMORY_BUDGET, trace_python=tracking)
+
+class SpoolPending(Exception):
+    """O job ainda está na fila compartilhada depois de SPOOL_WAIT segundos."""
+
+    def __init__(self, spool_id):
+        super().__init__(spool_id)
+        self.spool_id = spool_id
+
+def finish_spooled(info, output_path):
+    """Copia a saída de um job concluído para OUTPUT_FOLDER e devolve o resultado."""
+    if info['state'] == 'failed':
+        spool.remove(info['id'])
+        raise Exception(info.get('error') or 'Falha no worker')
+    if info['state'] == 'unknown':
+        raise FileNotFoundError(info['id'])
+    if info['state'] != 'done':
+        raise SpoolPending(info['id'])
+    result = info['result'] or {}
+    shutil.copyfile(os.path.join(info['path'], result.get('saida_pdf') or 'saida.pdf'), output_path)
+    output_store.register(os.path.basename(output_path))
+    result['saida_pdf'] = output_path
+    spool.remove(info['id'])
+    return result
+
+def process_spooled(filepath, output_path, job_id):
+    """Envia o upload para a fila compartilhada e aguarda um worker."""
+    if spool.pending_count() >= SPOOL_MAX_PENDING:
+        raise AdmissionRejected('upload', 'fila compartilhada cheia', 5)
+    if _published_catalog['etag'] != PRODUTOS_MAP.etag:
+        etag = PRODUTOS_MAP.etag
+        _, items = PRODUTOS_MAP.snapshot()
+        spool.publish_catalog(etag, items)
+        _published_catalog['etag'] = etag
+    spool_id = spool.submit('etiqueta', filepath)
+    info = spool.wait(spool_id, SPOOL_WAIT, progress_tracker.reporter(job_id))
+    return finish_spooled(info, output_path)
+
+def process_manifest_upload(adapter, filepath, output_path, job_id, split_dir=None):
+    """Manifesto Shein recebido em /upload: pipeline do shein e saída em OUTPUT_FOLDER."""
+    with shein.RequestWorkspace() as workspace:
+        result = adapter.process(filepath, output_path, progress=progress_tracker.reporter(job_id),
+                                 progress_path=workspace.file('progresso.json'), split_dir=split_dir)
+    if not result['danfes']:
+        raise ValueError('Nenhuma DANFE com tabela de itens encontrada no manifesto')
+    if not split_dir:
+        output_store.register(os.path.basename(output_path))
+    return result
+
+def split_zip_response(result, split_dir, download_name):
+    """ZIP com um PDF por rastreio/pedido e o índice, gerado durante o envio.
+
+    O diretório da saída separada é removido quando a transmissão termina.
+    """
+    arquivos = result.get('arquivos') or []
+    index = {key: result.get(key) for key in ('formato', 'layout', 'detectado', 'prazo') if result.get(key) is not None}
+    index['arquivos'] = arquivos
+    files = [(a['arquivo'], os.path.join(split_dir, a['arquivo'])) for a in arquivos]
+    return Response(stream_zip(files, index, partial(shutil.rmtree, split_dir, ignore_errors=True)),
+                    mimetype='application/zip', headers=zip_response_headers(download_name))
+
+def admission_rejected(e):
+    """Resposta 429 para uma requisição recusada pelo controle de admissão."""
+    response = jsonify({
+        'success': False,
+        'error': f'Servidor ocupado. Tente novamente em {e.retry_after} segundos.',
+        'retry_after': e.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -54,25 +191,38 @@ def upload_file():
     if file.filename == '':
         return jsonify({'success': False, 'error': 'Nenhum arquivo selecionado'})
     
+    # Identificador gerado pelo front-end para acompanhar o progresso em /progress/<job_id>
+    job_id = request.form.get('job_id')
+    if not valid_job_id(job_id):
+        job_id = None
+
+    # saida=zip: um PDF por rastreio (ou pedido Shein), devolvidos num ZIP
+    split = request.values.get('saida') == 'zip'
+    if split and spool is not None:
+        return jsonify({'success': False, 'error': 'Saída separada (saida=zip) não disponível com a fila compartilhada'}), 400
+
     if file and allowed_file(file.filename):
         filepath = None
+        split_dir = None
+        if job_id:
+            progress_tracker.start(job_id)
         try:
             # Salvar arquivo temporariamente
             filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+            # Prefixo único: uploads simultâneos com o mesmo nome não se sobrescrevem
+            upload_id = uuid.uuid4().hex[:8]
+            filepath = os.path.join(UPLOAD_FOLDER, f"{upload_id}_{filename}")
             file.save(filepath)
             
             # Validar PDF se for um arquivo PDF
             if filename.lower().endswith('.pdf'):
                 try:
-                    import pdfplumber
-                    with pdfplumber.open(filepath) as pdf:
+                    with fitz_lock, fitz.open(filepath) as pdf:
                         # Tentar acessar a primeira página para validar o PDF
-                        if len(pdf.pages) == 0:
+                        if pdf.page_count == 0:
                             raise Exception("PDF vazio ou sem páginas")
                         # Tentar extrair texto da primeira página
-                        first_page = pdf.pages[0]
-                        first_page.extract_text()
+                        page_text(pdf[0])
                 except Exception as pdf_error:
                     # Limpar arquivo inválido
                     try:
@@ -80,6 +230,8 @@ def upload_file():
                             os.remove(filepath)
                     except:
                         pass
+                    if job_id:
+                        progress_tracker.finish(job_id, error='PDF inválido')
                     return jsonify({
                         'success': False,
                         'error': 'O arquivo PDF está corrompido, danificado ou em um formato não suportado. Por favor, verifique o arquivo e tente novamente.'
@@ -89,8 +241,42 @@ def upload_file():
             import time
             timestamp = int(time.time())
             filename_without_ext = os.path.splitext(filename)[0]
-            enhanced_output = os.path.join(OUTPUT_FOLDER, f"{filename_without_ext}_processado_{timestamp}.pdf")
-            result = process_etiqueta(filepath, PRODUTOS_MAP, enhanced_output)
+            enhanced_output = os.path.join(OUTPUT_FOLDER, f"{filename_without_ext}_processado_{timestamp}_{upload_id}.pdf")
+            # Marketplace e layout pelas primeiras páginas, antes de qualquer OCR
+            detection = detect_format(filepath, FORMAT_ADAPTERS)
+            print(f"Formato de {filename}: {detection.adapter.name} ({detection.layout})")
+            if split:
+                # Os PDFs separados não vão para o OutputStore: saem direto no ZIP da resposta
+                split_dir = tempfile.mkdtemp(prefix=f"zip_{upload_id}_", dir=UPLOAD_FOLDER)
+            try:
+                if detection.adapter.name == 'shein':
+                    result = process_manifest_upload(detection.adapter, filepath, enhanced_output, job_id, split_dir)
+                elif spool is not None:
+                    # Processado por um worker da fila compartilhada
+                    result = process_spooled(filepath, enhanced_output, job_id)
+                else:
+                    # Aguarda capacidade conforme o custo estimado (páginas x OCR)
+                    memory = memory_tracker_for(request)
+                    try:
+                        with upload_admission.admit(estimate_cost(filepath)):
+                            # O prazo conta a partir da admissão (a espera na fila tem limite próprio)
+                            result = detection.adapter.process(filepath, enhanced_output,
+                                                               progress=progress_tracker.reporter(job_id),
+                                                               memory=memory, deadline=deadline_from_env(),
+                                                               split_dir=split_dir)
+                    finally:
+                        if memory is not None:
+                            memory.close()
+                            memory.log(filename)
+                    if not split_dir:
+                        output_store.register(os.path.basename(enhanced_output))
+            except BaseException:
+                if split_dir:
+                    shutil.rmtree(split_dir, ignore_errors=True)
+                raise
+            result.update(detection.as_dict())
+            if job_id:
+                progress_tracker.finish(job_id)
             
             # Tentar limpar arquivo de upload (não crítico se falhar)
             try:
@@ -99,14 +285,61 @@ def upload_file():
             except (PermissionError, OSError):
                 # Arquivo pode estar em uso, ignorar erro
                 pass
-            
+
+            if split_dir:
+                return split_zip_response(result, split_dir, f"{filename_without_ext}_processado_{timestamp}.zip")
             return jsonify({
                 'success': True,
                 'result': result,
-                'download_url': f'/download/{os.path.basename(enhanced_output)}'
+                'job_id': job_id,
+                'download_url': f'/download/{os.path.basename(enhanced_output)}',
+                'preview_url': f'/preview/{os.path.basename(enhanced_output)}'
             })
+
+        except SpoolPending as e:
+            # Continua na fila: o cliente consulta /jobs/<id> depois
+            if job_id:
+                progress_tracker.finish(job_id, error='Ainda na fila de processamento')
+            try:
+                if filepath and os.path.exists(filepath):
+                    os.remove(filepath)
+            except (PermissionError, OSError):
+                pass
+            return jsonify({
+                'success': False,
+                'pending': True,
+                'error': 'O arquivo ainda está na fila de processamento.',
+                'status_url': f'/jobs/{e.spool_id}'
+            }), 202
+
+        except AdmissionRejected as e:
+            if job_id:
+                progress_tracker.finish(job_id, error='Servidor ocupado')
+            try:
+                if filepath and os.path.exists(filepath):
+                    os.remove(filepath)
+            except (PermissionError, OSError):
+                pass
+            return admission_rejected(e)
+
+        except MemoryBudgetExceeded as e:
+            print(f"Memória [{file.filename}]: {e}")
+            if job_id:
+                progress_tracker.finish(job_id, error='Orçamento de memória excedido')
+            try:
+                if filepath and os.path.exists(filepath):
+                    os.remove(filepath)
+            except (PermissionError, OSError):
+                pass
+            return jsonify({
+                'success': False,
+                'error': 'O arquivo exige mais memória do que o servidor permite processar agora. Tente dividir o PDF ou enviar novamente mais tarde.'
+            }), 503
             
         except Exception as e:
+            if job_id:
+                progress_tracker.finish(job_id, error=str(e))
+
             # Tentar limpar arquivo de upload em caso de erro
             try:
                 if filepath and os.path.exists(filepath):
@@ -155,7 +388,9 @@ def demo():
         # Processar demonstração
         output_filename = f"demo_processado.pdf"
         output_path = os.path.join(OUTPUT_FOLDER, output_filename)
-        result = process_etiqueta(demo_file, PRODUTOS_MAP, output_path)
+        with demo_admission.admit(estimate_cost(demo_file)):
+            result = process_etiqueta(demo_file, PRODUTOS_MAP, output_path)
+        output_store.register(output_filename)
         
         # Tentar limpar arquivo temporário (não crítico se falhar)
         try:
@@ -168,8 +403,12 @@ def demo():
         return jsonify({
             'success': True,
             'result': result,
-            'download_url': f'/download/{os.path.basename(output_path)}'
+            'download_url': f'/download/{os.path.basename(output_path)}',
+            'preview_url': f'/preview/{os.path.basename(output_path)}'
         })
+
+    except AdmissionRejected as e:
+        return admission_rejected(e)
         
     except Exception as e:
         return jsonify({
@@ -180,27 +419,158 @@ def demo():
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
-        file_path = os.path.join(OUTPUT_FOLDER, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
-        else:
+        response = output_store.send(filename)
+        if response is None:
             return jsonify({'error': 'Arquivo não encontrado'}), 404
+        return response
+    except FileNotFoundError:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
     except Exception as e:
         return jsonify({'error': f'Erro ao baixar arquivo: {str(e)}'}), 500
 
+@app.route('/preview/<filename>')
+def preview_output(filename):
+    """Miniatura de uma página do PDF gerado (?page=1&width=400&format=webp|png)."""
+    try:
+        page = int(request.args.get('page', 1))
+        width = int(request.args.get('width', 400))
+    except ValueError:
+        return jsonify({'error': 'page e width devem ser números inteiros'}), 400
+    fmt = request.args.get('format', 'webp').lower()
+    if fmt not in PREVIEW_FORMATS:
+        return jsonify({'error': f"Formato inválido (use {', '.join(PREVIEW_FORMATS)})"}), 400
+    try:
+        preview = output_store.preview(filename, page, width, fmt)
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except FileNotFoundError:
+        preview = None
+    except Exception as e:
+        return jsonify({'error': f'Erro ao gerar miniatura: {str(e)}'}), 500
+    if preview is None:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+
+    response = Response(preview['data'], mimetype=preview['mimetype'])
+    response.set_etag(preview['etag'])
+    # Mesma política dos downloads: revalida sempre, 304 se nada mudou
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Page-Count'] = str(preview['pages'])
+    response.headers['X-Preview-Width'] = str(preview['width'])
+    response.headers['X-Preview-Cache'] = 'hit' if preview['cached'] else 'miss'
+    return response.make_conditional(request)
+
+@app.route('/outputs')
+def list_outputs():
+    return jsonify({
+        'total_bytes': output_store.total_bytes(),
+        'max_bytes': OUTPUT_MAX_BYTES,
+        'max_age_seconds': OUTPUT_MAX_AGE,
+        'cache_miniaturas': output_store.previews.stats(),
+        'arquivos': [
+            {**meta, 'download_url': f"/download/{meta['filename']}",
+             'preview_url': f"/preview/{meta['filename']}"}
+            for meta in output_store.list()
+        ]
+    })
+
+@app.route('/jobs/<spool_id>')
+def spool_job_status(spool_id):
+    """Estado de um upload enviado à fila compartilhada."""
+    if spool is None or not valid_job_id(spool_id):
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    info = spool.status(spool_id)
+    if info['state'] in ('pending', 'running'):
+        return jsonify({'success': False, 'pending': True, 'state': info['state'],
+                        'progress': info.get('progress')}), 202
+    try:
+        output_path = os.path.join(OUTPUT_FOLDER, f"{spool_id}_processado.pdf")
+        result = finish_spooled(info, output_path)
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': 'Job não encontrado'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': f'Erro ao processar arquivo: {str(e)}'})
+    return jsonify({
+        'success': True,
+        'result': result,
+        'download_url': f'/download/{os.path.basename(output_path)}',
+        'preview_url': f'/preview/{os.path.basename(output_path)}'
+    })
+
+@app.route('/progress/<job_id>')
+def progress_stream(job_id):
+    if not valid_job_id(job_id):
+        return jsonify({'error': 'Identificador de job inválido'}), 400
+    return Response(
+        stream_with_context(progress_tracker.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def catalog_headers(response):
+    response.headers['ETag'] = f'"{PRODUTOS_MAP.etag}"'
+    response.headers['X-Catalog-Version'] = str(PRODUTOS_MAP.version)
+    response.headers['X-Catalog-Epoch'] = PRODUTOS_MAP.epoch
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/produtos', methods=['GET', 'POST'])
 def manage_produtos():
     if request.method == 'GET':
-        return jsonify(PRODUTOS_MAP)
+        # GET condicional: nada mudou desde o último download
+        if PRODUTOS_MAP.etag in request.if_none_match:
+            return catalog_headers(Response(status=304))
+
+        # Delta: apenas o que mudou depois da versão informada
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Parâmetro since inválido'}), 400
+            epoch = request.args.get('epoch')
+            if epoch and epoch != PRODUTOS_MAP.epoch:
+                since = -1  # versão de outra execução: envia o catálogo completo
+            return catalog_headers(jsonify({'epoch': PRODUTOS_MAP.epoch, **PRODUTOS_MAP.changes_since(since)}))
+
+        # Exportação em streaming (uma linha JSON por tracking)
+        if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+            return catalog_headers(Response(PRODUTOS_MAP.iter_ndjson(), mimetype='application/x-ndjson'))
+
+        _, items = PRODUTOS_MAP.snapshot()
+        return catalog_headers(jsonify(items))
     
     elif request.method == 'POST':
         try:
             data = request.get_json()
-            if data:
-                PRODUTOS_MAP.update(data)
-                return jsonify({'success': True, 'message': 'Produtos atualizados'})
-            else:
+            if not data or not isinstance(data, dict):
                 return jsonify({'success': False, 'error': 'Dados inválidos'})
+
+            # Lote: {"upsert": {...}, "delete": [...], "if_version": N};
+            # qualquer outro objeto é o formato antigo tracking -> produtos
+            if set(data) <= {'upsert', 'delete', 'if_version'}:
+                changed, removed = PRODUTOS_MAP.apply(
+                    upserts=data.get('upsert'),
+                    deletes=data.get('delete') or [],
+                    if_version=data.get('if_version')
+                )
+            else:
+                changed, removed = PRODUTOS_MAP.apply(upserts=data)
+
+            return catalog_headers(jsonify({
+                'success': True,
+                'message': 'Produtos atualizados',
+                'version': PRODUTOS_MAP.version,
+                'alterados': changed,
+                'removidos': removed
+            }))
+        except VersionConflict as e:
+            return catalog_headers(jsonify({
+                'success': False,
+                'error': 'O catálogo foi alterado por outra sincronização',
+                'version': e.current
+            })), 409
+        except CatalogError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
 
@@ -211,11 +581,39 @@ def api_info():
         'version': '1.0',
         'endpoints': {
             '/': 'Interface principal',
-            '/upload': 'Upload de arquivos (POST)',
+            '/upload': 'Upload de arquivos (POST); o formato é detectado pelas primeiras páginas; saida=zip devolve um PDF por rastreio num ZIP',
+            '/processar-pdf': 'Manifesto Shein (POST, campo arquivo); responde com o PDF, ou com saida=zip um PDF por pedido num ZIP',
             '/demo': 'Demonstração (GET)',
-            '/download/<filename>': 'Download de arquivos processados',
-            '/produtos': 'Gerenciar produtos (GET/POST)',
+            '/download/<filename>': 'Download de arquivos processados (ETag/Range)',
+            '/outputs': 'Índice dos arquivos processados armazenados',
+            '/preview/<filename>': 'Miniatura de uma página do PDF processado (?page, ?width, ?format=webp|png)',
+            '/progress/<job_id>': 'Progresso do processamento (Server-Sent Events)',
+            '/jobs/<id>': 'Estado de um upload na fila compartilhada (SPOOL_DIR)',
+            '/produtos': 'Gerenciar produtos (GET/POST; ?since=<versão>, ?format=ndjson, lote upsert/delete)',
+            '/admin/perfis': 'Requisições perfiladas lentas recentes (?min_ms, ?limite; cabeçalho X-Profile com o PROFILE_TOKEN); /admin/perfis/<id>[/collapsed] para o perfil',
             '/api/info': 'Informações da API'
+        },
+        'formatos': [
+            {'nome': adapter.name, 'descricao': adapter.description}
+            for adapter in FORMAT_ADAPTERS
+        ],
+        'fila_compartilhada': {
+            'diretorio': spool.root if spool else None,
+            'pendentes': spool.pending_count() if spool else None
+        },
+        'memoria': {
+            'medicao': MEMORY_TRACKING,
+            'orcamento_mb': MEMORY_BUDGET // MB or None
+        },
+        'perfis': {
+            'amostragem': profiling.PROFILE_SAMPLE_RATE,
+            'cabecalho': profiling.PROFILE_HEADER,
+            'lentas_ms': profiling.PROFILE_SLOW_MS
+        },
+        'admissao': {
+            '/upload': upload_admission.stats(),
+            '/processar-pdf': shein.admission.stats(),
+            '/demo': demo_admission.stats()
         }
     })
 
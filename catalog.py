@@ -0,0 +1,177 @@
+# catalog.py
+"""Catálogo de produtos (tracking -> itens) com versão e feed de alterações.
+
+Cada alteração efetiva (inclusão, troca de itens ou remoção) incrementa a
+versão do catálogo. O log de alterações fica ordenado pela versão, então
+changes_since(v) percorre apenas o que mudou depois de v; remoções ficam
+registradas como tombstones (limitados) para que clientes de sincronização
+saibam o que apagar.
+"""
+import json
+import uuid
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tracking_index import TrackingIndex
+
+Produtos = List[Dict[str, Any]]
+
+
+class CatalogError(ValueError):
+    """Dados inválidos enviados ao catálogo."""
+
+
+class VersionConflict(Exception):
+    """A versão esperada pelo cliente não é a atual."""
+
+    def __init__(self, expected: int, current: int):
+        super().__init__(f"Versão esperada {expected}, atual {current}")
+        self.expected = expected
+        self.current = current
+
+
+def validate_produtos(tracking: Any, produtos: Any) -> Produtos:
+    if not isinstance(tracking, str) or not tracking.strip():
+        raise CatalogError(f"Código de rastreio inválido: {tracking!r}")
+    if not isinstance(produtos, list) or not all(isinstance(p, dict) for p in produtos):
+        raise CatalogError(f"Produtos de {tracking} devem ser uma lista de objetos")
+    # Cópia própria: os itens guardados nunca são alterados no lugar, então
+    # snapshots podem compartilhá-los sem lock
+    return [dict(p) for p in produtos]
+
+
+class ProductCatalog(Mapping):
+    """Mapa de produtos seguro entre threads, com versão, ETag e delta."""
+
+    def __init__(self, initial: Optional[Dict[str, Produtos]] = None, max_tombstones: int = 10000):
+        self.max_tombstones = max_tombstones
+        # Identifica esta instância: versões de outra execução não são comparáveis
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._items: Dict[str, Produtos] = {}
+        # chave -> versão da última alteração, em ordem crescente de versão
+        self._log: "OrderedDict[str, int]" = OrderedDict()
+        self._tombstones: "OrderedDict[str, int]" = OrderedDict()
+        # Deltas a partir de versões menores que esta não estão completos
+        self._floor = 0
+        self._lock = threading.RLock()
+        self._index: Optional[TrackingIndex] = None
+        self._index_version = -1
+        if initial:
+            self.apply(upserts=initial)
+
+    # Mapping (usado pelo processor como dicionário comum)
+    def __getitem__(self, tracking: str) -> Produtos:
+        with self._lock:
+            return self._items[tracking]
+
+    def __contains__(self, tracking: object) -> bool:
+        with self._lock:
+            return tracking in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._items))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    @property
+    def etag(self) -> str:
+        return f"{self.epoch}-{self.version}"
+
+    def _touch(self, tracking: str) -> None:
+        # Chamado com o lock adquirido
+        self.version += 1
+        self._log[tracking] = self.version
+        self._log.move_to_end(tracking)
+
+    def apply(self, upserts: Optional[Dict[str, Any]] = None, deletes: Iterable[str] = (),
+              if_version: Optional[int] = None) -> Tuple[int, int]:
+        """Aplica um lote de inclusões/alterações e remoções de forma atômica.
+
+        Itens idênticos aos atuais não contam como alteração. Retorna
+        (alterados, removidos).
+        """
+        upserts = upserts or {}
+        if not isinstance(upserts, dict):
+            raise CatalogError("'upsert' deve ser um objeto tracking -> produtos")
+        if isinstance(deletes, (str, bytes)) or not isinstance(deletes, (list, tuple, set)):
+            raise CatalogError("'delete' deve ser uma lista de códigos de rastreio")
+        validated = {k: validate_produtos(k, v) for k, v in upserts.items()}
+
+        with self._lock:
+            if if_version is not None and if_version != self.version:
+                raise VersionConflict(if_version, self.version)
+            changed = removed = 0
+            for tracking, produtos in validated.items():
+                if self._items.get(tracking) == produtos:
+                    continue
+                self._items[tracking] = produtos
+                self._tombstones.pop(tracking, None)
+                self._touch(tracking)
+                changed += 1
+            for tracking in deletes:
+                if tracking not in self._items:
+                    continue
+                del self._items[tracking]
+                self._touch(tracking)
+                self._tombstones[tracking] = self.version
+                removed += 1
+            while len(self._tombstones) > self.max_tombstones:
+                tracking, version = self._tombstones.popitem(last=False)
+                self._log.pop(tracking, None)
+                self._floor = max(self._floor, version)
+            return changed, removed
+
+    def tracking_index(self) -> TrackingIndex:
+        """Índice para resolver códigos lidos por OCR; refeito só quando a versão muda.
+
+        O índice é montado fora do lock (a partir de uma cópia das chaves), para
+        não bloquear as consultas ao catálogo, e só substitui o atual se o
+        catálogo não mudou nesse meio tempo.
+        """
+        with self._lock:
+            if self._index is not None and self._index_version == self.version:
+                return self._index
+            version, keys = self.version, list(self._items)
+        index = TrackingIndex(keys)
+        with self._lock:
+            if self.version == version:
+                self._index, self._index_version = index, version
+        return index
+
+    def snapshot(self) -> Tuple[int, Dict[str, Produtos]]:
+        with self._lock:
+            return self.version, dict(self._items)
+
+    def changes_since(self, since: int) -> Dict[str, Any]:
+        """Alterações posteriores à versão since.
+
+        Se since não puder ser atendido por delta (anterior ao histórico
+        guardado ou de outra execução) o catálogo inteiro é enviado com full=True.
+        """
+        with self._lock:
+            if since < self._floor or since > self.version:
+                return {'version': self.version, 'since': since, 'full': True,
+                        'upsert': dict(self._items), 'delete': []}
+            upserts: Dict[str, Produtos] = {}
+            deletes: List[str] = []
+            for tracking in reversed(self._log):
+                if self._log[tracking] <= since:
+                    break
+                if tracking in self._items:
+                    upserts[tracking] = self._items[tracking]
+                else:
+                    deletes.append(tracking)
+            return {'version': self.version, 'since': since, 'full': False,
+                    'upsert': upserts, 'delete': deletes}
+
+    def iter_ndjson(self) -> Iterator[str]:
+        """Exportação linha a linha ({"tracking", "produtos"}) de um snapshot."""
+        _, items = self.snapshot()
+        for tracking, produtos in items.items():
+            yield json.dumps({'tracking': tracking, 'produtos': produtos}, ensure_ascii=False) + "\n"
@@ -0,0 +1,109 @@
+# deadline.py
+"""Prazo por requisição e orçamento de tempo por etapa do pipeline.
+
+Um upload patológico (muitas páginas digitalizadas, OCR duas vezes, leitura de
+códigos de barras em todas as páginas) podia rodar por minutos. Com um prazo,
+as etapas caras são reduzidas numa ordem definida conforme o tempo acaba:
+
+1. a leitura de códigos de barras é pulada (as chaves do texto continuam valendo);
+2. as páginas passam a ser rasterizadas na resolução mínima;
+3. o OCR para nas páginas restantes.
+
+A composição do PDF nunca é pulada: uma fração do prazo fica reservada para
+ela, e o resultado parcial continua válido e diz o que foi pulado.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+# Prazo padrão de processamento por requisição em segundos (0 = sem prazo)
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 60))
+# Orçamento de cada etapa cara, como fração do prazo total
+STAGE_BUDGETS = {'ocr': 0.6, 'ocr_rastreio': 0.3, 'codigos_barras': 0.2}
+# Fração do prazo restante abaixo da qual cada redução entra (na ordem acima)
+DEGRADE_AT = {'codigos_barras': 0.5, 'dpi': 0.35}
+# Fração do prazo reservada para a composição
+COMPOSE_RESERVE = 0.15
+
+
+class Deadline:
+    """Relógio de uma requisição: tempo restante, orçamento por etapa e degradações aplicadas."""
+
+    def __init__(self, seconds: float, budgets: Optional[Dict[str, float]] = None):
+        self.seconds = seconds
+        self.budgets = {name: share * seconds for name, share in (budgets or STAGE_BUDGETS).items()}
+        self.reserve = COMPOSE_RESERVE * seconds
+        self.started = time.monotonic()
+        self.stages: Dict[str, float] = {}
+        self.degradations: List[Dict[str, str]] = []
+        self._stage_started: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        """Segundos até o prazo, descontada a reserva da composição."""
+        return self.seconds - self.reserve - self.elapsed()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mede a etapa e inicia o relógio do seu orçamento."""
+        started = time.monotonic()
+        self._stage_started[name] = started
+        try:
+            yield self
+        finally:
+            self.stages[name] = round(self.stages.get(name, 0.0) + time.monotonic() - started, 3)
+
+    def budget_left(self, name: str) -> float:
+        """Segundos que a etapa ainda pode usar: o menor entre seu orçamento e o prazo."""
+        left = self.remaining()
+        budget = self.budgets.get(name)
+        if budget is not None:
+            started = self._stage_started.get(name, time.monotonic())
+            left = min(left, budget - (time.monotonic() - started))
+        return left
+
+    def over(self, name: str) -> bool:
+        return self.budget_left(name) <= 0
+
+    def degraded(self, step: str) -> bool:
+        """True se o tempo restante já está abaixo do limiar da redução step."""
+        if self.expired():
+            return True
+        return self.remaining() < DEGRADE_AT[step] * (self.seconds - self.reserve)
+
+    def note(self, stage: str, action: str) -> None:
+        """Registra uma etapa pulada ou reduzida (uma vez por ação)."""
+        entry = {'etapa': stage, 'acao': action}
+        with self._lock:
+            if entry in self.degradations:
+                return
+            self.degradations.append(entry)
+        print(f"Prazo: {stage}: {action} ({self.elapsed():.1f}s de {self.seconds:.0f}s)")
+
+    def report(self) -> Dict[str, Any]:
+        """Resumo para o JSON de resposta."""
+        return {
+            'prazo_s': self.seconds,
+            'decorrido_s': round(self.elapsed(), 3),
+            'etapas': self.stages,
+            'degradacoes': self.degradations,
+            'parcial': bool(self.degradations),
+        }
+
+
+def deadline_from_env() -> Optional[Deadline]:
+    """Deadline com o prazo configurado, ou None se REQUEST_DEADLINE=0."""
+    return Deadline(REQUEST_DEADLINE) if REQUEST_DEADLINE > 0 else None
+
+
+def timed(deadline: Optional[Deadline], name: str):
+    """Contexto de medição da etapa, ou um contexto vazio sem prazo."""
+    return deadline.stage(name) if deadline is not None else nullcontext()
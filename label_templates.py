@@ -0,0 +1,209 @@
+# label_templates.py
+"""Templates pré-compilados para as partes desenhadas das etiquetas.
+
+Cada perfil de saída cria seus templates uma única vez (no import do módulo):
+fontes, estilos, geometria das colunas e as partes fixas (como o cabeçalho da
+tabela) já viram operadores PDF prontos. Por pedido só são formatados os
+campos variáveis, e o resultado vai para a página em um único stream de
+conteúdo via LabelWriter.add_content.
+
+As coordenadas recebidas seguem o PyMuPDF (origem no topo, y para baixo);
+a conversão para o sistema do PDF é feita aqui com a altura da página.
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import fitz
+
+from pdf_writer import code128_modules, PRETO
+
+
+def _n(v: float) -> str:
+    return f"{v:.3f}".rstrip("0").rstrip(".")
+
+
+def _color(rgb: Sequence[float]) -> str:
+    return " ".join(_n(c) for c in rgb)
+
+
+def pdf_string(text: str) -> str:
+    """Literal de string PDF (fontes base-14 com WinAnsiEncoding)."""
+    raw = str(text).encode("cp1252", errors="replace").decode("latin-1")
+    return "(" + raw.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+@lru_cache(maxsize=8192)
+def text_width(text: str, fontname: str, fontsize: float) -> float:
+    return fitz.get_text_length(text, fontname=fontname, fontsize=fontsize)
+
+
+@lru_cache(maxsize=4096)
+def wrap_text(text: str, width: float, fontname: str, fontsize: float) -> Tuple[str, ...]:
+    """Quebra o texto em linhas que cabem na largura dada (respeita '\\n').
+
+    Resultado em cache: títulos e atributos se repetem muito entre pedidos.
+    """
+    lines = []
+    for paragraph in str(text).split("\n"):
+        current = ""
+        for word in paragraph.split():
+            candidate = f"{current} {word}" if current else word
+            if text_width(candidate, fontname, fontsize) <= width:
+                current = candidate
+                continue
+            if current:
+                lines.append(current)
+            # Palavra maior que a coluna: quebrar por caracteres
+            while text_width(word, fontname, fontsize) > width and len(word) > 1:
+                cut = len(word) - 1
+                while cut > 1 and text_width(word[:cut], fontname, fontsize) > width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            current = word
+        lines.append(current)
+    return tuple(lines)
+
+
+def text_ops(x: float, y: float, text: str, fontname: str, fontsize: float, rotate: int = 0) -> str:
+    """Operadores para um texto com a linha de base em (x, y) no sistema do PDF."""
+    if rotate == 90:
+        matrix = f"0 1 -1 0 {_n(x)} {_n(y)}"
+    else:
+        matrix = f"1 0 0 1 {_n(x)} {_n(y)}"
+    return f"BT /{fontname} {_n(fontsize)} Tf {matrix} Tm {pdf_string(text)} Tj ET"
+
+
+class TableTemplate:
+    """Tabela com estilo e colunas fixos; opcionalmente com cabeçalho estático.
+
+    O cabeçalho é compilado uma vez em coordenadas locais (origem no canto
+    superior esquerdo da tabela) e reaproveitado em todas as páginas.
+    """
+
+    def __init__(self, col_widths: Sequence[float], style: Dict[str, Any],
+                 header: Optional[Sequence[str]] = None):
+        self.col_widths = list(col_widths)
+        self.total_width = sum(self.col_widths)
+        self.col_x = [sum(self.col_widths[:i]) for i in range(len(self.col_widths))]
+        self.pad_l, self.pad_r, self.pad_t, self.pad_b = style["padding"]
+        self.inner_widths = [w - self.pad_l - self.pad_r for w in self.col_widths]
+        self.grid = style["grid"]
+        self.min_row_height = style["min_row_height"]
+        self.backgrounds = style["row_backgrounds"] or [None]
+        self.aligns = style["aligns"] or ["LEFT"] * len(self.col_widths)
+        self.font = (style["fontname"], style["fontsize"], style["leading"] or style["fontsize"] * 1.2)
+
+        self.header_height = 0.0
+        self.header_ops = ""
+        if header is not None:
+            header_font = (style["header_fontname"], style["header_fontsize"],
+                           style["leading"] or style["header_fontsize"] * 1.2)
+            height, cells = self._measure_row(header, header_font)
+            self.header_height = height
+            self.header_ops = self._row_ops(0.0, height, cells, header_font,
+                                            [style["header_align"]] * len(self.col_widths),
+                                            style["header_background"])
+
+    def _measure_row(self, row: Sequence[Any], font: Tuple[str, float, float]):
+        fontname, fontsize, leading = font
+        cells = [wrap_text(str(cell), w, fontname, fontsize) for cell, w in zip(row, self.inner_widths)]
+        height = max(len(c) for c in cells) * leading + self.pad_t + self.pad_b
+        return max(height, self.min_row_height), cells
+
+    def measure(self, rows: Sequence[Sequence[Any]]) -> List[Tuple[float, Tuple[Tuple[str, ...], ...]]]:
+        """Layout das linhas de dados: [(altura, linhas quebradas de cada célula)]."""
+        return [self._measure_row(row, self.font) for row in rows]
+
+    def height(self, layout) -> float:
+        return self.header_height + sum(h for h, _ in layout)
+
+    def _row_ops(self, top: float, height: float, cells, font, aligns, fill) -> str:
+        # top é a distância (positiva) do topo da tabela até o topo da linha
+        fontname, fontsize, leading = font
+        ops = []
+        if fill:
+            ops.append(f"{_color(fill)} rg 0 {_n(-top - height)} {_n(self.total_width)} {_n(height)} re f")
+        ops.append(f"{_color(PRETO)} rg")
+        for c, lines in enumerate(cells):
+            baseline = top + self.pad_t + fontsize
+            for line in lines:
+                if line:
+                    tx = self.col_x[c] + self.pad_l
+                    if aligns[c] != "LEFT":
+                        free = self.inner_widths[c] - text_width(line, fontname, fontsize)
+                        tx += free / 2 if aligns[c] == "CENTER" else free
+                    ops.append(text_ops(tx, -baseline, line, fontname, fontsize))
+                baseline += leading
+        return "\n".join(ops)
+
+    def render(self, x: float, top: float, page_height: float, layout) -> bytes:
+        """Operadores da tabela com o canto superior esquerdo em (x, top) da página."""
+        ops = [f"q 1 0 0 1 {_n(x)} {_n(page_height - top)} cm"]
+        if self.header_ops:
+            ops.append(self.header_ops)
+        y = self.header_height
+        for i, (height, cells) in enumerate(layout):
+            fill = self.backgrounds[i % len(self.backgrounds)]
+            ops.append(self._row_ops(y, height, cells, self.font, self.aligns, fill))
+            y += height
+
+        if self.grid:
+            bottom = -y
+            lines = [f"0 0 m {_n(self.total_width)} 0 l"]
+            row_y = self.header_height
+            if self.header_ops:
+                lines.append(f"0 {_n(-row_y)} m {_n(self.total_width)} {_n(-row_y)} l")
+            for height, _ in layout:
+                row_y += height
+                lines.append(f"0 {_n(-row_y)} m {_n(self.total_width)} {_n(-row_y)} l")
+            for cx in self.col_x + [self.total_width]:
+                lines.append(f"{_n(cx)} 0 m {_n(cx)} {_n(bottom)} l")
+            ops.append(f"{_color(PRETO)} RG {_n(self.grid)} w " + " ".join(lines) + " S")
+        ops.append("Q")
+        return "\n".join(ops).encode("latin-1")
+
+
+class BarcodeTemplate:
+    """Code128 em posição fixa da página.
+
+    Com module_width as barras têm largura fixa e partem da base (vertical) ou
+    da esquerda do retângulo; sem ele o código é esticado para ocupar o retângulo.
+    """
+
+    def __init__(self, rect: fitz.Rect, page_height: float, vertical: bool = True,
+                 quiet_modules: int = 10, module_width: Optional[float] = None):
+        self.rect = fitz.Rect(rect)
+        self.vertical = vertical
+        self.quiet = quiet_modules
+        self.module_width = module_width
+        # Retângulo no sistema do PDF
+        self.x0, self.x1 = self.rect.x0, self.rect.x1
+        self.y0, self.y1 = page_height - self.rect.y1, page_height - self.rect.y0
+
+    def render(self, value: str) -> bytes:
+        if not value:
+            return b""
+        modules = code128_modules(value)
+        total = len(modules) + 2 * self.quiet
+        length = self.rect.height if self.vertical else self.rect.width
+        unit = self.module_width or length / total
+
+        ops = [f"{_color(PRETO)} rg"]
+        i = 0
+        while i < len(modules):
+            if modules[i] != "1":
+                i += 1
+                continue
+            start = i
+            while i < len(modules) and modules[i] == "1":
+                i += 1
+            a = (self.quiet + start) * unit
+            size = (i - start) * unit
+            if self.vertical:
+                # Leitura de baixo para cima a partir da base do retângulo
+                ops.append(f"{_n(self.x0)} {_n(self.y0 + a)} {_n(self.x1 - self.x0)} {_n(size)} re")
+            else:
+                ops.append(f"{_n(self.x0 + a)} {_n(self.y0)} {_n(size)} {_n(self.y1 - self.y0)} re")
+        ops.append("f")
+        return "\n".join(ops).encode("latin-1")
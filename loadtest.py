@@ -0,0 +1,540 @@
+# loadtest.py
+"""Teste de carga local dos endpoints de upload.
+
+Gera arquivos sintéticos (PDF com texto, PDF digitalizado, imagem e manifesto
+Shein), sobe o serviço num subprocesso (ou usa um já em execução com --url) e
+reenvia uma mistura configurável desses arquivos com concorrência fixa ou taxa
+de chegada controlada. Ao final mostra vazão, latências p50/p95/p99, erros por
+tipo e o uso de CPU e memória do servidor (incluindo processos filhos).
+
+Roda sem rede externa e só com a biblioteca padrão do lado do cliente:
+
+    python loadtest.py run --mix texto=6,imagem=2,digitalizado=1,shein=1 \\
+        --concurrency 8 --duration 60
+    python loadtest.py run --rate 4 --requests 200 --json resultado.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MB = 1024 * 1024
+
+# Tipo de carga -> (endpoint, campo do arquivo)
+ENDPOINTS = {
+    'texto': ('/upload', 'file'),
+    'digitalizado': ('/upload', 'file'),
+    'imagem': ('/upload', 'file'),
+    'shein': ('/processar-pdf', 'arquivo'),
+}
+
+
+# ------------------ ARQUIVOS SINTÉTICOS ------------------
+
+def _tracking(i: int) -> str:
+    from validators import s10_check_digit
+    serial = f"{(10000000 + i * 7919) % 100000000:08d}"
+    return f"AM{serial}{s10_check_digit(serial)}BR"
+
+
+def _chave(i: int) -> str:
+    from validators import nfe_check_digit
+    base = f"3523091234567800019055001{i:09d}1{i:08d}"[:43]
+    return base + str(nfe_check_digit(base))
+
+
+def make_text_pdf(path: str, labels: int, seed: int = 0) -> None:
+    """Etiquetas Mercado Livre com camada de texto e uma DANFE ao final."""
+    import fitz
+    doc = fitz.open()
+    for i in range(labels):
+        page = doc.new_page(width=288, height=432)
+        page.insert_text((20, 40), "Mercado Livre Envios")
+        page.insert_text((20, 70), f"Rastreamento: {_tracking(seed + i)}")
+        page.insert_text((20, 100), "Destinatário:")
+        page.insert_text((20, 115), f"Cliente {seed + i}")
+        page.draw_rect(fitz.Rect(20, 150, 260, 250))
+    page = doc.new_page()
+    page.insert_text((40, 40), "DANFE SIMPLIFICADO - ETIQUETA")
+    page.insert_text((40, 100), "CHAVE DE ACESSO")
+    page.insert_text((40, 115), _chave(seed))
+    doc.save(path)
+    doc.close()
+
+
+def _label_image(i: int):
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (800, 1200), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([20, 20, 780, 1180], outline="black", width=3)
+    for line, text in enumerate(["Mercado Livre Envios", f"Rastreamento: {_tracking(i)}",
+                                 "Destinatário:", f"Cliente {i}"]):
+        draw.text((60, 80 + 60 * line), text, fill="black")
+    return image
+
+
+def make_image(path: str, seed: int = 0) -> None:
+    """Foto de etiqueta (JPEG) levemente inclinada."""
+    image = _label_image(seed).rotate(2.5, expand=True, fillcolor="white")
+    image.save(path, "JPEG", quality=85)
+
+
+def make_scanned_pdf(path: str, labels: int, seed: int = 0) -> None:
+    """PDF só com imagens (sem texto), como sai de um scanner."""
+    import fitz
+    doc = fitz.open()
+    for i in range(labels):
+        buf = io.BytesIO()
+        _label_image(seed + i).save(buf, "JPEG", quality=80)
+        page = doc.new_page(width=288, height=432)
+        page.insert_image(page.rect, stream=buf.getvalue())
+    doc.save(path)
+    doc.close()
+
+
+def make_shein_manifest(path: str, orders: int, seed: int = 0) -> None:
+    """Manifesto Shein: etiqueta (imagem) seguida da DANFE simplificada com itens."""
+    import fitz
+    doc = fitz.open()
+    for i in range(orders):
+        buf = io.BytesIO()
+        _label_image(seed + i).resize((400, 600)).save(buf, "PNG")
+        page = doc.new_page(width=400, height=600)
+        page.insert_image(page.rect, stream=buf.getvalue())
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((40, 40), "DANFE SIMPLIFICADO")
+        page.insert_text((40, 60), "CHAVE DE ACESSO")
+        page.insert_text((40, 75), _chave(seed + i))
+        for x, header in [(40, "ITEM"), (120, "CONTEÚDO"), (380, "ATRIBUTOS"), (520, "QUANT.")]:
+            page.insert_text((x, 120), header)
+        for j in range(3):
+            y = 150 + 30 * j
+            page.insert_text((40, y), f"SKU{i}-{j}")
+            page.insert_text((120, y), f"Blusa feminina modelo {j}")
+            page.insert_text((380, y), "Cor: Preto")
+            page.insert_text((520, y), str(1 + j % 3))
+    doc.save(path)
+    doc.close()
+
+
+def build_corpus(folder: str, variants: int, labels: int, orders: int) -> Dict[str, List[str]]:
+    """Algumas variações de cada tipo, reaproveitadas durante o teste."""
+    corpus = defaultdict(list)
+    for v in range(variants):
+        seed = v * 1000
+        path = os.path.join(folder, f"texto_{v}.pdf")
+        make_text_pdf(path, labels, seed)
+        corpus['texto'].append(path)
+        path = os.path.join(folder, f"digitalizado_{v}.pdf")
+        make_scanned_pdf(path, labels, seed)
+        corpus['digitalizado'].append(path)
+        path = os.path.join(folder, f"imagem_{v}.jpg")
+        make_image(path, seed)
+        corpus['imagem'].append(path)
+        path = os.path.join(folder, f"shein_{v}.pdf")
+        make_shein_manifest(path, orders, seed)
+        corpus['shein'].append(path)
+    return corpus
+
+
+# ------------------ SERVIDOR ------------------
+
+def serve(app_module: str, port: int) -> None:
+    """Roda o app Flask num servidor com threads (sem reloader/debug)."""
+    sys.path.insert(0, HERE)
+    from werkzeug.serving import make_server
+    module = __import__(app_module)
+    server = make_server('127.0.0.1', port, module.app, threaded=True)
+    print(f"Servidor de teste em http://127.0.0.1:{port} ({app_module})", flush=True)
+    server.serve_forever()
+
+
+def start_server(app_module: str, port: int, workdir: str, timeout: float = 60) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=HERE + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve',
+                             '--app', app_module, '--port', str(port)], cwd=workdir, env=env)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Servidor terminou ao iniciar (código {proc.returncode})")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return proc
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.25)
+    proc.terminate()
+    raise RuntimeError(f"Servidor não respondeu em {timeout:.0f}s")
+
+
+def stop_server(proc: subprocess.Popen) -> None:
+    """Encerra o servidor e os processos dos pools dele."""
+    children = _proc_tree(proc.pid)[1:]
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    for pid in children:
+        try:
+            os.kill(pid, 15)
+        except OSError:
+            pass
+
+
+def _proc_tree(pid: int) -> List[int]:
+    """pid e descendentes (pools de processos do servidor)."""
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            return [pid] + [child.pid for child in root.children(recursive=True)]
+        except psutil.Error:
+            return []
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                pass
+    tree, frontier = [pid], [pid]
+    while frontier:
+        frontier = [child for child, parent in parents.items() if parent in frontier]
+        tree.extend(frontier)
+    return tree
+
+
+def _proc_usage(pid: int) -> Tuple[float, int]:
+    """(segundos de CPU, RSS em bytes) de um processo."""
+    if psutil is not None:
+        try:
+            p = psutil.Process(pid)
+            cpu = p.cpu_times()
+            return cpu.user + cpu.system, p.memory_info().rss
+        except psutil.Error:
+            return 0.0, 0
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu, rss
+    except (OSError, ValueError, IndexError):
+        return 0.0, 0
+
+
+class ResourceSampler:
+    """Amostra CPU e RSS do servidor (e filhos) durante o teste."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._cpu: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-sampler', daemon=True)
+
+    def _sample(self) -> None:
+        total_rss = 0
+        for pid in _proc_tree(self.pid):
+            cpu, rss = _proc_usage(pid)
+            # Processos que terminaram mantêm a última leitura
+            self._cpu[pid] = max(self._cpu.get(pid, 0.0), cpu)
+            total_rss += rss
+        self.peak_rss = max(self.peak_rss, total_rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._sample()
+        self._start_cpu = sum(self._cpu.values())
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        elapsed = time.perf_counter() - self._started
+        cpu = sum(self._cpu.values()) - self._start_cpu
+        return {
+            'cpu_segundos': round(cpu, 1),
+            'cpu_media_pct': round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+            'rss_pico_mb': round(self.peak_rss / MB, 1),
+            'processos': len(self._cpu),
+        }
+
+
+# ------------------ CLIENTE ------------------
+
+def _multipart(field: str, path: str) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        content = f.read()
+    job_id = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"job_id\"\r\n\r\n{job_id}\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+        f"filename=\"{os.path.basename(path)}\"\r\nContent-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def send(base_url: str, kind: str, path: str, timeout: float) -> Dict[str, Any]:
+    """Um upload; retorna tipo, status, resultado ('ok', 'recusado', 'erro') e latência."""
+    endpoint, field = ENDPOINTS[kind]
+    body, content_type = _multipart(field, path)
+    request = urllib.request.Request(base_url + endpoint, data=body, method='POST',
+                                     headers={'Content-Type': content_type})
+    started = time.perf_counter()
+    status, outcome, detail = 0, 'erro', ''
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+            data = response.read()
+            outcome = 'ok'
+            if response.headers.get_content_type() == 'application/json':
+                payload = json.loads(data or b'{}')
+                if payload.get('success') is False:
+                    outcome, detail = 'erro', str(payload.get('error', ''))[:120]
+    except urllib.error.HTTPError as e:
+        status = e.code
+        outcome = 'recusado' if e.code in (429, 503) else 'erro'
+        detail = e.read()[:120].decode('utf-8', 'replace')
+    except (urllib.error.URLError, OSError) as e:
+        detail = str(e)[:120]
+    return {'tipo': kind, 'status': status, 'resultado': outcome,
+            'latencia': time.perf_counter() - started, 'detalhe': detail}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in ENDPOINTS:
+            raise SystemExit(f"Tipo desconhecido na mistura: {kind} (use {', '.join(ENDPOINTS)})")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def run_load(base_url: str, corpus: Dict[str, List[str]], mix: Dict[str, float],
+             concurrency: int, rate: float, requests: int, duration: float,
+             timeout: float, seed: int = 0) -> Tuple[List[Dict[str, Any]], float]:
+    """Envia uploads até atingir requests ou duration.
+
+    Sem rate, cada um dos concurrency clientes envia o próximo assim que recebe
+    a resposta (carga fechada). Com rate, as chegadas seguem um processo de
+    Poisson com essa taxa média por segundo, limitadas a concurrency em voo.
+    """
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    results: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    issued = [0]
+
+    def next_job() -> Optional[Tuple[str, str]]:
+        with lock:
+            if requests and issued[0] >= requests:
+                return None
+            if duration and time.perf_counter() - started >= duration:
+                return None
+            issued[0] += 1
+            kind = rng.choices(kinds, weights)[0]
+            return kind, rng.choice(corpus[kind])
+
+    def record(result: Dict[str, Any]) -> None:
+        with lock:
+            results.append(result)
+
+    if not rate:
+        def client():
+            while True:
+                job = next_job()
+                if job is None:
+                    return
+                record(send(base_url, job[0], job[1], timeout))
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            in_flight = threading.BoundedSemaphore(concurrency)
+            next_arrival = time.perf_counter()
+            while True:
+                job = next_job()
+                if job is None:
+                    break
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                next_arrival += rng.expovariate(rate)
+                in_flight.acquire()
+
+                def task(job=job):
+                    try:
+                        record(send(base_url, job[0], job[1], timeout))
+                    finally:
+                        in_flight.release()
+
+                pool.submit(task)
+    return results, time.perf_counter() - started
+
+
+# ------------------ RELATÓRIO ------------------
+
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por posição (nearest-rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    def stats(items):
+        ok = [r['latencia'] for r in items if r['resultado'] == 'ok']
+        all_latencies = [r['latencia'] for r in items]
+        statuses = defaultdict(int)
+        for r in items:
+            statuses[str(r['status'])] += 1
+        return {
+            'requisicoes': len(items),
+            'ok': len(ok),
+            'recusadas': sum(1 for r in items if r['resultado'] == 'recusado'),
+            'erros': sum(1 for r in items if r['resultado'] == 'erro'),
+            'taxa_erro_pct': round(100 * (len(items) - len(ok)) / len(items), 1) if items else 0.0,
+            'vazao_rps': round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            'p50_s': round(percentile(all_latencies, 50), 3),
+            'p95_s': round(percentile(all_latencies, 95), 3),
+            'p99_s': round(percentile(all_latencies, 99), 3),
+            'status': dict(statuses),
+        }
+
+    by_kind = defaultdict(list)
+    for r in results:
+        by_kind[r['tipo']].append(r)
+    errors = defaultdict(int)
+    for r in results:
+        if r['resultado'] != 'ok' and r['detalhe']:
+            errors[f"{r['tipo']}: {r['detalhe']}"] += 1
+    return {
+        'duracao_s': round(elapsed, 1),
+        'total': stats(results),
+        'por_tipo': {kind: stats(items) for kind, items in sorted(by_kind.items())},
+        'erros_mais_comuns': dict(sorted(errors.items(), key=lambda e: -e[1])[:5]),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nDuração: {report['duracao_s']}s")
+    header = f"{'tipo':<14}{'req':>6}{'ok':>6}{'429/503':>9}{'erros':>7}{'rps':>8}{'p50':>8}{'p95':>8}{'p99':>8}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report['por_tipo'].items()) + [('TOTAL', report['total'])]
+    for kind, s in rows:
+        print(f"{kind:<14}{s['requisicoes']:>6}{s['ok']:>6}{s['recusadas']:>9}{s['erros']:>7}"
+              f"{s['vazao_rps']:>8}{s['p50_s']:>8}{s['p95_s']:>8}{s['p99_s']:>8}")
+    if report.get('servidor'):
+        srv = report['servidor']
+        print(f"\nServidor: CPU média {srv['cpu_media_pct']}% ({srv['cpu_segundos']}s), "
+              f"RSS pico {srv['rss_pico_mb']} MB em {srv['processos']} processo(s)")
+    if report['erros_mais_comuns']:
+        print("\nErros mais comuns:")
+        for detail, count in report['erros_mais_comuns'].items():
+            print(f"  {count:>5}  {detail}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Teste de carga local dos endpoints de upload')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    p_serve = sub.add_parser('serve', help='roda o servidor de teste (usado pelo run)')
+    p_serve.add_argument('--app', default='app_web', choices=['app_web', 'shein'])
+    p_serve.add_argument('--port', type=int, default=5050)
+
+    p_run = sub.add_parser('run', help='gera os arquivos e executa o teste')
+    p_run.add_argument('--url', help='servidor já em execução (senão um é iniciado)')
+    p_run.add_argument('--app', default='app_web', choices=['app_web', 'shein'])
+    p_run.add_argument('--port', type=int, default=5050)
+    p_run.add_argument('--mix', default='texto=6,imagem=2,digitalizado=1,shein=1',
+                       help='tipo=peso separados por vírgula (texto, digitalizado, imagem, shein)')
+    p_run.add_argument('--concurrency', type=int, default=4, help='clientes simultâneos / limite em voo')
+    p_run.add_argument('--rate', type=float, default=0, help='chegadas por segundo (0 = carga fechada)')
+    p_run.add_argument('--requests', type=int, default=0, help='total de uploads (0 = usar --duration)')
+    p_run.add_argument('--duration', type=float, default=30, help='segundos de teste')
+    p_run.add_argument('--timeout', type=float, default=300)
+    p_run.add_argument('--labels', type=int, default=3, help='etiquetas por PDF de Mercado Livre')
+    p_run.add_argument('--orders', type=int, default=20, help='pedidos por manifesto Shein')
+    p_run.add_argument('--variants', type=int, default=3, help='variações geradas de cada tipo')
+    p_run.add_argument('--seed', type=int, default=0)
+    p_run.add_argument('--json', help='grava o relatório completo neste arquivo')
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        serve(args.app, args.port)
+        return
+
+    if args.app == 'shein':
+        # O app do shein só atende /processar-pdf
+        for kind in ('texto', 'digitalizado', 'imagem'):
+            ENDPOINTS[kind] = ('/processar-pdf', 'arquivo')
+    sys.path.insert(0, HERE)
+    mix = parse_mix(args.mix)
+    duration = 0 if args.requests else args.duration
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as workdir:
+        print("Gerando arquivos sintéticos...")
+        corpus = build_corpus(workdir, args.variants, args.labels, args.orders)
+        server = None
+        base_url = (args.url or '').rstrip('/')
+        if not base_url:
+            server = start_server(args.app, args.port, workdir)
+            base_url = f"http://127.0.0.1:{args.port}"
+        sampler = ResourceSampler(server.pid) if server is not None else None
+        try:
+            if sampler:
+                sampler.start()
+            print(f"Carga: {args.mix} contra {base_url} "
+                  f"({'taxa ' + str(args.rate) + '/s, ' if args.rate else ''}concorrência {args.concurrency})")
+            results, elapsed = run_load(base_url, corpus, mix, args.concurrency, args.rate,
+                                        args.requests, duration, args.timeout, args.seed)
+            report = summarize(results, elapsed)
+            if sampler:
+                report['servidor'] = sampler.stop()
+        finally:
+            if server is not None:
+                stop_server(server)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
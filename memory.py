@@ -0,0 +1,177 @@
+# memory.py
+"""Contabilidade de memória por requisição e orçamento de pico.
+
+MemoryTracker mede, por etapa do pipeline, o RSS do processo (atual e pico,
+amostrado numa thread em segundo plano) e, opcionalmente, as alocações Python
+via tracemalloc. Com um orçamento definido, check() permite que o pipeline
+troque para uma estratégia mais econômica ou falhe com MemoryBudgetExceeded
+antes de o container ser morto por falta de memória.
+
+As medidas são do processo inteiro: com requisições simultâneas no mesmo
+processo elas se somam, o que é o comportamento desejado para o orçamento.
+"""
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MB = 1024 * 1024
+
+# tracemalloc é global ao processo: fica ativo enquanto algum tracker o usar
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def _tracemalloc_acquire() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _tracemalloc_release() -> None:
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+def current_rss() -> Optional[int]:
+    """RSS atual do processo em bytes (None se a plataforma não informa)."""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        # Sem RSS atual: usa o pico do processo (KB no Linux, bytes no macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """A requisição ultrapassaria o orçamento de memória configurado."""
+
+    def __init__(self, stage: str, needed: int, budget: int):
+        super().__init__(f"Orçamento de memória excedido em '{stage}': "
+                         f"{needed / MB:.0f} MB necessários, limite {budget / MB:.0f} MB")
+        self.stage = stage
+        self.needed = needed
+        self.budget = budget
+
+    def __reduce__(self):
+        # Precisa atravessar o pool de processos do shein
+        return (MemoryBudgetExceeded, (self.stage, self.needed, self.budget))
+
+
+class MemoryTracker:
+    """Medidas de memória por etapa de uma requisição, com orçamento opcional."""
+
+    def __init__(self, budget_bytes: Optional[int] = None, trace_python: bool = False,
+                 sample_interval: float = 0.05):
+        self.budget = budget_bytes or None
+        self.trace_python = trace_python
+        self.sample_interval = sample_interval
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.strategy_changes = []
+        self._peak = 0
+        self._lock = threading.Lock()
+        self._tracing = False
+
+    def _sample(self, stop: threading.Event) -> None:
+        while not stop.wait(self.sample_interval):
+            rss = current_rss() or 0
+            with self._lock:
+                self._peak = max(self._peak, rss)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Mede a etapa: RSS inicial/final/pico e, se ativo, pico de alocações Python."""
+        if self.trace_python and not self._tracing:
+            _tracemalloc_acquire()
+            self._tracing = True
+        if self._tracing:
+            tracemalloc.reset_peak()
+        start_rss = current_rss() or 0
+        with self._lock:
+            self._peak = start_rss
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stop,), name=f'mem-{name}', daemon=True)
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            stop.set()
+            sampler.join()
+            end_rss = current_rss() or 0
+            info = {
+                'rss_inicio_mb': round(start_rss / MB, 1),
+                'rss_fim_mb': round(end_rss / MB, 1),
+                'rss_pico_mb': round(max(self._peak, end_rss) / MB, 1),
+                'segundos': round(time.perf_counter() - started, 3),
+            }
+            if self._tracing:
+                info['python_pico_mb'] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+            self.stages[name] = info
+
+    def check(self, extra_bytes: int) -> bool:
+        """True se alocar extra_bytes a mais cabe no orçamento (sempre True sem orçamento)."""
+        if not self.budget:
+            return True
+        return (current_rss() or 0) + extra_bytes <= self.budget
+
+    def require(self, stage: str, extra_bytes: int) -> None:
+        """Falha de forma controlada se extra_bytes não cabem no orçamento."""
+        if not self.check(extra_bytes):
+            raise MemoryBudgetExceeded(stage, (current_rss() or 0) + extra_bytes, self.budget)
+
+    def note_strategy(self, stage: str, description: str) -> None:
+        """Registra a troca para uma estratégia mais econômica."""
+        self.strategy_changes.append({'etapa': stage, 'estrategia': description})
+        print(f"Memória: {stage}: {description}")
+
+    def close(self) -> None:
+        """Libera o tracemalloc desta requisição (idempotente)."""
+        if self._tracing:
+            _tracemalloc_release()
+            self._tracing = False
+
+    def report(self) -> Dict[str, Any]:
+        """Resumo para o JSON de resposta."""
+        self.close()
+        peak = max((s['rss_pico_mb'] for s in self.stages.values()), default=0.0)
+        return {
+            'rss_pico_mb': peak,
+            'orcamento_mb': round(self.budget / MB, 1) if self.budget else None,
+            'etapas': self.stages,
+            'estrategias': self.strategy_changes,
+        }
+
+    def log(self, label: str) -> None:
+        etapas = ", ".join(f"{name}={info['rss_pico_mb']}MB" for name, info in self.stages.items())
+        print(f"Memória [{label}]: pico por etapa: {etapas}")
+
+
+def track(memory: Optional[MemoryTracker], name: str):
+    """Contexto de medição da etapa, ou um contexto vazio sem tracker."""
+    return memory.stage(name) if memory is not None else nullcontext()
@@ -0,0 +1,105 @@
+# orientation.py
+"""Correção de orientação e inclinação de páginas antes do OCR.
+
+Etiquetas digitalizadas ou fotografadas chegam giradas (90/180/270 graus) ou
+levemente inclinadas, e o OCR dessas páginas devolve lixo. A página é
+decodificada uma única vez; as estimativas usam cópias reduzidas dela:
+
+- orientação: OSD do Tesseract (--psm 0), aceita só com confiança mínima;
+- inclinação: perfil de projeção horizontal. Com as linhas de texto na
+  horizontal, a soma de cada linha de pixels alterna entre texto e entrelinha
+  e o perfil fica mais "serrilhado"; o ângulo que maximiza essa variação é a
+  inclinação. A soma das linhas vem de um resize para 1 coluna (BOX), sem numpy.
+
+A página inteira é girada uma única vez, com a rotação e a inclinação juntas.
+"""
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from PIL import Image
+import pytesseract
+
+# Maior lado da cópia usada nas estimativas
+ANALYSIS_SIZE = 1000
+OSD_SIZE = 1600
+# Confiança mínima do OSD para girar a página
+MIN_OSD_CONFIDENCE = 2.0
+# Busca da inclinação: até MAX_SKEW graus, passo grosso e refinamento
+MAX_SKEW = 10.0
+COARSE_STEP = 1.0
+FINE_STEP = 0.1
+# Abaixo disso a inclinação não atrapalha o OCR e a página não é girada
+MIN_SKEW = 0.5
+
+ROTATIONS = {90: Image.Transpose.ROTATE_270, 180: Image.Transpose.ROTATE_180,
+             270: Image.Transpose.ROTATE_90}
+
+
+def _reduced(image: Image.Image, max_size: int) -> Image.Image:
+    """Cópia em tons de cinza com o maior lado até max_size."""
+    reduced = image.convert("L") if image.mode != "L" else image.copy()
+    reduced.thumbnail((max_size, max_size))
+    return reduced
+
+
+def detect_rotation(image: Image.Image) -> int:
+    """Graus (sentido horário) para endireitar a página segundo o OSD; 0 se incerto."""
+    try:
+        osd = pytesseract.image_to_osd(image, config="--psm 0",
+                                       output_type=pytesseract.Output.DICT)
+    except (pytesseract.TesseractError, OSError) as e:
+        # Sem Tesseract/osd.traineddata, ou página sem texto suficiente
+        print(f"OSD indisponível: {str(e).strip()[:80]}")
+        return 0
+    if float(osd.get("orientation_conf", 0)) < MIN_OSD_CONFIDENCE:
+        return 0
+    return int(osd.get("rotate", 0)) % 360
+
+
+def _profile_score(binary: Image.Image, angle: float) -> float:
+    rotated = binary.rotate(angle, resample=Image.Resampling.NEAREST, fillcolor=0)
+    rows = list(rotated.resize((1, rotated.height), Image.Resampling.BOX).getdata())
+    return sum((b - a) ** 2 for a, b in zip(rows, rows[1:]))
+
+
+def estimate_skew(image: Image.Image) -> float:
+    """Ângulo (graus, anti-horário) que deixa as linhas de texto na horizontal."""
+    # Texto em branco sobre fundo preto: o preenchimento da rotação não conta
+    binary = image.point(lambda v: 255 if v < 160 else 0)
+
+    def best(angles):
+        return max(angles, key=lambda a: _profile_score(binary, a))
+
+    steps = int(MAX_SKEW / COARSE_STEP)
+    coarse = best([i * COARSE_STEP for i in range(-steps, steps + 1)])
+    fine_steps = int(COARSE_STEP / FINE_STEP)
+    return round(best([coarse + i * FINE_STEP for i in range(-fine_steps, fine_steps + 1)]), 1)
+
+
+def correct_orientation(source: Union[Image.Image, str, Path]) -> Tuple[Optional[Image.Image], Dict[str, Any]]:
+    """Página endireitada e {'rotacao', 'inclinacao'} aplicados.
+
+    Se nada precisa ser corrigido a imagem devolvida é None, e quem chamou pode
+    seguir com a original (ou o arquivo) sem cópia. Quem já tem a página
+    decodificada deve passar a imagem, não o caminho.
+    """
+    image = Image.open(source) if isinstance(source, (str, Path)) else source
+    osd_image = _reduced(image, OSD_SIZE)
+    rotation = detect_rotation(osd_image)
+    # A cópia da análise sai da do OSD, sem voltar à página inteira
+    analysis = _reduced(osd_image, ANALYSIS_SIZE)
+    if rotation:
+        analysis = analysis.transpose(ROTATIONS[rotation])
+    skew = estimate_skew(analysis)
+    if abs(skew) < MIN_SKEW:
+        skew = 0.0
+    info = {"rotacao": rotation, "inclinacao": skew}
+    if not rotation and not skew:
+        return None, info
+
+    image = image.convert("RGB")
+    if rotation:
+        image = image.transpose(ROTATIONS[rotation])
+    if skew:
+        image = image.rotate(skew, resample=Image.Resampling.BICUBIC, expand=True, fillcolor="white")
+    return image, info
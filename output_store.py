@@ -0,0 +1,388 @@
+# output_store.py
+import io
+import os
+import stat
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import fitz
+from PIL import Image
+from flask import send_file
+
+from pdf_writer import fitz_lock
+
+PREVIEW_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+PREVIEW_MIN_WIDTH = 100
+PREVIEW_MAX_WIDTH = 1200
+# Larguras são arredondadas para este passo: menos variações, mais acertos no cache
+PREVIEW_WIDTH_STEP = 50
+# Arquivos mais novos que isto (segundos) não saem por limite de tamanho: o link
+# de download acabou de ser devolvido ao cliente
+EVICT_GRACE = 120
+# Idade máxima (segundos) da última leitura da pasta para o /outputs
+SCAN_INTERVAL = 10
+
+
+class PreviewCache:
+    """Cache LRU das miniaturas renderizadas, limitado pelo total de bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: tuple, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def discard(self, filename: str) -> None:
+        """Remove as miniaturas de um arquivo (a chave começa pelo nome)."""
+        with self._lock:
+            for key in [k for k in self._items if k[0] == filename]:
+                self._bytes -= len(self._items.pop(key))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'itens': len(self._items), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'acertos': self.hits, 'falhas': self.misses}
+
+
+def preview_width(width: int) -> int:
+    """Largura pedida limitada ao intervalo aceito e arredondada ao passo."""
+    width = min(max(width, PREVIEW_MIN_WIDTH), PREVIEW_MAX_WIDTH)
+    return max(PREVIEW_MIN_WIDTH, width // PREVIEW_WIDTH_STEP * PREVIEW_WIDTH_STEP)
+
+
+def render_preview(path: str, page_number: int, width: int, fmt: str) -> Tuple[bytes, int]:
+    """Renderiza uma página (começando em 1) como miniatura; retorna (imagem, total de páginas)."""
+    with fitz_lock, fitz.open(path) as doc:
+        page_count = doc.page_count
+        if not 1 <= page_number <= page_count:
+            raise IndexError(f"Página {page_number} fora do intervalo 1-{page_count}")
+        page = doc[page_number - 1]
+        zoom = width / page.rect.width
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        if fmt == 'png':
+            return pix.tobytes('png'), page_count
+        img = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+    # A codificação WEBP é do PIL e roda fora do lock
+    buf = io.BytesIO()
+    img.save(buf, 'WEBP', quality=80, method=4)
+    return buf.getvalue(), page_count
+
+
+class OutputStore:
+    """Armazena os PDFs gerados com limite de tamanho e de idade.
+
+    A pasta é a referência: com vários processos web servindo a mesma pasta,
+    cada um só registra o que gerou. O índice em memória (nome -> metadados)
+    guarda o que é caro de recalcular (ETag, páginas) e é conferido com um
+    os.stat a cada acesso a um arquivo. O total em bytes é mantido a cada
+    registro e remoção; a pasta inteira só é relida pela limpeza periódica,
+    quando o total passa do limite e, no máximo a cada SCAN_INTERVAL, na listagem.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, max_age: float, sweep_interval: float = 60.0,
+                 preview_cache_bytes: int = 64 * 1024 * 1024):
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._index: Dict[str, Dict[str, Any]] = {}
+        # Total de todos os arquivos e dos que contam para o limite (os que cabem nele)
+        self._bytes = 0
+        self._budget_bytes = 0
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        self.previews = PreviewCache(preview_cache_bytes)
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        """Sincroniza o índice com os arquivos da pasta (inclusive os de outros processos)."""
+        found = {}
+        for name in os.listdir(self.folder):
+            st = self._stat(name)
+            if st is not None:
+                found[name] = st
+        with self._lock:
+            for name in [n for n in self._index if n not in found]:
+                self._unset(name)
+                self.previews.discard(name)
+            for name, st in found.items():
+                self._refresh(name, st)
+            self._scanned_at = time.time()
+
+    def _counts(self, meta: Dict[str, Any]) -> bool:
+        # Arquivos maiores que o limite inteiro não contam nele (expiram pela idade)
+        return not self.max_bytes or meta['size'] <= self.max_bytes
+
+    def _set(self, filename: str, meta: Dict[str, Any]) -> None:
+        # Chamado com o lock adquirido: toda inclusão no índice passa por aqui (totais)
+        self._unset(filename)
+        self._index[filename] = meta
+        self._bytes += meta['size']
+        if self._counts(meta):
+            self._budget_bytes += meta['size']
+
+    def _unset(self, filename: str) -> Optional[Dict[str, Any]]:
+        # Chamado com o lock adquirido: toda saída do índice passa por aqui (totais)
+        meta = self._index.pop(filename, None)
+        if meta is not None:
+            self._bytes -= meta['size']
+            if self._counts(meta):
+                self._budget_bytes -= meta['size']
+        return meta
+
+    def _stat(self, filename: str) -> Optional[os.stat_result]:
+        """os.stat do arquivo armazenado, ou None se o nome é inválido ou o arquivo não existe."""
+        if not filename or filename != os.path.basename(filename) or filename.startswith('.'):
+            return None
+        try:
+            st = os.stat(self.path_for(filename))
+        except OSError:
+            return None
+        return st if stat.S_ISREG(st.st_mode) else None
+
+    def _refresh(self, filename: str, st: os.stat_result) -> Dict[str, Any]:
+        # Chamado com o lock adquirido: entrada nova ou arquivo regravado
+        meta = self._index.get(filename)
+        if meta is None or (meta['size'], meta['created']) != (st.st_size, st.st_mtime):
+            if meta is not None:
+                self.previews.discard(filename)
+            meta = {
+                'filename': filename,
+                'size': st.st_size,
+                'created': st.st_mtime,
+                'etag': None,  # calculado no primeiro download
+            }
+            self._set(filename, meta)
+        return meta
+
+    def _lookup(self, filename: str) -> Optional[Dict[str, Any]]:
+        """Metadados (cópia) conferidos com o disco; None se o arquivo não existe mais."""
+        st = self._stat(filename)
+        with self._lock:
+            if st is None:
+                if self._unset(filename) is not None:
+                    self.previews.discard(filename)
+                return None
+            return dict(self._refresh(filename, st))
+
+    def _etag(self, meta: Dict[str, Any]) -> str:
+        """ETag do arquivo; calculado fora do lock e guardado se o arquivo não mudou."""
+        if meta['etag'] is not None:
+            return meta['etag']
+        path = self.path_for(meta['filename'])
+        etag = _file_etag(path)
+        st = self._stat(meta['filename'])
+        with self._lock:
+            current = self._index.get(meta['filename'])
+            unchanged = (meta['size'], meta['created'])
+            if st is not None and current is not None and (st.st_size, st.st_mtime) == unchanged \
+                    and (current['size'], current['created']) == unchanged:
+                current['etag'] = etag
+        return etag
+
+    def path_for(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+
+    def register(self, filename: str) -> Dict[str, Any]:
+        """Adiciona (ou atualiza) um arquivo recém-gerado no índice.
+
+        O próprio arquivo nunca é removido aqui; um arquivo maior que o limite
+        inteiro só é registrado no log (sai pela idade máxima). A pasta só é
+        relida (em evict) se o total passou do limite; a ETag é calculada no
+        primeiro download.
+        """
+        st = os.stat(self.path_for(filename))
+        meta = {
+            'filename': filename,
+            'size': st.st_size,
+            'created': st.st_mtime,
+            'etag': None,
+        }
+        with self._lock:
+            self._set(filename, meta)
+            over = self.max_bytes and self._budget_bytes > self.max_bytes
+        # Mesmo nome com conteúdo novo: miniaturas antigas não servem mais
+        self.previews.discard(filename)
+        if not self._counts(meta):
+            print(f"OutputStore: {filename} ({meta['size']} bytes) é maior que o limite "
+                  f"de {self.max_bytes} bytes; mantido até expirar")
+        elif over:
+            self.evict(keep=filename)
+        return dict(meta)
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        return self._lookup(filename)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Arquivos armazenados, mais novos primeiro (inclui os de outros processos)."""
+        if time.time() - self._scanned_at > SCAN_INTERVAL:
+            self._scan()
+        with self._lock:
+            items = [dict(m) for m in self._index.values()]
+        items.sort(key=lambda m: m['created'], reverse=True)
+        return items
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def _remove(self, filename: str) -> None:
+        # Chamado com o lock adquirido
+        self._unset(filename)
+        self.previews.discard(filename)
+        try:
+            os.remove(self.path_for(filename))
+        except FileNotFoundError:
+            pass
+        except (PermissionError, OSError) as e:
+            # Arquivo pode estar em uso (ex.: download em andamento no Windows)
+            print(f"Erro ao remover saída {filename}: {e}")
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Relê a pasta e remove arquivos expirados e, se preciso, os mais antigos até caber no limite.
+
+        Por tamanho não saem keep, os arquivos mais novos que EVICT_GRACE nem os
+        maiores que o limite inteiro (esses não contam no total e expiram pela idade).
+        """
+        removed = 0
+        now = time.time()
+        # O limite vale para a pasta inteira, não só para o que este processo gerou
+        self._scan()
+        with self._lock:
+            for name, meta in list(self._index.items()):
+                if self.max_age and now - meta['created'] > self.max_age:
+                    self._remove(name)
+                    removed += 1
+
+            total = self._budget_bytes
+            if self.max_bytes and total > self.max_bytes:
+                fits = [m for m in self._index.values() if self._counts(m)]
+                for meta in sorted(fits, key=lambda m: m['created']):
+                    if total <= self.max_bytes:
+                        break
+                    if meta['filename'] == keep or now - meta['created'] < EVICT_GRACE:
+                        continue
+                    total -= meta['size']
+                    self._remove(meta['filename'])
+                    removed += 1
+        if removed:
+            print(f"OutputStore: {removed} arquivo(s) removido(s) por limite de tamanho/idade")
+        return removed
+
+    def start_sweeper(self) -> None:
+        """Inicia a thread de limpeza periódica (idempotente)."""
+        if self._sweeper and self._sweeper.is_alive():
+            return
+
+        def _run():
+            while not self._stop.wait(self.sweep_interval):
+                try:
+                    self.evict()
+                except Exception as e:
+                    print(f"OutputStore: erro na limpeza periódica: {e}")
+
+        self._sweeper = threading.Thread(target=_run, name='output-store-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+
+    def send(self, filename: str):
+        """Resposta de download com ETag, requisições condicionais (304) e Range."""
+        meta = self._lookup(filename)
+        if meta is None:
+            return None
+        try:
+            etag = self._etag(meta)
+            response = send_file(
+                self.path_for(filename),
+                as_attachment=True,
+                download_name=filename,
+                conditional=True,
+                etag=etag,
+                last_modified=meta['created'],
+                max_age=0,
+            )
+        except FileNotFoundError:
+            # Removido por outro processo entre a consulta e o envio
+            return None
+        # Estações de impressão devem sempre revalidar, recebendo 304 se nada mudou
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+
+    def preview(self, filename: str, page: int = 1, width: int = 400,
+                fmt: str = 'webp') -> Optional[Dict[str, Any]]:
+        """Miniatura de uma página de um arquivo armazenado, renderizada uma vez e mantida em cache.
+
+        Retorna None se o arquivo não existe; IndexError para página inválida.
+        """
+        width = preview_width(width)
+        meta = self._lookup(filename)
+        if meta is None:
+            return None
+        try:
+            etag = self._etag(meta)
+        except FileNotFoundError:
+            return None
+        pages = meta.get('pages')
+        if pages is not None and not 1 <= page <= pages:
+            raise IndexError(f"Página {page} fora do intervalo 1-{pages}")
+
+        key = (filename, etag, page, width, fmt)
+        data = self.previews.get(key)
+        cached = data is not None
+        if not cached:
+            data, pages = render_preview(self.path_for(filename), page, width, fmt)
+            self.previews.put(key, data)
+            with self._lock:
+                if filename in self._index:
+                    self._index[filename]['pages'] = pages
+        return {
+            'data': data,
+            'mimetype': PREVIEW_FORMATS[fmt],
+            'etag': f"{etag[:16]}-{page}-{width}.{fmt}",
+            'pages': pages,
+            'width': width,
+            'cached': cached,
+        }
+
+
+def _file_etag(path: str) -> str:
+    """ETag forte baseado no conteúdo do arquivo."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,385 @@
+# pdf_writer.py
+"""Composição de PDFs de saída diretamente no PyMuPDF.
+
+Páginas de origem são copiadas como vetores (sem rasterizar), tabelas e
+códigos de barras são escritos como conteúdo nativo da página (ver
+label_templates) e o arquivo é salvo com coleta de lixo e compressão.
+"""
+import os
+import struct
+import hashlib
+import threading
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
+
+import fitz
+from barcode import Code128
+
+PRETO = (0, 0, 0)
+BRANCO = (1, 1, 1)
+CINZA_CLARO = (0.827, 0.827, 0.827)
+AZUL_CLARO = (0.678, 0.847, 0.902)
+
+# Fontes base-14 do PyMuPDF
+HELVETICA = "helv"
+HELVETICA_BOLD = "hebo"
+BASE14_FONTS = {HELVETICA: "Helvetica", HELVETICA_BOLD: "Helvetica-Bold"}
+
+# O PyMuPDF não é seguro para uso em várias threads. No servidor web, todo uso
+# do fitz fora dos processos de pool passa por este lock (reentrante: funções
+# que o seguram chamam outras que também o pegam).
+fitz_lock = threading.RLock()
+
+# Método de início dos pools de processos. Com fork o filho herdaria o estado
+# do PyMuPDF e locks tomados por outras threads do servidor; spawn e
+# forkserver começam de um interpretador limpo.
+POOL_START_METHOD = os.environ.get("POOL_START_METHOD", "spawn")
+
+TABLE_STYLE_DEFAULTS: Dict[str, Any] = {
+    "fontname": HELVETICA,
+    "fontsize": 10,
+    "leading": None,            # padrão: 1.2 * fontsize
+    "aligns": None,             # alinhamento por coluna: LEFT/CENTER/RIGHT
+    "row_backgrounds": [BRANCO],
+    "header_fontname": HELVETICA_BOLD,
+    "header_fontsize": 12,
+    "header_background": None,
+    "header_align": "CENTER",
+    "grid": 1.0,
+    "padding": (6, 6, 6, 6),    # esquerda, direita, topo, base
+    "min_row_height": 0,
+}
+
+
+def table_style(**overrides) -> Dict[str, Any]:
+    style = dict(TABLE_STYLE_DEFAULTS)
+    style.update(overrides)
+    return style
+
+
+def code128_modules(value: str) -> str:
+    """Sequência de módulos ('1' barra, '0' espaço) do Code128 para o valor."""
+    return Code128(value).build()[0]
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# tipo de cor do PNG -> componentes por pixel (só os que o PDF lê sem decodificar)
+PNG_COLOR_COMPONENTS = {0: 1, 2: 3, 3: 1}
+
+
+def read_png_passthrough(data: bytes) -> Optional[Dict[str, Any]]:
+    """Dados de um PNG que pode ser embutido no PDF sem decodificar.
+
+    Os blocos IDAT de um PNG são zlib com os preditores PNG, exatamente o que
+    o FlateDecode com /Predictor 15 do PDF lê. Retorna None para PNGs que
+    precisariam de decodificação (entrelaçados, com canal alfa ou tRNS).
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    info: Dict[str, Any] = {"idat": []}
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, ctype = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if ctype == b"IHDR":
+            (info["width"], info["height"], info["bits"], info["color"],
+             _, _, info["interlace"]) = struct.unpack(">IIBBBBB", chunk)
+        elif ctype == b"PLTE":
+            info["palette"] = chunk
+        elif ctype == b"tRNS":
+            return None
+        elif ctype == b"IDAT":
+            info["idat"].append(chunk)
+        elif ctype == b"IEND":
+            break
+    if "width" not in info or info["interlace"] or info["color"] not in PNG_COLOR_COMPONENTS:
+        return None
+    if info["color"] == 3 and "palette" not in info:
+        return None
+    return info
+
+
+def fit_rect(src_width: float, src_height: float, box: fitz.Rect, anchor: str = "c") -> fitz.Rect:
+    """Maior retângulo com a proporção da origem dentro de box ('c' centro, 'nw' topo-esquerda)."""
+    if src_width <= 0 or src_height <= 0 or box.is_empty:
+        return fitz.Rect(box)
+    scale = min(box.width / src_width, box.height / src_height)
+    w, h = src_width * scale, src_height * scale
+    if anchor == "nw":
+        return fitz.Rect(box.x0, box.y0, box.x0 + w, box.y0 + h)
+    x0 = box.x0 + (box.width - w) / 2
+    y0 = box.y0 + (box.height - h) / 2
+    return fitz.Rect(x0, y0, x0 + w, y0 + h)
+
+
+class LabelWriter:
+    """Documento de saída em construção.
+
+    Mantém os documentos de origem abertos durante a composição para que as
+    páginas sejam copiadas como vetores, e valida o resultado no próprio save.
+    Imagens de mesmo conteúdo viram um único XObject compartilhado.
+    """
+
+    def __init__(self):
+        self.doc = fitz.open()
+        self._sources: Dict[str, fitz.Document] = {}
+        self._fonts: Dict[str, int] = {}
+        # sha1 do arquivo -> (xref, largura, altura, desenhada pelo próprio writer)
+        self._images: Dict[str, tuple] = {}
+
+    def _font_xref(self, fontname: str) -> int:
+        if fontname not in self._fonts:
+            xref = self.doc.get_new_xref()
+            self.doc.update_object(
+                xref, f"<</Type/Font/Subtype/Type1/BaseFont/{BASE14_FONTS[fontname]}/Encoding/WinAnsiEncoding>>")
+            self._fonts[fontname] = xref
+        return self._fonts[fontname]
+
+    def new_page(self, width: float, height: float) -> fitz.Page:
+        page = self.doc.new_page(width=width, height=height)
+        # Registra as fontes base-14 nos recursos da página antes de qualquer
+        # show_pdf_page: o insert_text enxerga fontes de mesmo nome dentro do
+        # XObject copiado e deixaria de declará-las na página. Todas as páginas
+        # compartilham o mesmo objeto de fonte.
+        _, resources = self.doc.xref_get_key(page.xref, "Resources")
+        res_xref = int(resources.split()[0])
+        for fontname in BASE14_FONTS:
+            self.doc.xref_set_key(res_xref, f"Font/{fontname}", f"{self._font_xref(fontname)} 0 R")
+        return page
+
+    def source(self, path: str) -> fitz.Document:
+        key = os.path.abspath(str(path))
+        if key not in self._sources:
+            self._sources[key] = fitz.open(key)
+        return self._sources[key]
+
+    def show_page(self, page: fitz.Page, box: fitz.Rect, src_path: str, pno: int, anchor: str = "c") -> fitz.Rect:
+        """Copia a página pno de src_path (vetorial) para dentro de box mantendo a proporção."""
+        src = self.source(src_path)
+        src_rect = src[pno].rect
+        target = fit_rect(src_rect.width, src_rect.height, box, anchor)
+        page.show_pdf_page(target, src, pno)
+        return target
+
+    def add_content(self, page: fitz.Page, ops: bytes) -> None:
+        """Acrescenta operadores PDF já compilados ao final do conteúdo da página."""
+        if not ops:
+            return
+        xref = self.doc.get_new_xref()
+        self.doc.update_object(xref, "<<>>")
+        self.doc.update_stream(xref, b"q\n" + ops + b"\nQ")
+        contents = page.get_contents() + [xref]
+        self.doc.xref_set_key(page.xref, "Contents", "[" + " ".join(f"{x} 0 R" for x in contents) + "]")
+
+    def _png_xobject(self, data: bytes) -> Optional[tuple]:
+        """XObject com os dados comprimidos do próprio PNG; (xref, largura, altura) ou None."""
+        info = read_png_passthrough(data)
+        if info is None:
+            return None
+        components = PNG_COLOR_COMPONENTS[info["color"]]
+        if info["color"] == 3:
+            colorspace = (f"[/Indexed/DeviceRGB {len(info['palette']) // 3 - 1}"
+                          f"<{info['palette'].hex()}>]")
+        else:
+            colorspace = "/DeviceGray" if components == 1 else "/DeviceRGB"
+        xref = self.doc.get_new_xref()
+        self.doc.update_object(
+            xref, f"<</Type/XObject/Subtype/Image/Width {info['width']}/Height {info['height']}"
+                  f"/ColorSpace{colorspace}/BitsPerComponent {info['bits']}>>")
+        self.doc.update_stream(xref, b"".join(info["idat"]), compress=False)
+        # update_stream grava o stream cru; o filtro é declarado depois
+        self.doc.xref_set_key(xref, "Filter", "/FlateDecode")
+        self.doc.xref_set_key(
+            xref, "DecodeParms",
+            f"<</Predictor 15/Colors {components}/BitsPerComponent {info['bits']}/Columns {info['width']}>>")
+        return xref, info["width"], info["height"]
+
+    def insert_image_file(self, page: fitz.Page, box: fitz.Rect, path: str) -> None:
+        """Insere um arquivo de imagem mantendo a proporção, sem recodificar.
+
+        JPEG é embutido como está pelo PyMuPDF; PNG sem transparência tem os
+        dados IDAT copiados direto para o PDF. Outros casos são decodificados
+        pelo PyMuPDF. A mesma imagem (pelo conteúdo) é embutida uma única vez.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self._images:
+            png = self._png_xobject(data)
+            if png is None:
+                xref = page.insert_image(box, stream=data, keep_proportion=True)
+                self._images[digest] = (xref, 0, 0, False)
+                return
+            self._images[digest] = png + (True,)
+        xref, img_w, img_h, own = self._images[digest]
+        if not own:
+            page.insert_image(box, xref=xref, keep_proportion=True)
+            return
+        target = fit_rect(img_w, img_h, box)
+        name = f"Img{xref}"
+        _, resources = self.doc.xref_get_key(page.xref, "Resources")
+        self.doc.xref_set_key(int(resources.split()[0]), f"XObject/{name}", f"{xref} 0 R")
+        ph = page.rect.height
+        self.add_content(page, (f"{target.width:.3f} 0 0 {target.height:.3f} {target.x0:.3f} "
+                                f"{ph - target.y1:.3f} cm /{name} Do").encode("latin-1"))
+
+    def save(self, out_path: str) -> int:
+        """Salva compactado; retorna o número de páginas.
+
+        garbage=4 também junta objetos idênticos (ex.: a mesma imagem vinda de
+        documentos de origem diferentes) e os objetos pequenos vão em object
+        streams comprimidos.
+        """
+        try:
+            if self.doc.page_count == 0:
+                raise ValueError("Nenhuma página foi gerada")
+            pages = self.doc.page_count
+            self.doc.save(str(out_path), garbage=4, deflate=True, use_objstms=1)
+            return pages
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        for src in self._sources.values():
+            src.close()
+        self._sources.clear()
+        if not self.doc.is_closed:
+            self.doc.close()
+
+
+def merge_pdfs(out_path: str, parts: Sequence[str]) -> int:
+    """Junta os PDFs parciais em ordem num único arquivo; retorna o número de páginas."""
+    with fitz_lock:
+        doc = fitz.open()
+        try:
+            for part in parts:
+                with fitz.open(part) as src:
+                    doc.insert_pdf(src)
+            if doc.page_count == 0:
+                raise ValueError("Nenhuma página foi gerada")
+            # garbage=4 junta o que se repete entre as partes (ex.: a mesma página de origem)
+            doc.save(str(out_path), garbage=4, deflate=True, use_objstms=1)
+            return doc.page_count
+        finally:
+            doc.close()
+
+
+# Pools de composição reaproveitados entre chamadas (max_workers -> pool)
+_render_pools: Dict[int, ProcessPoolExecutor] = {}
+_render_pools_lock = threading.Lock()
+# Teto de processos de composição neste processo (None = sem teto); definido
+# pelo initializer dos pools que rodam pipelines, para não multiplicar pools
+_render_workers_cap: Optional[int] = None
+
+
+def limit_render_workers(cap: int) -> None:
+    """Initializer de pool de processos: limita os pools de composição criados em cada processo."""
+    global _render_workers_cap
+    _render_workers_cap = max(1, cap)
+
+
+def render_workers(workers: int) -> int:
+    """Processos de composição efetivos para o pedido de workers neste processo."""
+    if multiprocessing.current_process().daemon:
+        # Processos daemon (workers do spool) não podem criar processos filhos
+        return 1
+    return workers if _render_workers_cap is None else min(workers, _render_workers_cap)
+
+
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """Pool de processos iniciados com POOL_START_METHOD (nunca fork)."""
+    return ProcessPoolExecutor(max_workers=max_workers,
+                               mp_context=multiprocessing.get_context(POOL_START_METHOD), **kwargs)
+
+
+def _render_pool(workers: int) -> ProcessPoolExecutor:
+    with _render_pools_lock:
+        if not _render_pools:
+            # Dentro de um processo de pool (ex.: o pipeline do shein) o atexit do
+            # concurrent.futures não roda, e ao encerrar o processo esperaria para
+            # sempre pelos filhos deste pool. O finalizador os encerra antes.
+            multiprocessing.util.Finalize(None, shutdown_render_pools, exitpriority=100)
+        if workers not in _render_pools:
+            _render_pools[workers] = process_pool(workers)
+        return _render_pools[workers]
+
+
+def shutdown_render_pools() -> None:
+    """Encerra os pools de composição (idempotente)."""
+    with _render_pools_lock:
+        pools = list(_render_pools.values())
+        _render_pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _run_chunks(calls: List[Tuple[Callable, tuple, int]], workers: int, progress=None,
+                stage: str = "composicao") -> List[Any]:
+    """Executa as chamadas (função, argumentos, itens) no pool, ou em série; retorna os resultados em ordem."""
+    total = sum(n for _, _, n in calls)
+    workers = render_workers(workers)
+    if workers > 1:
+        pool = _render_pool(workers)
+        futures = [pool.submit(fn, *args) for fn, args, _ in calls]
+    else:
+        futures = None
+    done = 0
+    results = []
+    try:
+        for i, (fn, args, n) in enumerate(calls):
+            if futures is None:
+                # Em série, na thread de quem chamou
+                with fitz_lock:
+                    results.append(fn(*args))
+            else:
+                results.append(futures[i].result())
+            done += n
+            if progress:
+                progress(stage, done, total)
+    except BaseException:
+        for future in futures or ():
+            future.cancel()
+        raise
+    return results
+
+
+def compose_in_chunks(render_chunk: Callable[[List[Any], str], Any], items: Sequence[Any],
+                      out_path: str, workdir: str, chunk_size: int, workers: int,
+                      progress=None, stage: str = "composicao") -> int:
+    """Compõe items em blocos paralelos e junta as partes na ordem original.
+
+    render_chunk(bloco, caminho_parcial) roda num processo do pool e precisa
+    ser serializável (função de módulo ou functools.partial), abrindo ele mesmo
+    os documentos de origem. Os blocos dependem só de chunk_size, então o
+    resultado é o mesmo com qualquer número de workers.
+    """
+    chunks = [list(items[i:i + chunk_size]) for i in range(0, len(items), chunk_size)]
+    parts = [os.path.join(workdir, f"parte_{n:05d}.pdf") for n in range(len(chunks))]
+    _run_chunks([(render_chunk, (chunk, part), len(chunk)) for chunk, part in zip(chunks, parts)],
+                workers, progress, stage)
+    return merge_pdfs(out_path, parts)
+
+
+def _render_each(render_chunk: Callable[[List[Any], str], Any], items: List[Any],
+                 paths: List[str]) -> List[int]:
+    # Roda no pool: um arquivo por item do bloco, cada render_chunk retorna as páginas salvas
+    return [render_chunk([item], path) for item, path in zip(items, paths)]
+
+
+def render_individually(render_chunk: Callable[[List[Any], str], Any], items: Sequence[Any],
+                        paths: Sequence[str], chunk_size: int, workers: int,
+                        progress=None, stage: str = "composicao") -> List[int]:
+    """Compõe cada item num PDF próprio (paths[i]), em blocos paralelos.
+
+    Mesmo contrato de render_chunk que compose_in_chunks, chamado com um item
+    por vez, retornando as páginas salvas; nada é juntado depois. Retorna as
+    páginas de cada arquivo, na ordem de items.
+    """
+    calls = []
+    for i in range(0, len(items), chunk_size):
+        chunk = list(items[i:i + chunk_size])
+        calls.append((_render_each, (render_chunk, chunk, list(paths[i:i + chunk_size])), len(chunk)))
+    return [pages for chunk in _run_chunks(calls, workers, progress, stage) for pages in chunk]
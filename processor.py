@@ -1,15 +1,17 @@
 # processor.py
+import os
 import re
 import io
 import base64
+import tempfile
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 # --- Dependências que você deve instalar:
-# pip install pdfplumber pytesseract pillow pyzbar python-barcode reportlab
+# pip install pdfplumber pymupdf pytesseract pillow pyzbar python-barcode
 # (instale também o Tesseract no sistema, ex.: Ubuntu: sudo apt-get install tesseract-ocr)
 
-import pdfplumber
 from PIL import Image
 import pytesseract
 
@@ -25,47 +27,156 @@ except Exception:
 from barcode import Code128
 from barcode.writer import ImageWriter
 
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+import fitz
+
+from pdf_writer import (
+    LabelWriter, compose_in_chunks, render_individually, render_workers, table_style, HELVETICA, HELVETICA_BOLD, BRANCO,
+    CINZA_CLARO, AZUL_CLARO, fitz_lock,
+)
+from label_templates import BarcodeTemplate, TableTemplate, text_ops, text_width
+from progress import ProgressCallback
+from tracking_index import index_for
+from validators import canonical_s10, is_valid_chave, is_valid_s10
+from memory import MemoryBudgetExceeded, MemoryTracker, track
+from deadline import Deadline, timed
+from orientation import correct_orientation
+from text_extraction import extract_pages
+from zip_stream import entry_names
+
+# Corrigir orientação (OSD) e inclinação das páginas antes do OCR
+OCR_ORIENTATION = os.environ.get('OCR_ORIENTATION', '1') == '1'
+
+# Composição paralela de uploads com muitos trackings: processos, trackings por
+# bloco e mínimo de trackings para dividir (COMPOSE_WORKERS=1 = serial)
+COMPOSE_WORKERS = int(os.environ.get('COMPOSE_WORKERS', os.cpu_count() or 1))
+COMPOSE_CHUNK = int(os.environ.get('COMPOSE_CHUNK', 10))
+COMPOSE_MIN_TRACKINGS = int(os.environ.get('COMPOSE_MIN_TRACKINGS', 2 * COMPOSE_CHUNK))
+
+# Tamanho A4 em pontos
+A4 = (595.2755905511812, 841.8897637795277)
 
 TRACKING_RE = re.compile(r"\b([A-Z]{2}\d{9}[A-Z]{2})\b")
 MEL_TRACKING_RE = re.compile(r"\b(MEL\d+[A-Z0-9]+)\b")  # Padrão para códigos MEL do Mercado Livre
 CHAVE44_RE = re.compile(r"\b(\d{44})\b", re.MULTILINE)
+# Candidatos a S10 com caracteres que o OCR costuma trocar
+LOOSE_TRACKING_RE = re.compile(r"\b[A-Z0-9]{2}[0-9OQDILBSZG]{9}[A-Z0-9]{2}\b")
 DEST_HINTS = [r"DESTINAT[ÁA]RIO", r"\bDEST\.\b", r"\bNOME DO DESTINAT[ÁA]RIO\b"]
 
-def read_pdf_text(path: Path) -> List[str]:
-    """Extrai texto por página de um PDF (sem OCR)."""
-    pages_text = []
-    with pdfplumber.open(str(path)) as pdf:
-        for page in pdf.pages:
-            pages_text.append(page.extract_text() or "")
-    return pages_text
-
-def ocr_image(image: Image.Image) -> str:
-    """OCR com Tesseract."""
-    return pytesseract.image_to_string(image, lang="por+eng")
-
-def pdf_to_images(path: Path) -> List[Image.Image]:
-    """(Opcional) Converter PDF em imagens para OCR/Barcodes.
-    Dica: pode usar pdf2image (poppler) se quiser mais robusto.
-    Aqui, tentamos com pdfplumber rasterizando a página."""
-    images = []
-    with pdfplumber.open(str(path)) as pdf:
-        for page in pdf.pages:
-            pil = page.to_image(resolution=200).original
-            images.append(pil)
-    return images
-
-def pdf_to_high_quality_images(path: Path) -> List[Image.Image]:
+def read_pdf_text(path: Path, progress: Optional[ProgressCallback] = None) -> List[str]:
+    """Extrai texto por página de um PDF (sem OCR); PyMuPDF com fallback para o pdfplumber."""
+    return extract_pages(path, progress)
+
+def ocr_image(image: Union[Image.Image, str], timeout: float = 0) -> str:
+    """OCR com Tesseract (um caminho de arquivo é lido direto pelo Tesseract).
+
+    Com timeout (segundos) o Tesseract é interrompido e sobe RuntimeError.
+    """
+    return pytesseract.image_to_string(image, lang="por+eng", timeout=timeout)
+
+def ocr_source(image: Union[Image.Image, str]) -> Union[Image.Image, str]:
+    """Imagem aberta de um arquivo vai para o Tesseract pelo caminho (sem PNG temporário)."""
+    return getattr(image, "filename", None) or image
+
+def upright_for_ocr(image: Union[Image.Image, str]) -> Union[Image.Image, str]:
+    """Página girada/endireitada antes do OCR; a própria entrada se já está reta."""
+    if not OCR_ORIENTATION:
+        return ocr_source(image)
+    corrected, info = correct_orientation(image)
+    if corrected is None:
+        return ocr_source(image)
+    print(f"OCR: página corrigida (rotação {info['rotacao']}°, inclinação {info['inclinacao']}°)")
+    return corrected
+
+def ocr_pages(images: Sequence[Union[Image.Image, str]], progress: Optional[ProgressCallback] = None,
+              deadline: Optional[Deadline] = None, stage: str = "ocr") -> List[str]:
+    """OCR de várias páginas, reportando o andamento.
+
+    Com prazo, o OCR para quando o orçamento da etapa acaba: as páginas
+    restantes ficam com texto vazio e a degradação é registrada.
+    """
+    texts = []
+    total = len(images)
+    for i in range(total):
+        if deadline is not None and deadline.over(stage):
+            deadline.note(stage, f"OCR interrompido: {total - i} de {total} página(s) sem OCR")
+            texts.extend([""] * (total - i))
+            break
+        # Só rasteriza a página depois de saber que ainda há tempo para ela
+        img = images[i]
+        timeout = max(1, int(deadline.budget_left(stage))) if deadline is not None else 0
+        try:
+            texts.append(ocr_image(upright_for_ocr(img), timeout))
+        except RuntimeError as e:
+            if deadline is None or 'timeout' not in str(e).lower():
+                raise
+            deadline.note(stage, f"OCR da página {i + 1} interrompido pelo prazo")
+            texts.append("")
+        if progress:
+            progress("ocr", len(texts), total)
+    return texts
+
+class PageImages(Sequence):
+    """Páginas de um PDF rasterizadas sob demanda.
+
+    Só a página em uso fica na memória durante o OCR e a leitura de códigos de
+    barras. Com orçamento de memória, a resolução da página é reduzida quando
+    ela não cabe; abaixo de min_resolution a requisição falha com
+    MemoryBudgetExceeded. Com o prazo apertado, as páginas seguintes saem
+    direto em min_resolution.
+    """
+
+    def __init__(self, path: Path, resolution: int, memory: Optional[MemoryTracker] = None,
+                 stage: str = "rasterizacao", min_resolution: int = 100,
+                 deadline: Optional[Deadline] = None):
+        self.path = Path(path)
+        self.resolution = resolution
+        self.memory = memory
+        self.deadline = deadline
+        self.stage = stage
+        self.min_resolution = min_resolution
+        with fitz_lock, fitz.open(str(self.path)) as doc:
+            self._sizes = [(page.rect.width, page.rect.height) for page in doc]
+        self._reduced = set()
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def _resolution_for(self, index: int) -> int:
+        width, height = self._sizes[index]
+        res = self.resolution
+        while True:
+            # Pixmap RGB + cópia na imagem PIL
+            needed = int(width * res / 72) * int(height * res / 72) * 3 * 2
+            if self.memory is None or self.memory.check(needed):
+                return res
+            if res <= self.min_resolution:
+                self.memory.require(self.stage, needed)
+            lower = max(self.min_resolution, res * 2 // 3)
+            if lower not in self._reduced:
+                self._reduced.add(lower)
+                self.memory.note_strategy(self.stage, f"rasterização reduzida para {lower} dpi (era {res})")
+            res = lower
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        res = self._resolution_for(index)
+        if self.deadline is not None and res > self.min_resolution and self.deadline.degraded("dpi"):
+            self.deadline.note(self.stage, f"rasterização reduzida para {self.min_resolution} dpi pelo prazo")
+            res = self.min_resolution
+        with fitz_lock, fitz.open(str(self.path)) as doc:
+            pix = doc[index].get_pixmap(dpi=res, alpha=False)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+
+def pdf_to_images(path: Path, memory: Optional[MemoryTracker] = None,
+                  deadline: Optional[Deadline] = None) -> Sequence[Image.Image]:
+    """Converter PDF em imagens (200 dpi) para OCR/Barcodes, uma página por vez."""
+    return PageImages(path, 200, memory, deadline=deadline)
+
+def pdf_to_high_quality_images(path: Path, memory: Optional[MemoryTracker] = None) -> Sequence[Image.Image]:
     """Converter PDF em imagens de alta qualidade para exibição na etiqueta final."""
-    images = []
-    with pdfplumber.open(str(path)) as pdf:
-        for page in pdf.pages:
-            # Usar resolução muito alta para qualidade superior
-            pil = page.to_image(resolution=600).original
-            images.append(pil)
-    return images
+    # Usar resolução muito alta para qualidade superior
+    return PageImages(path, 600, memory, min_resolution=300)
 
 def find_tracking(text_pages: List[str]) -> Optional[str]:
     for ptxt in text_pages:
@@ -105,9 +216,17 @@ def extract_possible_names(text: str) -> List[str]:
                     names.append(w.strip())
     return names
 
+def find_chaves_acesso(text: str) -> List[str]:
+    """Chaves de acesso com dígito verificador válido, na ordem em que aparecem."""
+    chaves = []
+    for m in CHAVE44_RE.finditer(text.replace(" ", "")):
+        if is_valid_chave(m.group(1)) and m.group(1) not in chaves:
+            chaves.append(m.group(1))
+    return chaves
+
 def find_chave_acesso(text: str) -> Optional[str]:
-    m = CHAVE44_RE.search(text.replace(" ", ""))
-    return m.group(1) if m else None
+    chaves = find_chaves_acesso(text)
+    return chaves[0] if chaves else None
 
 def detect_danfe(text_pages: List[str]) -> Tuple[bool, Optional[str], Optional[str]]:
     """
@@ -137,12 +256,15 @@ def detect_danfe(text_pages: List[str]) -> Tuple[bool, Optional[str], Optional[s
 
     return False, None, None
 
-def decode_barcodes_from_images(images: List[Image.Image]) -> List[str]:
+def decode_barcodes_from_images(images: Sequence[Image.Image], deadline: Optional[Deadline] = None) -> List[str]:
     if not zbar_decode:
         return []
     values = []
-    for img in images:
-        for code in zbar_decode(img):
+    for i in range(len(images)):
+        if deadline is not None and deadline.over("codigos_barras"):
+            deadline.note("codigos_barras", f"leitura interrompida: {len(images) - i} página(s) não lidas")
+            break
+        for code in zbar_decode(images[i]):
             try:
                 val = code.data.decode("utf-8")
                 values.append(val)
@@ -187,260 +309,359 @@ def generate_code128_image(data: str) -> Image.Image:
     fp.seek(0)
     return Image.open(fp)
 
-def extract_products_without_danfe(text_pages: List[str], tracking_codes: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+def resolve_tracking_codes(text_pages: List[str], tracking_codes: List[str],
+                           produtos_map: Dict[str, List[Dict[str, Any]]], ocr: bool = True) -> List[str]:
+    """Substitui códigos lidos por OCR com erro pela chave do catálogo correspondente.
+
+    Com ocr=False (camada de texto do PDF) os códigos são exatos: nada é
+    resolvido (um MEL de outro pedido resolveria para a chave vizinha) e só o
+    filtro do dígito verificador S10 se aplica.
+    Códigos no formato S10 fora do catálogo só são mantidos com dígito
+    verificador válido (ruído não chega à composição). Além dos códigos já
+    encontrados, procura candidatos com trocas típicas do
+    OCR (O/0, I/1, B/8...) que os regex exatos não pegam; esses só entram se
+    resolverem para uma chave do catálogo ou, com letras nas duas pontas (o que
+    descarta EAN-13 e outros números), para um S10 válido.
+    """
+    index = index_for(produtos_map) if ocr else None
+    resolved = []
+    for tc in tracking_codes:
+        if tc in produtos_map:
+            key = tc
+        elif ocr:
+            key = index.resolve(tc) or canonical_s10(tc)
+        else:
+            key = tc if is_valid_s10(tc) else None
+        if key is None:
+            if TRACKING_RE.fullmatch(tc):
+                print(f"DEBUG - Tracking {tc} descartado: dígito verificador S10 inválido")
+                continue
+            key = tc  # MEL e outros formatos sem dígito verificador
+        if key != tc:
+            print(f"DEBUG - Tracking {tc} resolvido como {key}")
+        if key not in resolved:
+            resolved.append(key)
+
+    if not ocr:
+        return resolved
+    for page in text_pages:
+        for candidate in LOOSE_TRACKING_RE.findall(page.upper()):
+            if candidate in tracking_codes:
+                continue
+            key = index.resolve(candidate)
+            if not key and candidate[:2].isalpha() and candidate[11:].isalpha():
+                key = canonical_s10(candidate)
+            if key and key not in resolved:
+                print(f"DEBUG - Tracking {candidate} (OCR) resolvido como {key}")
+                resolved.append(key)
+    return resolved
+
+# Padrões do parser de blocos de produto (texto OCR sem DANFE)
+BLOCK_TRACKING_RE = re.compile(r"[A-Z]{2}\d{9}[A-Z]{2}")
+SKU_RE = re.compile(r"SKU:\s*([A-Z0-9_]+)", re.IGNORECASE)
+SKU_MARKER_RE = re.compile(r"SKU:", re.IGNORECASE)
+PRODUCT_KEYWORD_RE = re.compile(r"quantidade:|cor:|tamanho:|venda:|pack", re.IGNORECASE)
+QUANTIDADE_RE = re.compile(r"Quantidade:\s*(\d+)", re.IGNORECASE)
+COR_RE = re.compile(r"Cor:\s*(.+)", re.IGNORECASE)
+TAMANHO_RE = re.compile(r"Tamanho:\s*(.+)", re.IGNORECASE)
+# Linhas após o SKU que ainda descrevem o mesmo produto (contando linhas vazias)
+PRODUCT_WINDOW = 5
+
+
+def iter_page_lines(text_pages: Iterable[str]) -> Iterator[str]:
+    """Linhas das páginas em sequência, como em '\\n'.join(text_pages).split('\\n')."""
+    for page in text_pages:
+        yield from page.split("\n")
+
+
+def extract_products_without_danfe(text_pages: Iterable[str], tracking_codes: List[str]) -> Dict[str, List[Dict[str, Any]]]:
     """Extrai produtos do texto OCR quando não há DANFE.
     Lógica simples: após cada tracking code, todos os produtos pertencem àquela etiqueta até o próximo tracking code.
+
+    Uma única passada pelas linhas: cada SKU abre um bloco que recebe as
+    PRODUCT_WINDOW linhas seguintes e fecha antes, num novo SKU ou tracking code.
     """
-    result = {}
-    full_text = '\n'.join(text_pages)
-    
-    # Inicializar resultado para cada tracking code
-    for tracking in tracking_codes:
-        result[tracking] = []
-    
-    lines = full_text.split('\n')
+    result = {tracking: [] for tracking in tracking_codes}
+    known = set(tracking_codes)
     current_tracking = None
+    block = None  # produto em montagem: campos, tracking e linhas restantes
+    
+    def close_block():
+        product = block["produto"]
+        if not product["titulo"]:
+            product["titulo"] = f"Produto {product['sku']}"
+        result[block["tracking"]].append(product)
     
-    for i, line in enumerate(lines):
-        line = line.strip()
+    for raw in iter_page_lines(text_pages):
+        line = raw.strip()
+        
+        if block is not None:
+            if line and (BLOCK_TRACKING_RE.search(line) or SKU_MARKER_RE.search(line)):
+                # Outro tracking ou SKU: o bloco termina e a linha segue o fluxo normal
+                close_block()
+                block = None
+            else:
+                block["restantes"] -= 1
+                if line:
+                    product = block["produto"]
+                    # Nome do produto: primeira linha longa sem palavras-chave
+                    if not product["titulo"] and len(line) > 10 and not PRODUCT_KEYWORD_RE.search(line):
+                        product["titulo"] = line
+                    m = QUANTIDADE_RE.search(line)
+                    if m:
+                        product["qtd"] = int(m.group(1))
+                    m = COR_RE.search(line)
+                    if m:
+                        product["cor"] = m.group(1).strip()
+                    m = TAMANHO_RE.search(line)
+                    if m:
+                        product["tamanho"] = m.group(1).strip()
+                if block["restantes"] == 0:
+                    close_block()
+                    block = None
+        
         if not line:
             continue
         
         # Verificar se a linha contém um tracking code
-        tracking_match = re.search(r'([A-Z]{2}\d{9}[A-Z]{2})', line)
+        tracking_match = BLOCK_TRACKING_RE.search(line)
         if tracking_match:
-            found_tracking = tracking_match.group(1)
-            if found_tracking in tracking_codes:
-                current_tracking = found_tracking
+            if tracking_match.group(0) in known:
+                current_tracking = tracking_match.group(0)
             continue
         
-        # Se temos um tracking atual, processar como produto
+        # Se temos um tracking atual, a linha com SKU abre um novo produto
         if current_tracking:
-            # Buscar SKU na linha
-            sku_match = re.search(r'SKU:\s*([A-Z0-9_]+)', line, re.IGNORECASE)
+            sku_match = SKU_RE.search(line)
             if sku_match:
-                sku = sku_match.group(1)
-                
-                # Buscar nome do produto nas próximas linhas
-                product_name = ""
-                qtd = 1
-                cor = ""
-                tamanho = ""
-                
-                # Verificar as próximas 5 linhas para informações do produto
-                for j in range(i + 1, min(i + 6, len(lines))):
-                    next_line = lines[j].strip()
-                    if not next_line:
-                        continue
-                    
-                    # Parar se encontrarmos outro tracking code
-                    if re.search(r'[A-Z]{2}\d{9}[A-Z]{2}', next_line):
-                        break
-                    
-                    # Parar se encontrarmos outro SKU
-                    if re.search(r'SKU:', next_line, re.IGNORECASE):
-                        break
-                    
-                    # Buscar nome do produto (linha mais longa sem palavras-chave)
-                    if (not product_name and len(next_line) > 10 and 
-                        not re.search(r'(quantidade:|cor:|tamanho:|venda:|pack)', next_line, re.IGNORECASE)):
-                        product_name = next_line
-                    
-                    # Buscar quantidade
-                    qty_match = re.search(r'Quantidade:\s*(\d+)', next_line, re.IGNORECASE)
-                    if qty_match:
-                        qtd = int(qty_match.group(1))
-                    
-                    # Buscar cor
-                    cor_match = re.search(r'Cor:\s*(.+?)(?:\n|$)', next_line, re.IGNORECASE)
-                    if cor_match:
-                        cor = cor_match.group(1).strip()
-                    
-                    # Buscar tamanho
-                    tamanho_match = re.search(r'Tamanho:\s*(.+?)(?:\n|$)', next_line, re.IGNORECASE)
-                    if tamanho_match:
-                        tamanho = tamanho_match.group(1).strip()
-                
-                product = {
-                    'titulo': product_name if product_name else f"Produto {sku}",
-                    'sku': sku,
-                    'qtd': qtd,
-                    'cor': cor,
-                    'tamanho': tamanho
+                block = {
+                    "tracking": current_tracking,
+                    "restantes": PRODUCT_WINDOW,
+                    "produto": {"titulo": "", "sku": sku_match.group(1), "qtd": 1, "cor": "", "tamanho": ""},
                 }
-                
-                result[current_tracking].append(product)
     
+    if block is not None:
+        close_block()
     return result
 
+# Templates da etiqueta A4, montados uma única vez
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+# Código de barras na lateral superior direita, na mesma área de antes:
+# 120 x 300 pontos, 10 pontos de margem da direita e do topo
+BARCODE_BOX = fitz.Rect(PAGE_WIDTH - 130, 10, PAGE_WIDTH - 10, 310)
+BARCODE_BARS = fitz.Rect(BARCODE_BOX.x0 + 38, BARCODE_BOX.y0, BARCODE_BOX.x0 + 72, BARCODE_BOX.y1)
+BARCODE_TEMPLATE = BarcodeTemplate(BARCODE_BARS, PAGE_HEIGHT, vertical=True)
+BARCODE_FONTSIZE = 7
+
+# Estilo da tabela de produtos, similar ao formato original
+PRODUCT_TABLE_STYLE = table_style(
+    header_fontname=HELVETICA_BOLD,
+    header_fontsize=12,
+    header_background=CINZA_CLARO,
+    header_align="CENTER",
+    fontname=HELVETICA,
+    fontsize=10,
+    aligns=["CENTER", "LEFT", "CENTER"],  # Tracking centralizado, produto à esquerda, quantidade centralizada
+    row_backgrounds=[BRANCO, AZUL_CLARO],
+    grid=1,
+    padding=(6, 6, 6, 6),
+)
+# Larguras proporcionais: 25%, 65%, 10%
+PRODUCT_TABLE = TableTemplate(
+    [PAGE_WIDTH * 0.25, PAGE_WIDTH * 0.65, PAGE_WIDTH * 0.10],
+    PRODUCT_TABLE_STYLE,
+    header=['CÓDIGO/TRACKING', 'PRODUTO/CONTEÚDO', 'QTD'],
+)
+
+
+def barcode_block_ops(value: str) -> bytes:
+    """Código de barras vertical com o valor legível ao lado (lendo de baixo para cima)."""
+    fontsize = BARCODE_FONTSIZE
+    text_len = text_width(value, HELVETICA, fontsize)
+    if text_len > BARCODE_BARS.height:
+        fontsize = fontsize * BARCODE_BARS.height / text_len
+        text_len = BARCODE_BARS.height
+    x = BARCODE_BARS.x1 + 2 + fontsize * 0.75
+    y = PAGE_HEIGHT - BARCODE_BARS.y1 + (BARCODE_BARS.height - text_len) / 2
+    return BARCODE_TEMPLATE.render(value) + b"\n" + text_ops(x, y, value, HELVETICA, fontsize, rotate=90).encode("latin-1")
+
+
 def compose_output_pdf(out_path: Path,
                        tracking: str,
                        destinatario: Optional[str],
                        produtos: List[Dict[str, Any]],
-                       barcode_img: Optional[Image.Image],
+                       barcode_value: Optional[str],
                        chave: Optional[str]) -> None:
-    c = canvas.Canvas(str(out_path), pagesize=A4)
-    width, height = A4
-
-    y = height - 50
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(40, y, "ETIQUETA COMPOSTA")
-    y -= 20
-
-    c.setFont("Helvetica", 12)
-    c.drawString(40, y, f"Tracking: {tracking}")
-    y -= 16
-    if destinatario:
-        c.drawString(40, y, f"Destinatário: {destinatario}")
-        y -= 16
-
-    if chave:
-        c.drawString(40, y, f"Chave de Acesso: {chave}")
-        y -= 20
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(40, y, "Produtos:")
-    y -= 16
-    c.setFont("Helvetica", 11)
-    for p in produtos:
-        line = f"• {p.get('titulo','(sem título)')}  (SKU: {p.get('sku','-')}  Qtd: {p.get('qtd',1)})"
-        c.drawString(50, y, line)
-        y -= 14
-        if y < 120:
-            c.showPage()
-            y = height - 50
-
-    if barcode_img:
-        # Rotacionar código de barras para posição vertical
-        barcode_img_rotated = barcode_img.rotate(90, expand=True)
-        
-        # Inserir barcode na lateral superior direita da etiqueta (vertical)
-        barcode_width = 120  # Largura aumentada para garantir visibilidade completa dos 44 dígitos
-        barcode_height = 300 # Altura aumentada para acomodar 44 dígitos completos
-        
-        # Posição: lateral superior direita com margem menor
-        barcode_x = width - barcode_width - 10  # 10 pontos de margem da direita
-        barcode_y = height - barcode_height - 10  # 10 pontos de margem do topo
-        
+    with fitz_lock:
+        writer = LabelWriter()
+        width, height = A4
+        page = writer.new_page(width, height)
 
-        bio = io.BytesIO()
-        barcode_img_rotated.save(bio, format="PNG")
-        bio.seek(0)
-        c.drawImage(ImageReader(bio), barcode_x, barcode_y, 
-                   width=barcode_width, height=barcode_height, 
-                   preserveAspectRatio=True, mask='auto')
+        y = 50
+        page.insert_text((40, y), "ETIQUETA COMPOSTA", fontname=HELVETICA_BOLD, fontsize=14)
+        y += 20
 
-    c.save()
+        page.insert_text((40, y), f"Tracking: {tracking}", fontname=HELVETICA, fontsize=12)
+        y += 16
+        if destinatario:
+            page.insert_text((40, y), f"Destinatário: {destinatario}", fontname=HELVETICA, fontsize=12)
+            y += 16
 
-def compose_output_pdf_multiple(out_path: Path,
-                               tracking_info: List[Dict[str, Any]],
-                               destinatario: Optional[str],
-                               barcode_img: Optional[Image.Image],
-                               chave: Optional[str],
-                               original_etiqueta_path: Optional[Path] = None,
-                               barcode_map: Optional[Dict[str, str]] = None) -> None:
-    c = canvas.Canvas(str(out_path), pagesize=A4)
-    width, height = A4
-    
-    from reportlab.platypus import Table, TableStyle
-    from reportlab.lib import colors
+        if chave:
+            page.insert_text((40, y), f"Chave de Acesso: {chave}", fontname=HELVETICA, fontsize=12)
+            y += 20
 
-    # Converter todas as páginas originais para imagens de alta qualidade
-    original_images = []
-    etiqueta_images = []  # Apenas páginas de etiquetas (não DANFE)
+        page.insert_text((40, y), "Produtos:", fontname=HELVETICA_BOLD, fontsize=12)
+        y += 16
+        for p in produtos:
+            line = f"• {p.get('titulo','(sem título)')}  (SKU: {p.get('sku','-')}  Qtd: {p.get('qtd',1)})"
+            page.insert_text((50, y), line, fontname=HELVETICA, fontsize=11)
+            y += 14
+            if y > height - 120:
+                page = writer.new_page(width, height)
+                y = 50
+
+        if barcode_value:
+            writer.add_content(page, barcode_block_ops(barcode_value))
+
+        writer.save(str(out_path))
+
+def prepare_tracking_pages(tracking_info: List[Dict[str, Any]],
+                           barcode_value: Optional[str],
+                           original_etiqueta_path: Optional[Path] = None,
+                           barcode_map: Optional[Dict[str, str]] = None) -> Tuple[list, partial]:
+    """Entradas (tracking_info, página da etiqueta original) e a função que as compõe."""
+    # Páginas de etiqueta do original (não DANFE), copiadas como vetores na composição
+    etiqueta_pages: List[int] = []
+    is_image_input = False
     
     if original_etiqueta_path and original_etiqueta_path.exists():
         try:
             if original_etiqueta_path.suffix.lower() == ".pdf":
-                original_images = pdf_to_high_quality_images(original_etiqueta_path)
-                
                 # Filtrar apenas páginas de etiquetas (não DANFE)
                 # Assumindo que páginas DANFE contêm texto específico
-                with pdfplumber.open(str(original_etiqueta_path)) as pdf:
-                    for idx, page in enumerate(pdf.pages):
-                        page_text = page.extract_text() or ""
-                        # Se a página não contém indicadores de DANFE, é uma etiqueta
-                        if not any(keyword in page_text.upper() for keyword in ['DANFE', 'DOCUMENTO AUXILIAR', 'NOTA FISCAL ELETRÔNICA']):
-                            if idx < len(original_images):
-                                etiqueta_images.append(original_images[idx])
-                        else:
-                            print(f"Página DANFE detectada e removida: página {idx + 1}")
+                for idx, page_text in enumerate(extract_pages(original_etiqueta_path)):
+                    # Se a página não contém indicadores de DANFE, é uma etiqueta
+                    if not any(keyword in page_text.upper() for keyword in ['DANFE', 'DOCUMENTO AUXILIAR', 'NOTA FISCAL ELETRÔNICA']):
+                        etiqueta_pages.append(idx)
+                    else:
+                        print(f"Página DANFE detectada e removida: página {idx + 1}")
             else:
                 # Se for imagem diretamente
-                etiqueta_images = [Image.open(original_etiqueta_path)]
+                etiqueta_pages = [0]
+                is_image_input = True
         except Exception as e:
             print(f"Erro ao carregar etiquetas originais: {e}")
 
-    # Criar uma página para cada tracking code com sua etiqueta correspondente
-    for idx, info in enumerate(tracking_info):
+    # Cada tracking é independente: 1º código = 1ª etiqueta, etc.
+    entries = [(info, etiqueta_pages[idx] if idx < len(etiqueta_pages) else None)
+               for idx, info in enumerate(tracking_info)]
+    render = partial(render_tracking_pages, etiqueta_path=original_etiqueta_path,
+                     is_image_input=is_image_input, barcode_map=barcode_map, barcode_value=barcode_value)
+    return entries, render
+
+def compose_output_pdf_multiple(out_path: Path,
+                               tracking_info: List[Dict[str, Any]],
+                               destinatario: Optional[str],
+                               barcode_value: Optional[str],
+                               chave: Optional[str],
+                               original_etiqueta_path: Optional[Path] = None,
+                               barcode_map: Optional[Dict[str, str]] = None,
+                               progress: Optional[ProgressCallback] = None) -> None:
+    entries, render = prepare_tracking_pages(tracking_info, barcode_value, original_etiqueta_path, barcode_map)
+
+    # O próprio writer valida o documento: falha no save ou documento sem páginas gera exceção
+    try:
+        print(f"DEBUG - Salvando PDF em: {out_path}")
+        if render_workers(COMPOSE_WORKERS) > 1 and len(entries) >= COMPOSE_MIN_TRACKINGS:
+            with tempfile.TemporaryDirectory(prefix="partes_", dir=str(Path(out_path).resolve().parent)) as partes:
+                num_pages = compose_in_chunks(render, entries, str(out_path), partes,
+                                              COMPOSE_CHUNK, COMPOSE_WORKERS, progress)
+        else:
+            with fitz_lock:
+                num_pages = render(entries, str(out_path), progress=progress)
+        print(f"DEBUG - PDF salvo com sucesso: {num_pages} páginas")
+    except Exception as save_error:
+        print(f"ERRO - Falha ao salvar PDF: {save_error}")
+        raise Exception(f"Erro ao gerar PDF: {save_error}")
+
+def compose_output_pdf_split(out_dir: Path,
+                             tracking_info: List[Dict[str, Any]],
+                             barcode_value: Optional[str],
+                             original_etiqueta_path: Optional[Path] = None,
+                             barcode_map: Optional[Dict[str, str]] = None,
+                             progress: Optional[ProgressCallback] = None) -> List[Dict[str, Any]]:
+    """Um PDF por tracking em out_dir, compostos em paralelo; retorna o índice dos arquivos.
+
+    Cada arquivo é composto direto (sem gerar o documento único e separá-lo depois).
+    """
+    entries, render = prepare_tracking_pages(tracking_info, barcode_value, original_etiqueta_path, barcode_map)
+    names = entry_names(info["tracking"] for info, _ in entries)
+    paths = [str(Path(out_dir) / name) for name in names]
+    workers = COMPOSE_WORKERS if len(entries) >= COMPOSE_MIN_TRACKINGS else 1
+    try:
+        pages = render_individually(render, entries, paths, COMPOSE_CHUNK, workers, progress)
+    except Exception as save_error:
+        print(f"ERRO - Falha ao salvar PDFs separados: {save_error}")
+        raise Exception(f"Erro ao gerar PDF: {save_error}")
+    print(f"DEBUG - {len(paths)} PDF(s) separados salvos em: {out_dir}")
+    return [{"arquivo": name, "tracking": info["tracking"], "paginas": n, "produtos": len(info["produtos"])}
+            for name, (info, _), n in zip(names, entries, pages)]
+
+def render_tracking_pages(entries: List[Tuple[Dict[str, Any], Optional[int]]],
+                          out_path: str,
+                          etiqueta_path: Optional[Path] = None,
+                          is_image_input: bool = False,
+                          barcode_map: Optional[Dict[str, str]] = None,
+                          barcode_value: Optional[str] = None,
+                          progress: Optional[ProgressCallback] = None) -> int:
+    """Uma página por (tracking_info, página da etiqueta original); retorna as páginas salvas.
+
+    Também roda por bloco nos processos de composição, então só recebe dados
+    serializáveis e abre a etiqueta original por conta própria.
+    """
+    writer = LabelWriter()
+    width, height = A4
+    for idx, (info, etiqueta_page) in enumerate(entries):
         tracking = info["tracking"]
         produtos = info["produtos"]
+        page = writer.new_page(width, height)
+        ops = []
         
-        # Desenhar a etiqueta original correspondente (1º código = 1ª etiqueta, etc.)
-        if idx < len(etiqueta_images):
+        # Desenhar a etiqueta original correspondente
+        if etiqueta_page is not None:
             try:
-                original_img = etiqueta_images[idx]
-                
-                # Converter para bytes para usar com ImageReader, mantendo qualidade máxima
-                img_bytes = io.BytesIO()
-                original_img.save(img_bytes, format='PNG', optimize=False, quality=100)
-                img_bytes.seek(0)
-                img_reader = ImageReader(img_bytes)
-                
-                # Calcular dimensões para deixar espaço para a tabela
-                # Etiqueta ocupa 70% da altura da página
+                # Etiqueta ocupa 70% da altura da página, centralizada na parte superior
                 img_height = height * 0.70
                 img_width = width * 0.95
-                
-                # Centralizar a imagem na parte superior
                 x_offset = (width - img_width) / 2
-                y_offset = height - img_height - 30  # 30 pontos de margem superior
-                
-                # Desenhar a etiqueta original
-                c.drawImage(img_reader, x_offset, y_offset, 
-                          width=img_width, height=img_height, 
-                          preserveAspectRatio=True, anchor='c')
+                box = fitz.Rect(x_offset, 30, x_offset + img_width, 30 + img_height)
+
+                if is_image_input:
+                    writer.insert_image_file(page, box, str(etiqueta_path))
+                else:
+                    writer.show_page(page, box, str(etiqueta_path), etiqueta_page)
                 
                 # ADICIONAR CÓDIGO DE BARRAS ESPECÍFICO PARA ESTE TRACKING (se disponível)
-                current_barcode_img = None
+                current_barcode_value = None
                 if barcode_map and tracking in barcode_map:
-                    # Gerar código de barras específico para este tracking
-                    barcode_value = barcode_map[tracking]
-                    print(f"DEBUG - Gerando código de barras específico para {tracking}: {barcode_value}")
-                    current_barcode_img = generate_code128_image(barcode_value)
-                elif barcode_img:
+                    current_barcode_value = barcode_map[tracking]
+                    print(f"DEBUG - Gerando código de barras específico para {tracking}: {current_barcode_value}")
+                elif barcode_value:
                     # Fallback para o código de barras padrão
-                    current_barcode_img = barcode_img
+                    current_barcode_value = barcode_value
                 
-                if current_barcode_img:
-                    # Rotacionar código de barras para posição vertical
-                    barcode_img_rotated = current_barcode_img.rotate(90, expand=True)
-                    
-                    # Inserir barcode na lateral superior direita da etiqueta (vertical)
-                    barcode_width = 120  # Largura aumentada para garantir visibilidade completa dos 44 dígitos
-                    barcode_height = 300 # Altura aumentada para acomodar 44 dígitos completos
-                    
-                    # Posição: lateral superior direita com margem menor
-                    barcode_x = width - barcode_width - 10  # 10 pontos de margem da direita
-                    barcode_y = height - barcode_height - 10  # 10 pontos de margem do topo
-                    
-
-                    bio = io.BytesIO()
-                    barcode_img_rotated.save(bio, format="PNG")
-                    bio.seek(0)
-                    c.drawImage(ImageReader(bio), barcode_x, barcode_y, 
-                               width=barcode_width, height=barcode_height, 
-                               preserveAspectRatio=True, mask='auto')
+                if current_barcode_value:
+                    ops.append(barcode_block_ops(current_barcode_value))
                 
             except Exception as e:
-                print(f"Erro ao incluir etiqueta {idx + 1}: {e}")
+                print(f"Erro ao incluir etiqueta de {tracking}: {e}")
 
         # Criar tabela com informações do produto específico desta etiqueta
+        # (o cabeçalho já está compilado no template)
         table_data = []
         
-        # Cabeçalho da tabela
-        table_data.append(['CÓDIGO/TRACKING', 'PRODUTO/CONTEÚDO', 'QTD'])
-        
         # Adicionar produtos deste tracking específico
         for p in produtos:
             titulo = p.get('titulo', '(sem título)')
@@ -460,97 +681,52 @@ def compose_output_pdf_multiple(out_path: Path,
             
             table_data.append([tracking, produto_completo, str(qtd)])
         
-        # Criar tabela com larguras proporcionais
-        col_widths = [width * 0.25, width * 0.65, width * 0.10]  # 25%, 65%, 10%
-        table = Table(table_data, colWidths=col_widths)
-        
-        # Estilo da tabela similar ao formato original
-        table_style = TableStyle([
-            # Cabeçalho
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.black),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            
-            # Dados
-            ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('ALIGN', (0, 1), (0, -1), 'CENTER'),  # Tracking centralizado
-            ('ALIGN', (1, 1), (1, -1), 'LEFT'),    # Produto à esquerda
-            ('ALIGN', (2, 1), (2, -1), 'CENTER'),  # Quantidade centralizada
-            ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 10),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightblue]),
-            
-            # Bordas
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            
-            # Padding
-            ('LEFTPADDING', (0, 0), (-1, -1), 6),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ])
-        
-        table.setStyle(table_style)
-        
-        # Posicionar a tabela na parte inferior da página
-        table_width, table_height = table.wrap(width, height)
-        table_x = (width - table_width) / 2  # Centralizar horizontalmente
-        table_y = 50  # 50 pontos da margem inferior
-        
-        # Desenhar a tabela
-        table.drawOn(c, table_x, table_y)
-        
-        # Nova página para o próximo tracking (exceto na última iteração)
-        if idx < len(tracking_info) - 1:
-            c.showPage()
+        # Tabela na parte inferior da página, a 50 pontos da margem
+        layout = PRODUCT_TABLE.measure(table_data)
+        table_top = height - 50 - PRODUCT_TABLE.height(layout)
+        table_x = (width - PRODUCT_TABLE.total_width) / 2
+        ops.append(PRODUCT_TABLE.render(table_x, table_top, height, layout))
+        writer.add_content(page, b"\n".join(ops))
+        if progress:
+            progress("composicao", idx + 1, len(entries))
 
-    # Código de barras agora é adicionado diretamente em cada etiqueta no loop acima
-    try:
-        print(f"DEBUG - Salvando PDF em: {out_path}")
-        c.save()
-        print(f"DEBUG - PDF salvo com sucesso")
-        
-        # Verificar se o arquivo foi criado e tem tamanho válido
-        if out_path.exists():
-            file_size = out_path.stat().st_size
-            print(f"DEBUG - Arquivo criado com tamanho: {file_size} bytes")
-            
-            # Tentar validar o PDF criado
-            try:
-                with pdfplumber.open(str(out_path)) as pdf:
-                    num_pages = len(pdf.pages)
-                    print(f"DEBUG - PDF validado com sucesso: {num_pages} páginas")
-            except Exception as validation_error:
-                print(f"ERRO - PDF criado está corrompido: {validation_error}")
-                raise Exception(f"PDF gerado está corrompido: {validation_error}")
-        else:
-            print(f"ERRO - Arquivo PDF não foi criado: {out_path}")
-            raise Exception("Arquivo PDF não foi criado")
-            
-    except Exception as save_error:
-        print(f"ERRO - Falha ao salvar PDF: {save_error}")
-        raise Exception(f"Erro ao gerar PDF: {save_error}")
+    return writer.save(out_path)
 
 def process_etiqueta(etiqueta_path: str,
                      produtos_map: Dict[str, List[Dict[str, Any]]],
-                     out_pdf_path: str = "etiqueta_composta.pdf") -> Dict[str, Any]:
+                     out_pdf_path: str = "etiqueta_composta.pdf",
+                     progress: Optional[ProgressCallback] = None,
+                     memory: Optional[MemoryTracker] = None,
+                     deadline: Optional[Deadline] = None,
+                     split_dir: Optional[str] = None) -> Dict[str, Any]:
+    """Lê a etiqueta, associa produtos a cada tracking e compõe a saída.
+
+    Com split_dir, em vez de out_pdf_path é gerado um PDF por tracking nesse
+    diretório, listado em result['arquivos'].
+    """
     path = Path(etiqueta_path)
     text_pages = []
+    # O texto já veio de OCR (com a página endireitada): repetir não acrescenta nada
+    ocr_done = False
     if path.suffix.lower() == ".pdf":
-        text_pages = read_pdf_text(path)
+        with track(memory, "leitura"), timed(deadline, "leitura"):
+            text_pages = read_pdf_text(path, progress)
         # OCR fallback se muito vazio
         if not any(text_pages):
-            imgs = pdf_to_images(path)
-            text_pages = [ocr_image(img) for img in imgs]
+            with track(memory, "ocr"), timed(deadline, "ocr"):
+                imgs = pdf_to_images(path, memory, deadline)
+                text_pages = ocr_pages(imgs, progress, deadline)
+            ocr_done = True
     else:
-        # imagem
-        img = Image.open(path)
-        text_pages = [ocr_image(img)]
+        # imagem: decodificada uma vez para a orientação e os códigos de barras;
+        # sem correção, o Tesseract lê o arquivo original (sem PNG temporário)
+        page_image = Image.open(path)
+        with track(memory, "ocr"), timed(deadline, "ocr"):
+            text_pages = ocr_pages([page_image], progress, deadline)
+        ocr_done = True
+
+    # Páginas lidas por OCR, as únicas em que os códigos podem ter erro de leitura
+    ocr_text_pages = text_pages if ocr_done else []
 
     # Buscar TODOS os tracking codes no texto
     all_tracking_codes = []
@@ -567,12 +743,13 @@ def process_etiqueta(etiqueta_path: str,
             if match not in all_tracking_codes:
                 all_tracking_codes.append(match)
 
-    # Se não encontrou nenhum, tentar com OCR
-    if not all_tracking_codes:
+    # Se não encontrou nenhum no texto do PDF, tentar com OCR
+    if not all_tracking_codes and not ocr_done:
         if path.suffix.lower() == ".pdf":
-            imgs = pdf_to_images(path)
-            ocr_pages = [ocr_image(img) for img in imgs]
-            for page in ocr_pages:
+            with track(memory, "ocr_rastreio"), timed(deadline, "ocr_rastreio"):
+                ocr_text = ocr_pages(pdf_to_images(path, memory, deadline), progress, deadline, "ocr_rastreio")
+            ocr_text_pages = ocr_text
+            for page in ocr_text:
                 # Buscar padrão tradicional
                 matches = re.findall(r'[A-Z]{2}\d{9}[A-Z]{2}', page)
                 for match in matches:
@@ -585,23 +762,43 @@ def process_etiqueta(etiqueta_path: str,
                     if match not in all_tracking_codes:
                         all_tracking_codes.append(match)
 
+    # Corrigir códigos com erros de OCR resolvendo contra as chaves do catálogo;
+    # os da camada de texto só passam pelo filtro do dígito verificador
+    all_tracking_codes = resolve_tracking_codes(ocr_text_pages, all_tracking_codes, produtos_map,
+                                                ocr=bool(ocr_text_pages))
+
     # Usar o primeiro tracking code como principal (para compatibilidade)
     tracking = all_tracking_codes[0] if all_tracking_codes else None
 
     # detectar DANFE
     is_danfe, destinatario, chave = detect_danfe(text_pages)
 
-    # tentar ler códigos de barras da imagem (se PDF: rasterizar)
+    # Chaves de acesso verificadas (módulo 11) presentes no texto, em ordem
+    text_chaves = find_chaves_acesso("\n".join(text_pages)) if is_danfe else []
+
+    # tentar ler códigos de barras da imagem (se PDF: rasterizar). Se todo
+    # tracking já tem uma chave verificada vinda do texto, a leitura não
+    # acrescentaria nada e a rasterização é evitada.
     barcode_values = []
-    try:
-        imgs = pdf_to_images(path) if path.suffix.lower() == ".pdf" else [Image.open(path)]
-        barcode_values = decode_barcodes_from_images(imgs) if imgs else []
-    except Exception:
-        pass
+    if text_chaves and len(text_chaves) >= max(len(all_tracking_codes), 1):
+        print(f"DEBUG - {len(text_chaves)} chave(s) verificada(s) no texto; leitura de códigos de barras ignorada")
+    elif deadline is not None and deadline.degraded("codigos_barras"):
+        # Primeira redução do prazo: as chaves do texto (se houver) continuam valendo
+        deadline.note("codigos_barras", "leitura de códigos de barras pulada")
+    else:
+        try:
+            with track(memory, "codigos_barras"), timed(deadline, "codigos_barras"):
+                imgs = pdf_to_images(path, memory, deadline) if path.suffix.lower() == ".pdf" else [page_image]
+                barcode_values = decode_barcodes_from_images(imgs, deadline) if imgs else []
+        except MemoryBudgetExceeded:
+            raise
+        except Exception:
+            pass
 
     # Mapear códigos de barras para tracking codes específicos
     barcode_map = {}  # tracking_code -> barcode_value
     barcode_img = None
+    chosen_bar_val = None
     barcode_base64 = None
 
     # Debug: imprimir valores encontrados
@@ -614,15 +811,19 @@ def process_etiqueta(etiqueta_path: str,
         # Encontrar todos os códigos de barras de 44 dígitos
         valid_barcodes = []
         
-        # PRIORIDADE 1: Usar a chave extraída do texto (mais confiável)
+        # PRIORIDADE 1: Usar as chaves extraídas do texto (mais confiável)
         if chave:
             valid_barcodes.append(chave)
             print(f"DEBUG - Adicionando chave de acesso extraída: {chave}")
+        for text_chave in text_chaves:
+            if text_chave not in valid_barcodes:
+                valid_barcodes.append(text_chave)
+                print(f"DEBUG - Adicionando chave de acesso extraída: {text_chave}")
         
-        # PRIORIDADE 2: Procurar nos códigos de barras lidos
+        # PRIORIDADE 2: Procurar nos códigos de barras lidos (só chaves com DV válido)
         for val in barcode_values:
             clean_val = re.sub(r"\D", "", val or "")
-            if re.fullmatch(r"\d{44}", clean_val) and clean_val not in valid_barcodes:
+            if is_valid_chave(clean_val) and clean_val not in valid_barcodes:
                 valid_barcodes.append(clean_val)
                 print(f"DEBUG - Adicionando código de barras lido: {clean_val}")
 
@@ -690,8 +891,15 @@ def process_etiqueta(etiqueta_path: str,
     print(f"DEBUG - Produtos totais: {len(all_produtos)}")
     
     try:
-        compose_output_pdf_multiple(Path(out_pdf_path), all_tracking_info, destinatario, barcode_img, chave, path, barcode_map)
-        print(f"DEBUG - PDF gerado com sucesso: {out_pdf_path}")
+        with track(memory, "composicao"), timed(deadline, "composicao"):
+            if split_dir:
+                arquivos = compose_output_pdf_split(Path(split_dir), all_tracking_info, chosen_bar_val, path, barcode_map, progress)
+            else:
+                arquivos = None
+                compose_output_pdf_multiple(Path(out_pdf_path), all_tracking_info, destinatario, chosen_bar_val, chave, path, barcode_map, progress)
+                print(f"DEBUG - PDF gerado com sucesso: {out_pdf_path}")
+    except MemoryBudgetExceeded:
+        raise
     except Exception as pdf_error:
         print(f"ERRO - Falha na geração do PDF: {pdf_error}")
         raise Exception(f"Erro ao gerar PDF: {pdf_error}")
@@ -706,7 +914,10 @@ def process_etiqueta(etiqueta_path: str,
         "barcode_base64": barcode_base64,
         "produtos": all_produtos,
         "tracking_info": all_tracking_info,
-        "saida_pdf": out_pdf_path
+        "saida_pdf": None if split_dir else out_pdf_path,
+        "arquivos": arquivos,
+        "memoria": memory.report() if memory is not None else None,
+        "prazo": deadline.report() if deadline is not None else None
     }
 
 # ------------------ EXEMPLO DE USO ------------------
@@ -0,0 +1,374 @@
+# profiling.py
+"""Perfis por amostragem de requisições reais, sob demanda.
+
+Uma fração das requisições de processamento (PROFILE_SAMPLE_RATE) e as que
+chegam com o cabeçalho X-Profile igual a PROFILE_TOKEN são perfiladas (sem
+PROFILE_TOKEN o cabeçalho é ignorado e as rotas /admin/perfis respondem 404).
+Uma thread lê a pilha da thread da requisição a cada PROFILE_INTERVAL_MS com
+sys._current_frames(), sem instrumentar o código: o custo é o mesmo qualquer
+que seja o caminho percorrido, e requisições não selecionadas não pagam nada.
+
+Cada perfil é gravado em PROFILE_DIR em dois arquivos:
+
+- <id>.collapsed.txt: pilhas no formato "a;b;c peso" (peso em microssegundos),
+  lido por flamegraph.pl, inferno e speedscope;
+- <id>.json: metadados da requisição e tempo próprio/total por função.
+
+O pipeline do shein roda num processo do pool: lá um amostrador próprio grava
+as pilhas num arquivo, que é juntado ao perfil da requisição sob a raiz
+"[pipeline]". Workers do spool e pools de composição não são amostrados.
+
+As rotas /admin/perfis (cabeçalho X-Profile com o PROFILE_TOKEN) listam as
+requisições lentas recentes com seus perfis.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import uuid
+import random
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from flask import Blueprint, abort, jsonify, request, send_file
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'perfis')
+# Perfis mantidos em disco e duração mínima para a lista de requisições lentas
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 1000))
+PROFILE_HEADER = 'X-Profile'
+# Rotas perfiladas (endpoints do Flask)
+PROFILED_ENDPOINTS = {'upload_file', 'shein.processar_pdf'}
+# Funções listadas no JSON do perfil
+TOP_FUNCTIONS = 50
+WORKER_ROOT = '[pipeline]'
+
+_active = threading.local()
+
+
+def frame_label(code) -> str:
+    # ';' separa os quadros no formato collapsed
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class StackSampler:
+    """Amostra a pilha de uma thread em segundo plano; peso de cada pilha em microssegundos."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL, skip: int = 0):
+        self.thread_id = thread_id
+        self.interval = interval
+        # Quadros mais externos descartados (herdados do pai num processo do pool)
+        self.skip = skip
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            # Peso = tempo real desde a amostra anterior (o GIL pode atrasar a thread)
+            self.stacks[tuple(reversed(stack))[self.skip:]] += int((now - last) * 1e6)
+            self.samples += 1
+            last = now
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def write_collapsed(stacks: Counter, path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, weight in stacks.items():
+            if weight > 0:
+                f.write(f"{';'.join(stack)} {weight}\n")
+
+
+def read_collapsed(path: str) -> Counter:
+    stacks: Counter = Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stack, _, weight = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[tuple(stack.split(';'))] += int(weight)
+    return stacks
+
+
+def function_table(stacks: Counter, limit: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+    """Tempo próprio (topo da pilha) e total (em qualquer posição) por função, em ms."""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, weight in stacks.items():
+        own[stack[-1]] += weight
+        # Recursão conta uma vez por pilha
+        for name in set(stack):
+            total[name] += weight
+    rows = [{'funcao': name, 'proprio_ms': round(own[name] / 1000, 1), 'total_ms': round(weight / 1000, 1)}
+            for name, weight in total.items()]
+    rows.sort(key=lambda r: (r['proprio_ms'], r['total_ms']), reverse=True)
+    return rows[:limit]
+
+
+class ProfileStore:
+    """Perfis gravados em disco, com índice em memória dos mais recentes."""
+
+    def __init__(self, folder: str, keep: int):
+        self.folder = folder
+        self.keep = keep
+        self._index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+
+    def _scan(self) -> None:
+        """Recarrega o índice dos perfis de execuções anteriores."""
+        records = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.folder, name), encoding='utf-8') as f:
+                        record = json.load(f)
+                    records.append({k: v for k, v in record.items() if k != 'funcoes'})
+                except (OSError, ValueError):
+                    continue
+        for record in sorted(records, key=lambda r: r['inicio'])[-self.keep:]:
+            self._index[record['id']] = record
+
+    def path_for(self, profile_id: str, kind: str) -> str:
+        return os.path.join(self.folder, f"{profile_id}.{kind}")
+
+    def save(self, record: Dict[str, Any], stacks: Counter) -> None:
+        write_collapsed(stacks, self.path_for(record['id'], 'collapsed.txt'))
+        with open(self.path_for(record['id'], 'json'), 'w', encoding='utf-8') as f:
+            json.dump({**record, 'funcoes': function_table(stacks)}, f, ensure_ascii=False, indent=2)
+        with self._lock:
+            self._index[record['id']] = record
+            while len(self._index) > self.keep:
+                old_id, _ = self._index.popitem(last=False)
+                for kind in ('collapsed.txt', 'json'):
+                    try:
+                        os.remove(self.path_for(old_id, kind))
+                    except OSError:
+                        pass
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if profile_id not in self._index:
+                return None
+        with open(self.path_for(profile_id, 'json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def slow(self, min_ms: float, limit: int) -> List[Dict[str, Any]]:
+        """Requisições mais recentes com duração >= min_ms."""
+        with self._lock:
+            records = [dict(r) for r in reversed(self._index.values()) if r['duracao_ms'] >= min_ms]
+        return records[:limit]
+
+
+store: Optional[ProfileStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ProfileStore:
+    global store
+    with _store_lock:
+        if store is None:
+            store = ProfileStore(PROFILE_DIR, PROFILE_KEEP)
+        return store
+
+
+def profile_reason() -> Optional[str]:
+    """Motivo para perfilar a requisição atual, ou None."""
+    if has_token():
+        return 'cabecalho'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'amostragem'
+    return None
+
+
+class RequestProfile:
+    """Perfil da requisição em andamento nesta thread."""
+
+    def __init__(self, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.reason = reason
+        self.started = time.time()
+        self.sampler = StackSampler(threading.get_ident()).start()
+        self.worker_stacks: Counter = Counter()
+        self.status: Optional[int] = None
+
+    def finish(self, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        self.sampler.stop()
+        stacks = self.sampler.stacks + self.worker_stacks
+        upload = next(iter(request.files.values()), None)
+        record = {
+            'id': self.id,
+            'rota': request.path,
+            'endpoint': request.endpoint,
+            'arquivo': upload.filename if upload else None,
+            'motivo': self.reason,
+            'inicio': self.started,
+            'duracao_ms': round((time.time() - self.started) * 1000, 1),
+            'status': self.status if error is None else 500,
+            'erro': str(error) if error else None,
+            'amostras': self.sampler.samples,
+            'perfil_url': f"/admin/perfis/{self.id}/collapsed",
+            'detalhes_url': f"/admin/perfis/{self.id}",
+        }
+        get_store().save(record, stacks)
+        print(f"Perfil {self.id}: {record['rota']} em {record['duracao_ms']:.0f} ms "
+              f"({record['amostras']} amostras, {self.reason})")
+        return record
+
+
+def current() -> Optional[RequestProfile]:
+    return getattr(_active, 'profile', None)
+
+
+# ---- processo do pipeline (pool do shein) ----
+
+def worker_profile_path() -> Optional[str]:
+    """Arquivo para o processo do pipeline gravar suas pilhas, se esta requisição é perfilada."""
+    profile = current()
+    if profile is None:
+        return None
+    return os.path.abspath(get_store().path_for(f"{profile.id}_pipeline_{uuid.uuid4().hex[:6]}", 'collapsed.txt'))
+
+
+@contextmanager
+def sample_to(path: Optional[str]):
+    """No processo do pipeline: amostra a thread atual e grava as pilhas em path."""
+    if not path:
+        yield
+        return
+    # As pilhas começam na função que abriu o contexto (0: este gerador, 1: __enter__)
+    caller = sys._getframe(2)
+    skip = 0
+    while caller.f_back is not None:
+        caller = caller.f_back
+        skip += 1
+    sampler = StackSampler(threading.get_ident(), skip=skip).start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        write_collapsed(sampler.stacks, path)
+
+
+def merge_worker_profile(path: Optional[str]) -> None:
+    """Junta as pilhas gravadas pelo processo do pipeline ao perfil da requisição."""
+    profile = current()
+    if not path or profile is None:
+        return
+    try:
+        for stack, weight in read_collapsed(path).items():
+            profile.worker_stacks[(WORKER_ROOT,) + stack] += weight
+        os.remove(path)
+    except OSError as e:
+        print(f"Perfil {profile.id}: pilhas do pipeline indisponíveis: {e}")
+
+
+# ---- integração com o Flask ----
+
+profiling_api = Blueprint('profiling', __name__)
+
+
+@profiling_api.before_app_request
+def _start_profile():
+    if request.endpoint not in PROFILED_ENDPOINTS:
+        return
+    reason = profile_reason()
+    if reason:
+        _active.profile = RequestProfile(reason)
+
+
+@profiling_api.after_app_request
+def _profile_header(response):
+    profile = current()
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers['X-Profile-Id'] = profile.id
+    return response
+
+
+@profiling_api.teardown_app_request
+def _finish_profile(error):
+    profile = current()
+    if profile is None:
+        return
+    _active.profile = None
+    try:
+        profile.finish(error)
+    except Exception as e:
+        print(f"Perfil {profile.id}: erro ao gravar: {e}")
+
+
+def has_token() -> bool:
+    """True se a requisição traz o PROFILE_TOKEN no cabeçalho X-Profile (nunca sem token configurado)."""
+    header = request.headers.get(PROFILE_HEADER)
+    return bool(PROFILE_TOKEN and header) and hmac.compare_digest(header.encode(), PROFILE_TOKEN.encode())
+
+
+def _check_token():
+    # Sem token configurado as rotas de administração não existem
+    if not PROFILE_TOKEN:
+        abort(404)
+    if not has_token():
+        abort(403)
+
+
+@profiling_api.route('/admin/perfis')
+def list_profiles():
+    """Requisições perfiladas recentes, mais lentas que ?min_ms (padrão PROFILE_SLOW_MS)."""
+    _check_token()
+    try:
+        min_ms = float(request.args.get('min_ms', PROFILE_SLOW_MS))
+        limit = int(request.args.get('limite', 50))
+    except ValueError:
+        return jsonify({'erro': 'Parâmetros inválidos'}), 400
+    return jsonify({
+        'amostragem': PROFILE_SAMPLE_RATE,
+        'intervalo_ms': PROFILE_INTERVAL * 1000,
+        'min_ms': min_ms,
+        'perfis': get_store().slow(min_ms, limit),
+    })
+
+
+@profiling_api.route('/admin/perfis/<profile_id>')
+def profile_details(profile_id):
+    _check_token()
+    record = get_store().get(profile_id) if profile_id.isalnum() else None
+    if record is None:
+        return jsonify({'erro': 'Perfil não encontrado'}), 404
+    return jsonify(record)
+
+
+@profiling_api.route('/admin/perfis/<profile_id>/collapsed')
+def profile_collapsed(profile_id):
+    """Pilhas no formato collapsed (flamegraph.pl, inferno, speedscope)."""
+    _check_token()
+    if not profile_id.isalnum() or get_store().get(profile_id) is None:
+        return jsonify({'erro': 'Perfil não encontrado'}), 404
+    return send_file(os.path.abspath(get_store().path_for(profile_id, 'collapsed.txt')),
+                     mimetype='text/plain', as_attachment=True,
+                     download_name=f"{profile_id}.collapsed.txt", max_age=0)
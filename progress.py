@@ -0,0 +1,257 @@
+# progress.py
+"""Acompanhamento de progresso dos processamentos, publicado via Server-Sent Events.
+
+O pipeline recebe um callback progress(etapa, feitos, total) e o tracker guarda
+o estado de cada job. A rota /progress/<job_id> transmite esse estado (com
+taxa e ETA por etapa) enquanto o job roda.
+
+Sem pasta compartilhada o estado fica só na memória do processo: com vários
+processos web, o /progress só funciona se cair no mesmo processo do upload.
+Com PROGRESS_DIR (por padrão <SPOOL_DIR>/progress quando há fila compartilhada)
+cada job também é gravado num arquivo JSON, e qualquer processo transmite o
+progresso de um job que roda em outro lendo esse arquivo.
+"""
+import os
+import re
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+ProgressCallback = Callable[[str, int, int], None]
+
+JOB_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# Intervalo mínimo entre gravações do arquivo de um job e leitura do de outro processo
+SAVE_INTERVAL = 0.2
+POLL_INTERVAL = 0.5
+
+# Nomes das etapas exibidos no front-end
+STAGE_LABELS = {
+    "leitura": "Páginas lidas",
+    "ocr": "Páginas com OCR",
+    "composicao": "Etiquetas compostas",
+}
+
+
+def valid_job_id(job_id: Optional[str]) -> bool:
+    return bool(job_id) and bool(JOB_ID_RE.match(job_id))
+
+
+class ProgressTracker:
+    """Estado de progresso de jobs, seguro entre threads.
+
+    Com folder, o estado de cada job também vai para folder/<job_id>.json,
+    visível para os outros processos que usam a mesma pasta.
+    """
+
+    def __init__(self, ttl: float = 900.0, folder: Optional[str] = None):
+        self.ttl = ttl
+        self.folder = folder
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._cond = threading.Condition()
+        self._purged_files = 0.0
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def _purge(self) -> None:
+        # Chamado com o lock adquirido
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if now - job["updated"] > self.ttl:
+                del self._jobs[job_id]
+        if self.folder and now - self._purged_files > 60:
+            self._purged_files = now
+            for name in os.listdir(self.folder):
+                path = os.path.join(self.folder, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.folder, f"{job_id}.json")
+
+    def _save(self, job: Dict[str, Any], force: bool = True) -> None:
+        # Chamado com o lock adquirido
+        if not self.folder or (not force and job["updated"] - job.get("saved", 0) < SAVE_INTERVAL):
+            return
+        job["saved"] = job["updated"]
+        path = self._path(job["job_id"])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(job, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Progresso: erro ao gravar {path}: {e}")
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado gravado por outro processo, ou None."""
+        if not self.folder:
+            return None
+        return read_progress_file(self._path(job_id)) or None
+
+    def start(self, job_id: str) -> None:
+        now = time.time()
+        with self._cond:
+            self._purge()
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "running",
+                "stage": None,
+                "stages": {},
+                "started": now,
+                "updated": now,
+                "version": 0,
+                "error": None,
+            }
+            self._save(self._jobs[job_id])
+            self._cond.notify_all()
+
+    def update(self, job_id: str, stage: str, done: int, total: int) -> None:
+        now = time.time()
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            # A etapa começou, no máximo, na última atualização recebida do job
+            info = job["stages"].setdefault(stage, {"started": job["updated"]})
+            info["done"] = done
+            info["total"] = total
+            info["updated"] = now
+            job["stage"] = stage
+            job["updated"] = now
+            job["version"] += 1
+            self._save(job, force=done >= total)
+            self._cond.notify_all()
+
+    def finish(self, job_id: str, error: Optional[str] = None) -> None:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["status"] = "error" if error else "done"
+            job["error"] = error
+            job["updated"] = time.time()
+            job["version"] += 1
+            self._save(job)
+            self._cond.notify_all()
+
+    def reporter(self, job_id: Optional[str]) -> Optional[ProgressCallback]:
+        """Callback para o pipeline, ou None se não há job a acompanhar."""
+        if not job_id:
+            return None
+        return lambda stage, done, total: self.update(job_id, stage, done, total)
+
+    def snapshot(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return _public_state(job)
+        job = self._read(job_id)
+        return _public_state(job) if job is not None else None
+
+    def stream(self, job_id: str, wait_start: float = 30.0, keepalive: float = 15.0) -> Iterator[str]:
+        """Eventos SSE até o job terminar.
+
+        O cliente pode se inscrever antes de enviar o upload: o job é aguardado
+        por até wait_start segundos. Um job de outro processo é acompanhado
+        pelo arquivo na pasta compartilhada, lido a cada POLL_INTERVAL.
+        """
+        last_version = -1
+        deadline = time.time() + wait_start
+        last_sent = time.time()
+        while True:
+            state = None
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if job is not None and job["version"] == last_version:
+                    self._cond.wait(keepalive)
+                    job = self._jobs.get(job_id)
+                local = job is not None
+                if local and job["version"] != last_version:
+                    version, state = job["version"], _public_state(job)
+            if not local:
+                job = self._read(job_id)
+                if job is None and time.time() > deadline:
+                    yield _sse("erro", {"job_id": job_id, "error": "Job não encontrado"})
+                    return
+                if job is not None and job["version"] != last_version:
+                    version, state = job["version"], _public_state(job)
+                else:
+                    # Acorda antes se o job começar neste processo
+                    with self._cond:
+                        self._cond.wait(POLL_INTERVAL)
+                    if time.time() - last_sent < 1.0:
+                        continue
+            last_sent = time.time()
+            if state is None:
+                yield ": keepalive\n\n"
+                continue
+            last_version = version
+            yield _sse("progresso", state)
+            if state["status"] != "running":
+                return
+
+
+def _public_state(job: Dict[str, Any]) -> Dict[str, Any]:
+    now = time.time()
+    stages = {}
+    for name, info in job["stages"].items():
+        elapsed = max(info["updated"] - info["started"], 1e-6)
+        done, total = info["done"], info["total"]
+        rate = done / elapsed if done else 0.0
+        eta = (total - done) / rate if rate and total else None
+        stages[name] = {
+            "label": STAGE_LABELS.get(name, name),
+            "done": done,
+            "total": total,
+            "rate": round(rate, 2),
+            "eta": round(eta, 1) if eta is not None else None,
+        }
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "stages": stages,
+        "elapsed": round(now - job["started"], 2),
+        "error": job["error"],
+    }
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class FileProgressReporter:
+    """Callback de progresso para processos de trabalho.
+
+    Grava o estado das etapas em um arquivo JSON (substituição atômica), que o
+    processo do servidor lê com read_progress_file e repassa ao tracker.
+    """
+
+    def __init__(self, path: str, min_interval: float = 0.2):
+        self.path = path
+        self.min_interval = min_interval
+        self._stages: Dict[str, list] = {}
+        self._last_write = 0.0
+
+    def __call__(self, stage: str, done: int, total: int) -> None:
+        self._stages[stage] = [done, total]
+        now = time.time()
+        if done >= total or now - self._last_write >= self.min_interval:
+            self._last_write = now
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._stages, f)
+            os.replace(tmp, self.path)
+
+
+def read_progress_file(path: str) -> Dict[str, list]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
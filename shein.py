@@ -1,142 +1,352 @@
-from flask import Flask, request, send_file, jsonify, render_template, after_this_request
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, stream_with_context
 import fitz
-from reportlab.pdfgen import canvas
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.graphics.barcode import code128
-from reportlab.lib.utils import ImageReader
-import io
-from PIL import Image
 import re
 import time
 import os
 import traceback
 import atexit
+import json
+import shutil
 import tempfile
+import threading
+from contextlib import nullcontext
+from functools import partial
+from concurrent.futures import TimeoutError as FuturesTimeout
 from flask_cors import CORS
 
+from pdf_writer import (LabelWriter, compose_in_chunks, render_individually, render_workers, limit_render_workers,
+                        process_pool, fitz_lock, table_style, HELVETICA, HELVETICA_BOLD, BRANCO)
+from label_templates import BarcodeTemplate, TableTemplate, text_ops
+from progress import ProgressTracker, FileProgressReporter, read_progress_file, valid_job_id
+from admission import AdmissionController, AdmissionRejected, estimate_cost
+from memory import MemoryTracker, MemoryBudgetExceeded, MB, track
+from spool import Spool
+from zip_stream import INDEX_NAME, entry_names, stream_directory, zip_response_headers
+import profiling
+
 HTML_TEMPLATE = """
 
 """
 
+# Rotas de processamento, registradas neste app e no serviço unificado (app_web.py)
+shein_api = Blueprint('shein', __name__)
+
 app = Flask(__name__)
 CORS(app)  # Adiciona suporte CORS para permitir requisições de diferentes origens
 
 # Configurar limite de tamanho de upload para 50MB
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB em bytes
 
-# Lista para rastrear arquivos temporários
-temp_files = []  
+# Diretório raiz dos arquivos temporários deste processo. Cada requisição
+# recebe um subdiretório próprio (RequestWorkspace), então não há estado
+# compartilhado entre threads além da criação do diretório.
+TEMP_ROOT = tempfile.mkdtemp(prefix='shein_')
+
+# Número de processos para o pipeline de PDF. O PyMuPDF não é seguro para uso
+# em várias threads, então o trabalho pesado roda em processos separados e as
+# threads do Flask apenas aguardam o resultado. Com 0 o pipeline roda no
+# próprio processo, serializado pelo fitz_lock (ver pdf_writer).
+SHEIN_WORKERS = int(os.environ.get('SHEIN_WORKERS', os.cpu_count() or 1))
+
+# Composição paralela de manifestos grandes: processos por manifesto, pedidos
+# por bloco e mínimo de pedidos para valer a pena dividir (0 ou 1 = serial).
+# Nos processos do pipeline o pool de composição fica limitado à parte das CPUs
+# de cada um (cpu_count // SHEIN_WORKERS), para não criar SHEIN_WORKERS pools.
+SHEIN_RENDER_WORKERS = int(os.environ.get('SHEIN_RENDER_WORKERS', os.cpu_count() or 1))
+SHEIN_RENDER_CHUNK = int(os.environ.get('SHEIN_RENDER_CHUNK', 50))
+SHEIN_RENDER_MIN_ORDERS = int(os.environ.get('SHEIN_RENDER_MIN_ORDERS', 2 * SHEIN_RENDER_CHUNK))
+
+# Controle de admissão do /processar-pdf (custo = páginas do manifesto). Sem ele
+# os pedidos se acumulariam sem limite na fila do pool de processos.
+SHEIN_ADMISSION_CAPACITY = int(os.environ.get('SHEIN_ADMISSION_CAPACITY', 100 * max(1, SHEIN_WORKERS)))
+SHEIN_ADMISSION_MAX_QUEUE = int(os.environ.get('SHEIN_ADMISSION_MAX_QUEUE', 16))
+SHEIN_ADMISSION_MAX_WAIT = float(os.environ.get('SHEIN_ADMISSION_MAX_WAIT', 30))
+
+# Medição de memória por requisição e orçamento de pico (MB, 0 = sem limite),
+# aplicados dentro do processo que executa o pipeline
+MEMORY_TRACKING = os.environ.get('MEMORY_TRACKING', '0') == '1'
+MEMORY_BUDGET = int(os.environ.get('MEMORY_BUDGET_MB', 0)) * MB
+
+# Fila compartilhada (ver spool.py): com SPOOL_DIR definido os manifestos são
+# processados pelos workers em vez do pool local
+SPOOL_DIR = os.environ.get('SPOOL_DIR')
+SPOOL_WAIT = float(os.environ.get('SPOOL_WAIT', 300))
+SPOOL_MAX_PENDING = int(os.environ.get('SPOOL_MAX_PENDING', 200))
+spool = Spool(SPOOL_DIR) if SPOOL_DIR else None
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Progresso dos jobs; com PROGRESS_DIR (ou a fila compartilhada) visível para
+# todos os processos web, senão só para o processo que recebeu o upload
+PROGRESS_DIR = os.environ.get('PROGRESS_DIR') or (os.path.join(SPOOL_DIR, 'progress') if SPOOL_DIR else None)
+progress_tracker = ProgressTracker(folder=PROGRESS_DIR)
+
+admission = AdmissionController('processar-pdf', SHEIN_ADMISSION_CAPACITY,
+                                SHEIN_ADMISSION_MAX_QUEUE, SHEIN_ADMISSION_MAX_WAIT)
+
+
+class RequestWorkspace:
+    """Diretório temporário exclusivo de uma requisição.
+
+    Todos os arquivos da requisição ficam dentro dele e são removidos de uma vez
+    em cleanup(), que pode ser chamado mais de uma vez sem erro.
+    """
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='req_', dir=TEMP_ROOT)
+        self._cleaned = False
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        if self._cleaned:
+            return
+        self._cleaned = True
+        shutil.rmtree(self.path, ignore_errors=True)
+        if os.path.exists(self.path):
+            print(f"Erro ao remover diretório temporário: {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
 
-# Função para limpar arquivos temporários
-def cleanup_temp_files():
-    for file_path in temp_files:
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Arquivo temporário removido: {file_path}")
-        except Exception as e:
-            print(f"Erro ao remover arquivo temporário {file_path}: {str(e)}")
-    temp_files.clear()
+
+def cleanup_temp_root():
+    shutil.rmtree(TEMP_ROOT, ignore_errors=True)
 
 # Registrar função de limpeza para ser executada quando o aplicativo for encerrado
-atexit.register(cleanup_temp_files)
+atexit.register(cleanup_temp_root)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = process_pool(SHEIN_WORKERS, initializer=limit_render_workers,
+                                     initargs=((os.cpu_count() or 1) // SHEIN_WORKERS,))
+        return _executor
+
+
+def process_manifest(input_pdf, output_pdf, progress=None, track_memory=False, memory_budget=0,
+                     split_dir=None, profile_path=None):
+    """Executa extração + composição.
+
+    Com split_dir, gera um PDF por pedido nesse diretório (e o índice
+    INDEX_NAME) em vez de output_pdf. Com profile_path (processo de trabalho
+    de uma requisição perfilada), as pilhas são amostradas e gravadas nele.
+    Retorna (quantidade de DANFEs processadas, relatório de memória ou None).
+    """
+    memory = MemoryTracker(memory_budget, trace_python=track_memory) if track_memory or memory_budget else None
+    try:
+        with profiling.sample_to(profile_path):
+            with track(memory, "leitura"):
+                extracted_data = extract_text_from_pdf(input_pdf, progress)
+            if extracted_data:
+                if memory is not None:
+                    # O documento de saída fica inteiro na memória até o save
+                    memory.require("composicao", os.path.getsize(input_pdf))
+                with track(memory, "composicao"):
+                    if split_dir:
+                        arquivos = create_split_pdfs(split_dir, extracted_data, input_pdf, progress)
+                        with open(os.path.join(split_dir, INDEX_NAME), 'w', encoding='utf-8') as f:
+                            json.dump({'formato': 'shein', 'total': len(arquivos), 'arquivos': arquivos},
+                                      f, ensure_ascii=False, indent=2)
+                    else:
+                        create_individual_page_pdf(output_pdf, extracted_data, input_pdf, progress)
+    finally:
+        if memory is not None:
+            memory.close()
+            memory.log(os.path.basename(os.path.dirname(input_pdf)))
+    return len(extracted_data), (memory.report() if memory is not None else None)
+
+
+def run_pipeline(input_pdf, output_pdf, progress=None, progress_path=None, split_dir=None):
+    """Roda process_manifest isolado da thread da requisição.
+
+    No processo de trabalho o progresso é gravado em progress_path e repassado
+    ao callback progress enquanto esta thread aguarda o resultado.
+    """
+    if spool is not None:
+        if split_dir:
+            raise ValueError("Saída separada (saida=zip) não disponível com a fila compartilhada")
+        return run_spooled(input_pdf, output_pdf, progress)
+    if SHEIN_WORKERS > 0:
+        reporter = FileProgressReporter(progress_path) if progress and progress_path else None
+        profile_path = profiling.worker_profile_path()
+        future = _get_executor().submit(process_manifest, input_pdf, output_pdf, reporter,
+                                        MEMORY_TRACKING, MEMORY_BUDGET, split_dir, profile_path)
+        reported = {}
+        try:
+            while True:
+                try:
+                    return future.result(timeout=0.25)
+                except FuturesTimeout:
+                    pass
+                finally:
+                    if reporter:
+                        for stage, (done, total) in read_progress_file(progress_path).items():
+                            if reported.get(stage) != (done, total):
+                                reported[stage] = (done, total)
+                                progress(stage, done, total)
+        finally:
+            # Pilhas do processo de trabalho, também se o pipeline falhou
+            profiling.merge_worker_profile(profile_path)
+    with fitz_lock:
+        return process_manifest(input_pdf, output_pdf, progress, MEMORY_TRACKING, MEMORY_BUDGET, split_dir)
+
+
+def run_spooled(input_pdf, output_pdf, progress=None):
+    """Processa o manifesto num worker da fila compartilhada e copia a saída."""
+    if spool.pending_count() >= SPOOL_MAX_PENDING:
+        raise AdmissionRejected('processar-pdf', 'fila compartilhada cheia', 5)
+    spool_id = spool.submit('shein', input_pdf)
+    info = spool.wait(spool_id, SPOOL_WAIT, progress)
+    if info['state'] == 'failed':
+        spool.remove(spool_id)
+        raise Exception(info.get('error') or 'Falha no worker')
+    if info['state'] != 'done':
+        raise TimeoutError(f"Job {spool_id} ainda na fila compartilhada após {SPOOL_WAIT:.0f}s")
+    result = info['result'] or {}
+    if result.get('saida_pdf'):
+        shutil.copyfile(os.path.join(info['path'], result['saida_pdf']), output_pdf)
+    spool.remove(spool_id)
+    return result.get('total', 0), result.get('memoria')
+
+
+def process_upload(input_pdf, output_pdf, progress=None, progress_path=None, split_dir=None):
+    """Admissão + pipeline de um manifesto enviado; retorna (total, memória)."""
+    # O manifesto não passa por OCR: o custo é só o número de páginas.
+    # Na fila compartilhada o limite é SPOOL_MAX_PENDING, não a CPU local.
+    if spool is None:
+        admitted = admission.admit(estimate_cost(input_pdf, ocr_weight=1))
+    else:
+        admitted = nullcontext()
+    with admitted:
+        return run_pipeline(input_pdf, output_pdf, progress, progress_path, split_dir)
+
+
+def stream_file_and_cleanup(path, workspace, chunk_size=64 * 1024):
+    """Transmite o arquivo em blocos e libera o workspace ao final."""
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+    finally:
+        workspace.cleanup()
+
 
 @app.route('/', methods=['GET'])
 def index():
     return render_template('index.html')
 
-@app.route('/processar-pdf', methods=['POST'])
-@app.route('/api/processar-pdf', methods=['POST'])
+@shein_api.route('/processar-pdf', methods=['POST'])
+@shein_api.route('/api/processar-pdf', methods=['POST'])
 def processar_pdf():
-    # Criar arquivos temporários com o módulo tempfile para garantir limpeza adequada
-    input_pdf_fd, input_pdf = tempfile.mkstemp(suffix='.pdf', prefix='temp_input_')
-    output_pdf_fd, output_pdf = tempfile.mkstemp(suffix='.pdf', prefix='temp_output_')
-    
-    # Fechar os descritores de arquivo criados pelo tempfile
-    os.close(input_pdf_fd)
-    os.close(output_pdf_fd)
-    
-    # Adicionar à lista de arquivos temporários para garantir limpeza
-    temp_files.append(input_pdf)
-    temp_files.append(output_pdf)
-    
+    workspace = RequestWorkspace()
+    input_pdf = workspace.file('entrada.pdf')
+    output_pdf = workspace.file('processado.pdf')
+
     try:
         # Verifica se foi enviado um arquivo
         if 'arquivo' not in request.files:
+            workspace.cleanup()
             return jsonify({'erro': 'Nenhum arquivo enviado'}), 400
             
         arquivo = request.files['arquivo']
         
         # Verifica se o nome do arquivo está vazio
         if arquivo.filename == '':
+            workspace.cleanup()
             return jsonify({'erro': 'Nome do arquivo vazio'}), 400
         
         # Salva o arquivo temporariamente
         arquivo.save(input_pdf)
+
+        # Rejeita cedo o que não é manifesto, lendo só as primeiras páginas
+        if not looks_like_manifest(input_pdf):
+            workspace.cleanup()
+            return jsonify({
+                'erro': 'Formato não reconhecido',
+                'mensagem': 'O PDF não parece ser um manifesto Shein (DANFE com tabela de itens). Etiquetas do Mercado Livre devem ser enviadas em /upload.'
+            }), 400
+
+        # Identificador opcional para acompanhar o progresso em /progress/<job_id>
+        job_id = request.form.get('job_id')
+        if valid_job_id(job_id):
+            progress_tracker.start(job_id)
+        else:
+            job_id = None
         
+        # saida=zip: um PDF por pedido, devolvidos num ZIP gerado durante o envio
+        split_dir = None
+        if request.values.get('saida') == 'zip':
+            if spool is not None:
+                workspace.cleanup()
+                return jsonify({'erro': 'Saída separada (saida=zip) não disponível com a fila compartilhada'}), 400
+            split_dir = workspace.file('pedidos')
+            os.makedirs(split_dir)
+
         # Processa o PDF
-        extracted_data = extract_text_from_pdf(input_pdf)
-        if extracted_data:
-            create_individual_page_pdf(output_pdf, extracted_data, input_pdf)
-            
-            # Registra função para limpar os arquivos após o request
-            @after_this_request
-            def cleanup_after_request(response):
-                try:
-                    # Remover os arquivos temporários após o envio da resposta
-                    if os.path.exists(input_pdf):
-                        os.remove(input_pdf)
-                        temp_files.remove(input_pdf)
-                        print(f"Arquivo temporário removido após request: {input_pdf}")
-                    if os.path.exists(output_pdf):
-                        os.remove(output_pdf)
-                        temp_files.remove(output_pdf)
-                        print(f"Arquivo temporário removido após request: {output_pdf}")
-                except Exception as e:
-                    print(f"Erro ao remover arquivos temporários após request: {str(e)}")
-                return response
-            
-            # Envia o arquivo processado como resposta
-            try:
-                response = send_file(
-                    output_pdf,
-                    mimetype='application/pdf',
-                    as_attachment=True,
-                    download_name='processado.pdf'
-                )
-                
-                return response
-            except Exception as e:
-                # Se houver erro ao enviar o arquivo, tenta remover os temporários
-                print(f"Erro ao enviar o arquivo: {str(e)}")
-                try:
-                    if os.path.exists(input_pdf):
-                        os.remove(input_pdf)
-                        temp_files.remove(input_pdf)
-                    if os.path.exists(output_pdf):
-                        os.remove(output_pdf)
-                        temp_files.remove(output_pdf)
-                except Exception as cleanup_error:
-                    print(f"Erro ao limpar arquivos após falha de envio: {str(cleanup_error)}")
-                raise
+        try:
+            total, memoria = process_upload(input_pdf, output_pdf, progress_tracker.reporter(job_id),
+                                            workspace.file('progresso.json'), split_dir)
+        except Exception as e:
+            if job_id:
+                progress_tracker.finish(job_id, error=str(e))
+            raise
+        if job_id:
+            progress_tracker.finish(job_id, error=None if total else 'Nenhum dado extraído do PDF')
+
+        if total and split_dir:
+            headers = zip_response_headers('processado.zip')
+            if memoria:
+                headers['X-Memory-Peak-MB'] = str(memoria['rss_pico_mb'])
+            return Response(stream_directory(split_dir, workspace.cleanup),
+                            mimetype='application/zip', headers=headers)
+        elif total:
+            # Envia o arquivo processado; o diretório da requisição é removido
+            # quando o servidor terminar (ou abortar) a transmissão da resposta
+            headers = {
+                'Content-Disposition': 'attachment; filename=processado.pdf',
+                'Content-Length': str(os.path.getsize(output_pdf)),
+            }
+            if memoria:
+                headers['X-Memory-Peak-MB'] = str(memoria['rss_pico_mb'])
+            return Response(
+                stream_file_and_cleanup(output_pdf, workspace),
+                mimetype='application/pdf',
+                headers=headers
+            )
         else:
-            # Se não extraiu dados, remove o arquivo de entrada
-            try:
-                if os.path.exists(input_pdf):
-                    os.remove(input_pdf)
-                    temp_files.remove(input_pdf)
-                if os.path.exists(output_pdf):
-                    os.remove(output_pdf)
-                    temp_files.remove(output_pdf)
-            except Exception as e:
-                print(f"Erro ao remover arquivos temporários: {str(e)}")
-                
+            workspace.cleanup()
             return jsonify({
                 'erro': 'Nenhum dado extraído do PDF', 
                 'mensagem': 'O PDF enviado não parece conter o formato esperado. Certifique-se de que o PDF contém uma DANFE com a chave de acesso e itens.'
             }), 400
+
+    except MemoryBudgetExceeded as e:
+        print(f"Memória: {e}")
+        workspace.cleanup()
+        return jsonify({
+            'erro': 'Orçamento de memória excedido',
+            'mensagem': 'O PDF exige mais memória do que o servidor permite processar agora. Tente dividir o arquivo ou enviar novamente mais tarde.'
+        }), 503
+
+    except AdmissionRejected as e:
+        workspace.cleanup()
+        response = jsonify({
+            'erro': 'Servidor ocupado',
+            'mensagem': f'Muitos PDFs em processamento. Tente novamente em {e.retry_after} segundos.',
+            'retry_after': e.retry_after
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
             
     except Exception as e:
         # Log do erro completo para debug
@@ -144,15 +354,7 @@ def processar_pdf():
         print(error_trace)
         
         # Limpar arquivos temporários em caso de erro
-        try:
-            if os.path.exists(input_pdf):
-                os.remove(input_pdf)
-                temp_files.remove(input_pdf)
-            if os.path.exists(output_pdf):
-                os.remove(output_pdf)
-                temp_files.remove(output_pdf)
-        except Exception as cleanup_error:
-            print(f"Erro ao limpar arquivos temporários: {str(cleanup_error)}")
+        workspace.cleanup()
         
         # Mensagem de erro mais amigável para o usuário
         error_message = str(e)
@@ -168,165 +370,293 @@ def processar_pdf():
             'mensagem': user_message
         }), 500
 
-# Resto do código permanece igual
-def extract_text_from_pdf(input_pdf):
+@app.route('/progress/<job_id>')
+def progress_stream(job_id):
+    if not valid_job_id(job_id):
+        return jsonify({'erro': 'Identificador de job inválido'}), 400
+    return Response(
+        stream_with_context(progress_tracker.stream(job_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Cabeçalho da tabela de itens da DANFE simplificada (rótulo -> coluna)
+DANFE_COLUNAS = {"ITEM": "codigo", "CONTEÚDO": "conteudo", "ATRIBUTOS": "atributos", "QUANT.": "quantidade"}
+QUANTIDADE_RE = re.compile(r"\d+")
+# Páginas lidas para reconhecer um manifesto (etiquetas e DANFEs se alternam)
+MANIFEST_SNIFF_PAGES = 4
+
+
+def agrupar_linhas(words, tolerancia=3.0):
+    """Agrupa as palavras de page.get_text("words") em linhas pela posição vertical.
+
+    Retorna uma lista de linhas (de cima para baixo), cada uma com as palavras
+    ordenadas da esquerda para a direita.
+    """
+    linhas = []
+    topo_linha = None
+    for w in sorted(words, key=lambda w: (w[1], w[0])):
+        if topo_linha is None or w[1] - topo_linha > tolerancia:
+            linhas.append([])
+            topo_linha = w[1]
+        linhas[-1].append(w)
+    for linha in linhas:
+        linha.sort(key=lambda w: w[0])
+    return linhas
+
+
+def texto_linha(linha):
+    return " ".join(w[4] for w in linha)
+
+
+def encontrar_cabecalho_itens(linhas):
+    """Localiza a linha ITEM/CONTEÚDO/ATRIBUTOS/QUANT.
+
+    Retorna (índice da linha, [(x inicial, coluna), ...]) ou (None, None).
+    """
+    for idx, linha in enumerate(linhas):
+        colunas = [(w[0], DANFE_COLUNAS[w[4]]) for w in linha if w[4] in DANFE_COLUNAS]
+        if any(nome == "codigo" for _, nome in colunas) and len(colunas) >= 2:
+            return idx, sorted(colunas)
+    return None, None
+
+
+def manifest_header_in(words_pages):
+    """True se alguma das páginas (palavras de get_text("words")) tem o cabeçalho de itens."""
+    return any(encontrar_cabecalho_itens(agrupar_linhas(words))[0] is not None for words in words_pages)
+
+
+def looks_like_manifest(input_pdf, max_pages=MANIFEST_SNIFF_PAGES):
+    """Detecção barata: procura o cabeçalho de itens só nas primeiras páginas."""
+    with fitz_lock, fitz.open(input_pdf) as doc:
+        return manifest_header_in(doc[i].get_text("words") for i in range(min(max_pages, doc.page_count)))
+
+
+def extrair_chave_acesso(linhas):
+    """Texto após 'CHAVE DE ACESSO' na mesma linha ou, se vazio, na linha seguinte."""
+    for idx, linha in enumerate(linhas):
+        texto = texto_linha(linha)
+        pos = texto.find("CHAVE DE ACESSO")
+        if pos < 0:
+            continue
+        resto = texto[pos + len("CHAVE DE ACESSO"):].strip()
+        if resto:
+            return resto
+        if idx + 1 < len(linhas):
+            return texto_linha(linhas[idx + 1]).strip()
+    return None
+
+
+def coluna_da_palavra(word, colunas):
+    # A palavra pertence à última coluna que começa antes dela (com folga de 2pt)
+    nome = colunas[0][1]
+    for x_inicio, col in colunas:
+        if word[0] >= x_inicio - 2:
+            nome = col
+        else:
+            break
+    return nome
+
+
+def acumular_itens(linhas, colunas, itens):
+    """Distribui as linhas da tabela em colunas e acrescenta/continua itens.
+
+    Uma nova linha de item começa quando há texto na coluna ITEM; linhas sem
+    código continuam o item anterior (conteúdo quebrado em várias linhas ou
+    em várias páginas).
+    """
+    for linha in linhas:
+        celulas = {}
+        for w in linha:
+            celulas.setdefault(coluna_da_palavra(w, colunas), []).append(w[4])
+        if not celulas:
+            continue
+        if "codigo" in celulas or not itens:
+            itens.append({"codigo": [], "conteudo": [], "atributos": [], "quantidade": []})
+        atual = itens[-1]
+        for nome, palavras in celulas.items():
+            atual[nome].append(" ".join(palavras))
+
+
+def finalizar_itens(itens):
+    resultado = []
+    for item in itens:
+        codigo = " ".join(item["codigo"])
+        conteudo = " ".join(item["conteudo"] + item["atributos"])
+        m = QUANTIDADE_RE.search(" ".join(item["quantidade"]))
+        resultado.append([codigo, conteudo, m.group(0) if m else "1"])
+    return resultado
+
+
+def extract_text_from_pdf(input_pdf, progress=None):
+    """Extrai [chave de acesso, itens, página da etiqueta] de cada DANFE.
+
+    Percorre o documento uma única vez lendo as palavras com coordenadas. As
+    colunas da tabela de itens são reconstruídas a partir da posição do
+    cabeçalho; páginas sem imagens logo após uma DANFE são continuação da
+    tabela. A etiqueta (página com imagem) associada a cada DANFE é a que a
+    precede ou, se não houver, a primeira que vem depois dela.
+    """
     inicio = time.time()
     doc = fitz.open(input_pdf)
     extracted_data = []
-    page_num = 0
-    while page_num < doc.page_count:
-        page = doc.load_page(page_num)
-        text = page.get_text("text")
-
-        if not text.startswith("DANFE"):
-            page_num += 1
-            continue
-
-        try:
-            chave_acesso_index = text.index("CHAVE DE ACESSO")
-            chave_acesso = text[chave_acesso_index + len("CHAVE DE ACESSO"):].strip().split('\n')[0]
-
-            item_index = text.index("ITEM")
-            texto_completo = text[item_index:]
+    atual = None          # [chave, itens brutos, página da etiqueta]
+    colunas = None
+    etiqueta_pendente = None
 
-            proxima_pagina = page_num + 1
-            if proxima_pagina < doc.page_count:
-                next_page = doc.load_page(proxima_pagina)
-                if not next_page.get_images():
-                    next_text = next_page.get_text("text")
-                    texto_completo += next_text
+    def fechar():
+        if atual is not None:
+            extracted_data.append([atual[0], finalizar_itens(atual[1]), atual[2]])
 
-            linhas = texto_completo.strip().split('\n')
-            
-            itens = []
-            item_atual = []
-            
-            for linha in linhas[1:]:
-                if linha.strip() in ["CONTEÚDO", "ATRIBUTOS", "QUANT."]:
-                    continue
-                    
-                if linha.strip() == "1":
-                    if item_atual:
-                        codigo = item_atual[0]
-                        conteudo = " ".join(item_atual[1:])
-                        itens.append([codigo, conteudo, "1"])
-                        item_atual = []
-                elif linha.strip():
-                    item_atual.append(linha.strip())
-            
-            if item_atual:
-                codigo = item_atual[0]
-                conteudo = " ".join(item_atual[1:])
-                itens.append([codigo, conteudo, "1"])
-
-            extracted_data.append([chave_acesso, itens])
+    for page_num in range(doc.page_count):
+        page = doc.load_page(page_num)
+        words = page.get_text("words")
+        if progress:
+            progress("leitura", page_num + 1, doc.page_count)
+
+        if words and words[0][4].startswith("DANFE"):
+            fechar()
+            atual = None
+            linhas = agrupar_linhas(words)
+            chave_acesso = extrair_chave_acesso(linhas)
+            idx_cabecalho, colunas = encontrar_cabecalho_itens(linhas)
+            if not chave_acesso or idx_cabecalho is None:
+                print(f"Erro ao extrair dados na página {page_num + 1}")
+                continue
+            atual = [chave_acesso, [], etiqueta_pendente]
+            etiqueta_pendente = None
+            acumular_itens(linhas[idx_cabecalho + 1:], colunas, atual[1])
+            continue
 
-        except ValueError:
-            print(f"Erro ao extrair dados na página {page_num + 1}")
+        tem_imagens = bool(page.get_images())
+        if atual is not None and not tem_imagens:
+            # Continuação da tabela de itens em outra página
+            linhas = agrupar_linhas(words)
+            idx_cabecalho, novas_colunas = encontrar_cabecalho_itens(linhas)
+            if idx_cabecalho is not None:
+                colunas = novas_colunas
+                linhas = linhas[idx_cabecalho + 1:]
+            acumular_itens(linhas, colunas, atual[1])
+            continue
 
-        page_num += 2
+        if tem_imagens:
+            if atual is not None and atual[2] is None:
+                atual[2] = page_num
+            else:
+                etiqueta_pendente = page_num
+        fechar()
+        atual = None
 
+    fechar()
     doc.close()
     fim = time.time()
     print(f"Tempo de execução da extração: {fim - inicio} segundos")
     return extracted_data
 
-def create_individual_page_pdf(output_pdf, data, input_pdf):
+CM = 28.3464567  # pontos por centímetro
+PAGE_SIZE = (799, 1197)
+PAGE_WIDTH, PAGE_HEIGHT = PAGE_SIZE
+
+# Templates da página de saída, montados uma única vez
+
+# Código de barras vertical na borda direita: barras de 0,05 cm e 1,8 cm de
+# altura, lido de baixo para cima a partir de 14,8 cm do topo
+BARCODE_TEMPLATE = BarcodeTemplate(
+    fitz.Rect(PAGE_WIDTH - 2.3 * CM, 0, PAGE_WIDTH - 0.5 * CM, 14.8 * CM),
+    PAGE_HEIGHT, vertical=True, module_width=0.05 * CM,
+)
+# Chave de acesso legível, girada, ao lado do código de barras
+CHAVE_TEXT_ORIGIN = (PAGE_WIDTH - 0.10 * CM, PAGE_HEIGHT - 12.0 * CM)
+
+# Tabela de itens: conteúdo e quantidade em negrito 18
+ITENS_TABLE_STYLE = table_style(
+    fontname=HELVETICA_BOLD,
+    fontsize=18,
+    leading=20,
+    aligns=["LEFT", "LEFT"],
+    row_backgrounds=[BRANCO],
+    grid=0.5,
+    padding=(6, 6, 10, 10),
+)
+ITENS_TABLE = TableTemplate([PAGE_WIDTH * 0.98 * 0.95, PAGE_WIDTH * 0.98 * 0.05], ITENS_TABLE_STYLE)
+
+# Área da etiqueta: toda a largura menos 1,5 cm à direita; a altura depende da tabela
+MARGEM_DIREITA = 1.5 * CM
+MARGEM_INFERIOR = 0.1 * CM
+
+
+def create_individual_page_pdf(output_pdf, data, input_pdf, progress=None):
+    """Uma página (ou duas, com tabela longa) por DANFE, na ordem do manifesto.
+
+    Manifestos grandes são divididos em blocos compostos em paralelo, cada
+    processo abrindo o manifesto por conta própria.
+    """
     inicio = time.time()
-    doc = fitz.open(input_pdf)
-    c = canvas.Canvas(output_pdf, pagesize=(799, 1197))
-    width, height = c._pagesize
+    if render_workers(SHEIN_RENDER_WORKERS) > 1 and len(data) >= SHEIN_RENDER_MIN_ORDERS:
+        with tempfile.TemporaryDirectory(prefix='partes_', dir=os.path.dirname(os.path.abspath(output_pdf))) as partes:
+            compose_in_chunks(partial(render_orders, input_pdf=input_pdf), data, output_pdf, partes,
+                              SHEIN_RENDER_CHUNK, SHEIN_RENDER_WORKERS, progress)
+    else:
+        render_orders(data, output_pdf, input_pdf, progress)
+    fim = time.time()
+    print(f"PDF gerado com sucesso: {output_pdf} em {fim - inicio} segundos")
+
+
+def create_split_pdfs(split_dir, data, input_pdf, progress=None):
+    """Um PDF por pedido em split_dir, compostos em paralelo; retorna o índice dos arquivos."""
+    inicio = time.time()
+    nomes = entry_names(chave_acesso for chave_acesso, itens, pagina_etiqueta in data)
+    caminhos = [os.path.join(split_dir, nome) for nome in nomes]
+    workers = SHEIN_RENDER_WORKERS if len(data) >= SHEIN_RENDER_MIN_ORDERS else 1
+    paginas = render_individually(partial(render_orders, input_pdf=input_pdf), data, caminhos,
+                                  SHEIN_RENDER_CHUNK, workers, progress)
+    print(f"{len(caminhos)} PDFs separados em {split_dir} em {time.time() - inicio} segundos")
+    return [{'arquivo': nome, 'chave_acesso': row[0], 'itens': len(row[1]), 'paginas': n}
+            for nome, row, n in zip(nomes, data, paginas)]
+
+
+def render_orders(data, output_pdf, input_pdf, progress=None):
+    """Compõe os pedidos de data em output_pdf (também usado por bloco, no pool)."""
+    writer = LabelWriter()
+    width, height = PAGE_SIZE
 
     for i, row in enumerate(data):
-        chave_acesso, itens = row
-
-        barcode = code128.Code128(chave_acesso, barHeight=1.8 * cm, barWidth=0.05 * cm)
-        c.saveState()
-        c.rotate(90)
-        barcode.drawOn(c, height - 14.00 * cm - 0.80 * cm, -width + 0.50 * cm)
-        c.restoreState()
-
-        text_x = width - 0.10 * cm
-        text_y = height - 12.0 * cm
-        c.saveState()
-        c.translate(text_x, text_y)
-        c.rotate(90)
-        c.drawString(0, 0, chave_acesso)
-        c.restoreState()
-
-        table_data = []
-        for item in itens:
-            codigo, conteudo, quantidade = item
-            conteudo_quebrado = "\n".join(conteudo[i:i+82] for i in range(0, len(conteudo), 50))
-            table_data.append([conteudo_quebrado, quantidade])
-
-        table_width = width * 0.98
-        col_widths = [table_width * 0.95, table_width * 0.05]
-        table = Table(table_data, colWidths=col_widths)
-
-        style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), colors.white),
-            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (-1, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 18),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 10),
-            ('TOPPADDING', (0, 0), (-1, -1), 10),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('NOSPLIT', (0, 0), (-1, -1)),
-            ('WORDWRAP', (0, 0), (-1, -1)),
-            ('ROWHEIGHT', (0, 0), (-1, -1), 100),
-            ('LEADING', (0, 0), (-1, -1), 20)
-        ])
-        table.setStyle(style)
+        chave_acesso, itens, pagina_etiqueta = row
+        page = writer.new_page(width, height)
+
+        ops = [
+            BARCODE_TEMPLATE.render(chave_acesso),
+            text_ops(*CHAVE_TEXT_ORIGIN, chave_acesso, HELVETICA, 12, rotate=90).encode("latin-1"),
+        ]
+
+        table_data = [[conteudo, quantidade] for codigo, conteudo, quantidade in itens]
+        layout = ITENS_TABLE.measure(table_data)
+        altura_tabela = ITENS_TABLE.height(layout)
 
         img_height = 0
 
-        pagina_com_imagem = None
-        for offset in range(0, doc.page_count - i * 2):
-            pagina_atual = i * 2 + offset
-            if pagina_atual < doc.page_count:
-                page = doc.load_page(pagina_atual)
-                if page.get_images():
-                    text = page.get_text("text")
-                    if not "DANFE" in text:
-                        pagina_com_imagem = page
-                    break
-
-        if pagina_com_imagem:
-            pix = pagina_com_imagem.get_pixmap(alpha=False, dpi=200)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            img_bytes = io.BytesIO()
-            img.save(img_bytes, format='JPEG')
-            img_bytes.seek(0)
-            img_reader = ImageReader(img_bytes)
-
-            margem_direita = 1.5 * cm
-            margem_inferior = 0.1 * cm
-            img_width = width - margem_direita
-            img_height = height - margem_inferior - table.wrap(0, width)[1] - 2 * cm
-
-            c.drawImage(img_reader, 0, height - img_height, width=img_width, height=img_height, preserveAspectRatio=True, anchor='nw')
+        if pagina_etiqueta is not None:
+            img_height = max(height - MARGEM_INFERIOR - altura_tabela - 2 * CM, 0)
+            if img_height > 0:
+                writer.show_page(page, fitz.Rect(0, 0, width - MARGEM_DIREITA, img_height),
+                                 input_pdf, pagina_etiqueta, anchor='nw')
 
         if len(table_data) > 4:
-            c.showPage()
-            
-            table.wrapOn(c, width, height)
-            table_y = height - table.wrap(0, width)[1] - 1 * cm
-            table.drawOn(c, 0.1 * cm, table_y)
+            writer.add_content(page, b"\n".join(ops))
+            page = writer.new_page(width, height)
+            writer.add_content(page, ITENS_TABLE.render(0.1 * CM, 1 * CM, height, layout))
         else:
-            table.wrapOn(c, width, height)
-            table_y = height - img_height - table.wrap(0, width)[1] - 1 * cm
-            table.drawOn(c, 0.1 * cm, table_y)
+            ops.append(ITENS_TABLE.render(0.1 * CM, img_height + 1 * CM, height, layout))
+            writer.add_content(page, b"\n".join(ops))
 
-        c.showPage()
+        if progress:
+            progress("composicao", i + 1, len(data))
 
-    c.save()
-    doc.close()
-    fim = time.time()
-    print(f"PDF gerado com sucesso: {output_pdf} em {fim - inicio} segundos")
+    return writer.save(output_pdf)
+
+app.register_blueprint(shein_api)
+app.register_blueprint(profiling.profiling_api)
 
 if __name__ == '__main__':
-    # Registrar limpeza de arquivos temporários quando o servidor for encerrado
-    atexit.register(cleanup_temp_files)
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Cada requisição tem seu próprio workspace, então o servidor pode ser threaded
+    app.run(debug=True, port=5000, threaded=True)
\ No newline at end of file
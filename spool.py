@@ -0,0 +1,410 @@
+# spool.py
+"""Fila de trabalho em diretório compartilhado (ex.: NFS), sem broker.
+
+Estrutura do spool:
+
+    tmp/<job>/                job sendo montado pelo servidor web
+    pending/<job>/            publicado (rename atômico de tmp/)
+    running/<job>.<claim>/    reivindicado por um worker (rename atômico de pending/)
+    done/<job>/               concluído, com result.json e o arquivo de saída
+    failed/<job>/             falhou, com error.json
+
+Cada job é um diretório com job.json, o arquivo de entrada e, enquanto roda,
+um arquivo heartbeat que o worker toca periodicamente. O rename garante que
+só um worker reivindica cada job; jobs em running/ com heartbeat parado são
+devolvidos para pending/ (até max_attempts) por qualquer worker.
+
+Cada reivindicação tem um token próprio no nome do diretório em running/.
+Depois que um job é devolvido e reivindicado de novo, o heartbeat e o rename
+final do worker antigo apontam para um diretório que não existe mais: eles
+falham e o worker antigo abandona o job, sem concluí-lo.
+
+Para rodar um worker (em qualquer máquina que enxergue o spool):
+
+    python spool.py worker --spool /mnt/spool --processes 4
+
+A capacidade cresce acrescentando processos ou máquinas com workers.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import argparse
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, Optional
+
+from progress import FileProgressReporter, read_progress_file
+
+STATES = ('tmp', 'pending', 'running', 'done', 'failed')
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    tmp = f"{path}.{uuid.uuid4().hex[:6]}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SpoolJob:
+    """Job reivindicado por um worker."""
+
+    def __init__(self, spool: 'Spool', job_id: str, meta: Dict[str, Any], claim: str):
+        self.spool = spool
+        self.id = job_id
+        self.meta = meta
+        self.claim = claim
+        self.path = spool.job_dir('running', f"{job_id}.{claim}")
+        # Definido quando o heartbeat falha: o job foi devolvido para a fila
+        self.lost = threading.Event()
+
+    @property
+    def kind(self) -> str:
+        return self.meta['kind']
+
+    @property
+    def input_path(self) -> str:
+        return os.path.join(self.path, self.meta['input'])
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+
+class Spool:
+    """Operações sobre o diretório do spool, seguras entre processos e máquinas."""
+
+    def __init__(self, root: str, stale_after: float = 60.0, max_attempts: int = 3):
+        self.root = os.path.abspath(root)
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        for state in STATES:
+            os.makedirs(os.path.join(self.root, state), exist_ok=True)
+
+    def job_dir(self, state: str, job_id: str) -> str:
+        return os.path.join(self.root, state, job_id)
+
+    def running_dir(self, job_id: str) -> Optional[str]:
+        """Diretório da reivindicação atual do job em running/, se houver."""
+        running = os.path.join(self.root, 'running')
+        for name in os.listdir(running):
+            if name.partition('.')[0] == job_id:
+                return os.path.join(running, name)
+        return None
+
+    def _now(self) -> float:
+        """Hora do servidor de arquivos (mtime de um arquivo recém-tocado).
+
+        Heartbeats são comparados com ela, não com o relógio local, para que
+        diferenças de relógio entre máquinas não reivindiquem jobs vivos.
+        """
+        probe = os.path.join(self.root, '.clock')
+        with open(probe, 'a'):
+            pass
+        os.utime(probe, None)
+        return os.stat(probe).st_mtime
+
+    # ---- lado do servidor web ----
+
+    def submit(self, kind: str, input_path: str, options: Optional[Dict[str, Any]] = None,
+               input_name: Optional[str] = None) -> str:
+        """Copia a entrada para o spool e publica o job; retorna o id."""
+        job_id = f"{int(time.time() * 1000):013d}-{uuid.uuid4().hex[:8]}"
+        staging = self.job_dir('tmp', job_id)
+        os.makedirs(staging)
+        name = input_name or os.path.basename(input_path)
+        shutil.copyfile(input_path, os.path.join(staging, name))
+        _write_json(os.path.join(staging, 'job.json'), {
+            'id': job_id,
+            'kind': kind,
+            'input': name,
+            'options': options or {},
+            'attempts': 0,
+            'submitted': time.time(),
+            'submitted_by': socket.gethostname(),
+        })
+        os.rename(staging, self.job_dir('pending', job_id))
+        return job_id
+
+    def pending_count(self) -> int:
+        return len(os.listdir(os.path.join(self.root, 'pending')))
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        """Estado atual do job: pending, running, done, failed ou unknown."""
+        for state in ('done', 'failed', 'running', 'pending'):
+            path = self.running_dir(job_id) if state == 'running' else self.job_dir(state, job_id)
+            if path and os.path.isdir(path):
+                info: Dict[str, Any] = {'id': job_id, 'state': state, 'path': path}
+                if state == 'done':
+                    info['result'] = _read_json(os.path.join(path, 'result.json'))
+                elif state == 'failed':
+                    info['error'] = (_read_json(os.path.join(path, 'error.json')) or {}).get('error')
+                elif state == 'running':
+                    info['progress'] = read_progress_file(os.path.join(path, 'progress.json'))
+                return info
+        return {'id': job_id, 'state': 'unknown'}
+
+    def wait(self, job_id: str, timeout: float, on_progress: Optional[Callable[[str, int, int], None]] = None,
+             poll_interval: float = 0.25) -> Dict[str, Any]:
+        """Aguarda o job terminar (ou o timeout), repassando o progresso do worker."""
+        deadline = time.time() + timeout
+        reported: Dict[str, tuple] = {}
+        while True:
+            info = self.status(job_id)
+            if on_progress:
+                for stage, (done, total) in (info.get('progress') or {}).items():
+                    if reported.get(stage) != (done, total):
+                        reported[stage] = (done, total)
+                        on_progress(stage, done, total)
+            if info['state'] in ('done', 'failed', 'unknown') or time.time() >= deadline:
+                return info
+            time.sleep(poll_interval)
+
+    def remove(self, job_id: str) -> None:
+        for state in ('done', 'failed'):
+            shutil.rmtree(self.job_dir(state, job_id), ignore_errors=True)
+
+    def publish_catalog(self, etag: str, items: Dict[str, Any]) -> None:
+        """Publica o catálogo de produtos para os workers (substituição atômica)."""
+        _write_json(os.path.join(self.root, 'catalog.json'), {'etag': etag, 'produtos': items})
+
+    # ---- lado do worker ----
+
+    def claim(self, worker_id: str, kinds=None) -> Optional[SpoolJob]:
+        """Reivindica o job pendente mais antigo dos tipos dados (rename atômico)."""
+        pending = os.path.join(self.root, 'pending')
+        for job_id in sorted(os.listdir(pending)):
+            source = os.path.join(pending, job_id)
+            if kinds is not None:
+                meta = _read_json(os.path.join(source, 'job.json'))
+                if not meta or meta.get('kind') not in kinds:
+                    continue
+            claim = uuid.uuid4().hex[:12]
+            try:
+                # Toca o heartbeat antes do rename: o job nunca aparece em
+                # running/ com heartbeat antigo
+                with open(os.path.join(source, 'heartbeat'), 'w') as f:
+                    f.write(f"{worker_id} {claim}")
+                os.rename(source, self.job_dir('running', f"{job_id}.{claim}"))
+            except OSError:
+                continue  # outro worker chegou antes
+            job = SpoolJob(self, job_id, {}, claim)
+            meta = _read_json(job.file('job.json')) or {}
+            meta['attempts'] = meta.get('attempts', 0) + 1
+            meta['worker'] = worker_id
+            job.meta = meta
+            try:
+                _write_json(job.file('job.json'), meta)
+            except OSError:
+                continue  # devolvido para a fila logo após a reivindicação
+            return job
+        return None
+
+    def heartbeat(self, job: SpoolJob) -> bool:
+        """Renova o heartbeat; False (e job.lost) se o job não é mais deste worker."""
+        try:
+            os.utime(job.file('heartbeat'), None)
+            return True
+        except OSError:
+            job.lost.set()
+            return False
+
+    def complete(self, job: SpoolJob, result: Dict[str, Any]) -> bool:
+        return self._finish(job, 'done', 'result.json', result)
+
+    def fail(self, job: SpoolJob, error: str) -> bool:
+        return self._finish(job, 'failed', 'error.json', {'error': error, 'worker': job.meta.get('worker')})
+
+    def _finish(self, job: SpoolJob, state: str, name: str, data: Dict[str, Any]) -> bool:
+        """Grava o resultado e move o job para state, se a reivindicação ainda é deste worker."""
+        # Confere a reivindicação logo antes de gravar: o heartbeat falha se
+        # o diretório já foi devolvido para a fila
+        if job.lost.is_set() or not self.heartbeat(job):
+            print(f"Spool: job {job.id} não pertence mais a este worker; resultado descartado")
+            return False
+        try:
+            _write_json(job.file(name), data)
+            os.rename(job.path, self.job_dir(state, job.id))
+            return True
+        except OSError:
+            # O job foi devolvido para a fila por heartbeat atrasado
+            job.lost.set()
+            print(f"Spool: job {job.id} não pertence mais a este worker")
+            return False
+
+    def reclaim_stale(self) -> int:
+        """Devolve para pending/ os jobs cujo worker parou de dar sinal."""
+        running = os.path.join(self.root, 'running')
+        now = self._now()
+        reclaimed = 0
+        for name in os.listdir(running):
+            path = os.path.join(running, name)
+            job_id = name.partition('.')[0]
+            try:
+                beat = os.stat(os.path.join(path, 'heartbeat')).st_mtime
+            except OSError:
+                continue
+            if now - beat <= self.stale_after:
+                continue
+            meta = _read_json(os.path.join(path, 'job.json')) or {}
+            if meta.get('attempts', 0) >= self.max_attempts:
+                target = self.job_dir('failed', job_id)
+                error = f"Job abandonado após {meta.get('attempts')} tentativas sem heartbeat"
+                try:
+                    _write_json(os.path.join(path, 'error.json'), {'error': error})
+                    os.rename(path, target)
+                except OSError:
+                    continue
+            else:
+                try:
+                    os.rename(path, self.job_dir('pending', job_id))
+                except OSError:
+                    continue
+            reclaimed += 1
+            print(f"Spool: job {job_id} sem heartbeat há {now - beat:.0f}s reivindicado")
+        return reclaimed
+
+    def purge(self, max_age: float) -> int:
+        """Remove jobs concluídos/falhos (e montagens abandonadas) mais antigos que max_age."""
+        now = self._now()
+        removed = 0
+        for state in ('done', 'failed', 'tmp'):
+            base = os.path.join(self.root, state)
+            for job_id in os.listdir(base):
+                path = os.path.join(base, job_id)
+                try:
+                    if now - os.stat(path).st_mtime > max_age:
+                        shutil.rmtree(path, ignore_errors=True)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def load_catalog(self) -> Optional[Dict[str, Any]]:
+        return _read_json(os.path.join(self.root, 'catalog.json'))
+
+
+class SpoolWorker:
+    """Loop de worker: reivindica jobs, executa o handler do tipo e grava o resultado."""
+
+    def __init__(self, spool: Spool, handlers: Dict[str, Callable[[SpoolJob, Any], Dict[str, Any]]],
+                 worker_id: Optional[str] = None, poll_interval: float = 1.0,
+                 heartbeat_interval: float = 5.0, purge_after: float = 24 * 3600):
+        self.spool = spool
+        self.handlers = handlers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.purge_after = purge_after
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _beat(self, job: SpoolJob, done: threading.Event) -> None:
+        while not done.wait(self.heartbeat_interval):
+            if not self.spool.heartbeat(job):
+                return
+
+    def run_once(self) -> bool:
+        """Processa no máximo um job; retorna True se havia trabalho."""
+        self.spool.reclaim_stale()
+        if time.time() - self._last_purge > 600:
+            self._last_purge = time.time()
+            self.spool.purge(self.purge_after)
+
+        job = self.spool.claim(self.worker_id, kinds=set(self.handlers))
+        if job is None:
+            return False
+        handler = self.handlers[job.kind]
+
+        done = threading.Event()
+        beater = threading.Thread(target=self._beat, args=(job, done), daemon=True)
+        beater.start()
+        started = time.time()
+        try:
+            result = handler(job, FileProgressReporter(job.file('progress.json')))
+            if self.spool.complete(job, result):
+                print(f"Spool: job {job.id} ({job.kind}) concluído em {time.time() - started:.1f}s")
+        except Exception as e:
+            print(f"Spool: job {job.id} ({job.kind}) falhou: {e}")
+            self.spool.fail(job, str(e))
+        finally:
+            done.set()
+            beater.join()
+        return True
+
+    def run_forever(self) -> None:
+        print(f"Spool: worker {self.worker_id} atendendo {sorted(self.handlers)} em {self.spool.root}")
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+
+
+# ---- handlers dos tipos de job ----
+
+_catalog_cache: Dict[str, Any] = {'etag': None, 'catalog': None}
+
+
+def _current_catalog(spool: Spool):
+    from catalog import ProductCatalog
+    data = spool.load_catalog() or {'etag': None, 'produtos': {}}
+    if data['etag'] != _catalog_cache['etag'] or _catalog_cache['catalog'] is None:
+        # ProductCatalog mantém o índice de rastreio entre jobs
+        _catalog_cache['catalog'] = ProductCatalog(data['produtos'])
+        _catalog_cache['etag'] = data['etag']
+    return _catalog_cache['catalog']
+
+
+def handle_etiqueta(job: SpoolJob, progress) -> Dict[str, Any]:
+    from processor import process_etiqueta
+    from deadline import deadline_from_env
+    output = job.file('saida.pdf')
+    result = process_etiqueta(job.input_path, _current_catalog(job.spool), output, progress=progress,
+                              deadline=deadline_from_env())
+    result['saida_pdf'] = 'saida.pdf'
+    return result
+
+
+def handle_shein(job: SpoolJob, progress) -> Dict[str, Any]:
+    from shein import process_manifest
+    output = job.file('saida.pdf')
+    total, memoria = process_manifest(job.input_path, output, progress)
+    return {'total': total, 'memoria': memoria, 'saida_pdf': 'saida.pdf' if total else None}
+
+
+HANDLERS = {'etiqueta': handle_etiqueta, 'shein': handle_shein}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Worker da fila de etiquetas em diretório compartilhado')
+    parser.add_argument('mode', choices=['worker'])
+    parser.add_argument('--spool', default=os.environ.get('SPOOL_DIR', 'spool'))
+    parser.add_argument('--kinds', default=','.join(HANDLERS), help='tipos de job atendidos')
+    parser.add_argument('--stale-after', type=float, default=float(os.environ.get('SPOOL_STALE_AFTER', 60)))
+    parser.add_argument('--processes', type=int, default=1, help='workers nesta máquina')
+    args = parser.parse_args()
+    kinds = [kind for kind in args.kinds.split(',') if kind in HANDLERS]
+
+    def run_worker():
+        spool = Spool(args.spool, stale_after=args.stale_after)
+        SpoolWorker(spool, {kind: HANDLERS[kind] for kind in kinds}).run_forever()
+
+    if args.processes <= 1:
+        run_worker()
+    else:
+        workers = [multiprocessing.Process(target=run_worker, daemon=True) for _ in range(args.processes)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
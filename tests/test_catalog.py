@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+from catalog import CatalogError, ProductCatalog, VersionConflict
+
+CAMISA = [{'titulo': 'Camisa', 'sku': 'C1', 'qtd': 1}]
+CALCA = [{'titulo': 'Calça', 'sku': 'P2', 'qtd': 2}]
+
+
+def test_versions_count_only_effective_changes():
+    catalog = ProductCatalog({'RA123456785BR': CAMISA})
+    assert catalog.version == 1
+    assert catalog.apply(upserts={'RA123456785BR': CAMISA}) == (0, 0)
+    assert catalog.apply(deletes=['XX']) == (0, 0)
+    assert catalog.version == 1
+    assert catalog.etag == f"{catalog.epoch}-1"
+
+
+def test_changes_since():
+    catalog = ProductCatalog({'A': CAMISA, 'B': CAMISA})
+    since = catalog.version
+    catalog.apply(upserts={'A': CALCA, 'C': CALCA}, deletes=['B'])
+
+    delta = catalog.changes_since(since)
+    assert not delta['full']
+    assert delta['version'] == catalog.version == 5
+    assert delta['upsert'] == {'A': CALCA, 'C': CALCA}
+    assert delta['delete'] == ['B']
+
+    assert catalog.changes_since(catalog.version)['upsert'] == {}
+    # Item alterado de novo aparece uma vez, com o valor atual
+    catalog.apply(upserts={'A': CAMISA})
+    assert catalog.changes_since(since)['upsert'] == {'A': CAMISA, 'C': CALCA}
+
+
+def test_readded_item_is_not_deleted():
+    catalog = ProductCatalog({'A': CAMISA})
+    since = catalog.version
+    catalog.apply(deletes=['A'])
+    catalog.apply(upserts={'A': CALCA})
+    delta = catalog.changes_since(since)
+    assert delta['upsert'] == {'A': CALCA}
+    assert delta['delete'] == []
+
+
+def test_changes_since_falls_back_to_full():
+    catalog = ProductCatalog({'A': CAMISA, 'B': CAMISA, 'C': CAMISA}, max_tombstones=1)
+    since = catalog.version
+    catalog.apply(deletes=['A'])
+    catalog.apply(deletes=['B'])
+    # O tombstone de A foi descartado: delta a partir de since estaria incompleto
+    delta = catalog.changes_since(since)
+    assert delta['full']
+    assert delta['upsert'] == {'C': CAMISA}
+    assert catalog.changes_since(catalog.version + 1)['full']
+    assert not catalog.changes_since(catalog.version - 1)['full']
+
+
+def test_if_version_conflict():
+    catalog = ProductCatalog({'A': CAMISA})
+    with pytest.raises(VersionConflict):
+        catalog.apply(upserts={'B': CALCA}, if_version=0)
+    assert catalog.apply(upserts={'B': CALCA}, if_version=1) == (1, 0)
+
+
+def test_invalid_payloads():
+    catalog = ProductCatalog()
+    with pytest.raises(CatalogError):
+        catalog.apply(upserts={'A': {'titulo': 'x'}})
+    with pytest.raises(CatalogError):
+        catalog.apply(upserts={' ': CAMISA})
+    with pytest.raises(CatalogError):
+        catalog.apply(deletes='A')
+    assert catalog.version == 0
+
+
+def test_stored_items_are_copies():
+    produtos = [{'titulo': 'Camisa'}]
+    catalog = ProductCatalog({'A': produtos})
+    produtos[0]['titulo'] = 'alterado'
+    assert catalog['A'] == [{'titulo': 'Camisa'}]
+
+
+def test_iter_ndjson():
+    catalog = ProductCatalog({'A': CAMISA, 'B': CALCA})
+    lines = list(catalog.iter_ndjson())
+    assert all(line.endswith("\n") for line in lines)
+    assert [json.loads(line) for line in lines] == [
+        {'tracking': 'A', 'produtos': CAMISA},
+        {'tracking': 'B', 'produtos': CALCA},
+    ]
+    # Acentos saem como UTF-8, não como escapes
+    assert 'Calça' in lines[1]
+
+
+def test_tracking_index_is_reused_until_the_catalog_changes():
+    catalog = ProductCatalog({'RA123456785BR': CAMISA})
+    index = catalog.tracking_index()
+    assert catalog.tracking_index() is index
+    assert index.resolve('RAI2345678SBR') == 'RA123456785BR'
+    catalog.apply(upserts={'MEL4400012345': CALCA})
+    assert catalog.tracking_index() is not index
+    assert catalog.tracking_index().resolve('MEL4400012345') == 'MEL4400012345'
@@ -0,0 +1,136 @@
+import os
+import time
+
+import fitz
+import pytest
+from flask import Flask, abort
+
+from output_store import EVICT_GRACE, OutputStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(str(tmp_path / 'outputs'), max_bytes=0, max_age=0)
+
+
+@pytest.fixture
+def client(store):
+    app = Flask(__name__)
+
+    @app.route('/download/<filename>')
+    def download(filename):
+        response = store.send(filename)
+        if response is None:
+            abort(404)
+        return response
+
+    return app.test_client()
+
+
+def write(store, name, data, age=0.0):
+    path = store.path_for(name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if age:
+        old = time.time() - age
+        os.utime(path, (old, old))
+    return path
+
+
+def test_etag_and_conditional_get(store, client):
+    write(store, 'a.pdf', b'%PDF-1.4 conteudo')
+    store.register('a.pdf')
+    r = client.get('/download/a.pdf')
+    assert r.status_code == 200
+    assert r.data == b'%PDF-1.4 conteudo'
+    assert r.headers['Cache-Control'] == 'no-cache'
+    etag = r.headers['ETag']
+
+    r = client.get('/download/a.pdf', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.data == b''
+
+
+def test_range_request(store, client):
+    write(store, 'a.pdf', b'0123456789')
+    store.register('a.pdf')
+    r = client.get('/download/a.pdf', headers={'Range': 'bytes=2-5'})
+    assert r.status_code == 206
+    assert r.data == b'2345'
+    assert r.headers['Content-Range'] == 'bytes 2-5/10'
+
+
+def test_rewritten_file_gets_new_etag(store, client):
+    write(store, 'a.pdf', b'primeira versao', age=60)
+    store.register('a.pdf')
+    first = client.get('/download/a.pdf').headers['ETag']
+    write(store, 'a.pdf', b'segunda versao, maior')
+    r = client.get('/download/a.pdf', headers={'If-None-Match': first})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != first
+
+
+def test_file_removed_by_another_process(store, client):
+    write(store, 'a.pdf', b'x')
+    store.register('a.pdf')
+    os.remove(store.path_for('a.pdf'))
+    assert client.get('/download/a.pdf').status_code == 404
+    assert store.get('a.pdf') is None
+    assert store.total_bytes() == 0
+
+
+def test_invalid_names(store, client):
+    assert store.get('../a.pdf') is None
+    assert store.get('.clock') is None
+    assert client.get('/download/nada.pdf').status_code == 404
+
+
+def test_register_evicts_oldest_over_limit(tmp_path):
+    store = OutputStore(str(tmp_path / 'outputs'), max_bytes=25, max_age=0)
+    write(store, 'velho.pdf', b'x' * 10, age=EVICT_GRACE * 3)
+    write(store, 'medio.pdf', b'x' * 10, age=EVICT_GRACE * 2)
+    store.register('velho.pdf')
+    store.register('medio.pdf')
+    write(store, 'novo.pdf', b'x' * 10)
+    store.register('novo.pdf')
+    assert [m['filename'] for m in store.list()] == ['novo.pdf', 'medio.pdf']
+    assert store.total_bytes() == 20
+
+
+def test_recent_and_oversized_files_are_kept(tmp_path):
+    store = OutputStore(str(tmp_path / 'outputs'), max_bytes=25, max_age=0)
+    write(store, 'recente.pdf', b'x' * 20)
+    store.register('recente.pdf')
+    write(store, 'grande.pdf', b'x' * 100)
+    store.register('grande.pdf')
+    write(store, 'novo.pdf', b'x' * 10)
+    store.register('novo.pdf')
+    # Todos dentro do período de carência; o grande não conta no limite
+    assert sorted(m['filename'] for m in store.list()) == ['grande.pdf', 'novo.pdf', 'recente.pdf']
+
+
+def test_evict_by_age_and_files_of_other_processes(tmp_path):
+    store = OutputStore(str(tmp_path / 'outputs'), max_bytes=0, max_age=60)
+    write(store, 'expirado.pdf', b'x', age=120)
+    write(store, 'outro_processo.pdf', b'xy')
+    assert store.evict() == 1
+    assert [m['filename'] for m in store.list()] == ['outro_processo.pdf']
+    assert store.total_bytes() == 2
+
+
+def test_preview_is_cached(store):
+    doc = fitz.open()
+    for _ in range(2):
+        doc.new_page(width=200, height=300)
+    doc.save(store.path_for('a.pdf'))
+    doc.close()
+    store.register('a.pdf')
+
+    first = store.preview('a.pdf', page=2, width=120, fmt='png')
+    assert first['pages'] == 2 and first['width'] == 100 and not first['cached']
+    assert first['data'].startswith(b'\x89PNG')
+    second = store.preview('a.pdf', page=2, width=120, fmt='png')
+    assert second['cached'] and second['etag'] == first['etag']
+    with pytest.raises(IndexError):
+        store.preview('a.pdf', page=3)
+    assert store.preview('nada.pdf') is None
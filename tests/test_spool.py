@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from spool import Spool, SpoolWorker
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / 'spool'), stale_after=60, max_attempts=2)
+
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / 'etiqueta.pdf'
+    path.write_bytes(b'%PDF-1.4')
+    return str(path)
+
+
+def make_stale(job):
+    # Heartbeat parado há mais que stale_after
+    old = os.stat(job.file('heartbeat')).st_mtime - 3600
+    os.utime(job.file('heartbeat'), (old, old))
+
+
+def test_claim_and_complete(spool, upload):
+    job_id = spool.submit('etiqueta', upload)
+    assert spool.status(job_id)['state'] == 'pending'
+    assert spool.pending_count() == 1
+
+    job = spool.claim('w1')
+    assert job.id == job_id and job.kind == 'etiqueta'
+    assert job.meta['attempts'] == 1
+    assert os.path.exists(job.input_path)
+    assert spool.status(job_id)['state'] == 'running'
+    assert spool.claim('w2') is None
+
+    assert spool.heartbeat(job)
+    assert spool.complete(job, {'paginas': 3})
+    info = spool.status(job_id)
+    assert info['state'] == 'done'
+    assert info['result'] == {'paginas': 3}
+
+    spool.remove(job_id)
+    assert spool.status(job_id)['state'] == 'unknown'
+
+
+def test_claim_filters_kinds(spool, upload):
+    job_id = spool.submit('shein', upload)
+    assert spool.claim('w1', kinds={'etiqueta'}) is None
+    assert spool.claim('w1', kinds={'shein'}).id == job_id
+
+
+def test_fail(spool, upload):
+    job_id = spool.submit('etiqueta', upload)
+    job = spool.claim('w1')
+    assert spool.fail(job, 'PDF inválido')
+    info = spool.status(job_id)
+    assert info['state'] == 'failed'
+    assert info['error'] == 'PDF inválido'
+
+
+def test_reclaimed_job_belongs_to_the_new_claim(spool, upload):
+    job_id = spool.submit('etiqueta', upload)
+    old = spool.claim('w1')
+    make_stale(old)
+    # Outro processo (com outra instância) devolve o job para a fila
+    other = Spool(spool.root, stale_after=60, max_attempts=2)
+    assert other.reclaim_stale() == 1
+    assert spool.status(job_id)['state'] == 'pending'
+
+    new = other.claim('w2')
+    assert new.id == job_id and new.meta['attempts'] == 2
+    assert new.path != old.path
+
+    # O worker antigo perdeu a reivindicação: heartbeat e conclusão falham
+    assert not spool.heartbeat(old)
+    assert old.lost.is_set()
+    assert not spool.complete(old, {'worker': 'w1'})
+    assert not spool.fail(old, 'atrasado')
+
+    assert other.heartbeat(new)
+    assert other.complete(new, {'worker': 'w2'})
+    assert spool.status(job_id)['result'] == {'worker': 'w2'}
+
+
+def test_reclaim_gives_up_after_max_attempts(spool, upload):
+    job_id = spool.submit('etiqueta', upload)
+    for _ in range(2):
+        job = spool.claim('w1')
+        make_stale(job)
+        spool.reclaim_stale()
+    info = spool.status(job_id)
+    assert info['state'] == 'failed'
+    assert 'tentativas' in info['error']
+
+
+def test_live_job_is_not_reclaimed(spool, upload):
+    spool.submit('etiqueta', upload)
+    spool.claim('w1')
+    assert spool.reclaim_stale() == 0
+
+
+def test_worker_runs_handlers(spool, upload):
+    def ok(job, progress):
+        progress('composicao', 1, 1)
+        return {'input': os.path.basename(job.input_path)}
+
+    def broken(job, progress):
+        raise ValueError('sem páginas')
+
+    worker = SpoolWorker(spool, {'etiqueta': ok, 'shein': broken}, worker_id='w1')
+    ok_id = spool.submit('etiqueta', upload)
+    broken_id = spool.submit('shein', upload)
+    assert worker.run_once() and worker.run_once()
+    assert not worker.run_once()
+    assert spool.status(ok_id)['result'] == {'input': 'etiqueta.pdf'}
+    assert spool.status(broken_id)['error'] == 'sem páginas'
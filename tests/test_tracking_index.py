@@ -0,0 +1,55 @@
+from tracking_index import TrackingIndex, deletions, edit_distance, fold, index_for
+
+S10 = "RA123456785BR"
+
+
+def test_exact_and_positional_s10_correction():
+    index = TrackingIndex([S10, "MEL4400012345"])
+    assert len(index) == 2
+    assert index.resolve(S10) == S10
+    assert index.resolve(" ra12345678sbr ") == S10
+    assert index.resolve("RAI2345678SBR") == S10
+
+
+def test_folded_lookup_resolves_mel_codes():
+    index = TrackingIndex(["MEL4400012345"])
+    assert index.resolve("ME14400O12345") == "MEL4400012345"
+
+
+def test_approximate_search_is_s10_only():
+    index = TrackingIndex([S10, "MEL4400012345"])
+    # Caractere inserido pelo OCR num S10: resolve pela distância de edição
+    assert index.resolve("RA1234567855BR") == S10
+    # MEL sem dígito verificador: um caractere a menos pode ser outro pedido
+    assert index.resolve("MEL440001234") is None
+    assert index.resolve("MEL44000123456") is None
+
+
+def test_approximate_tie_does_not_resolve():
+    index = TrackingIndex(["RA123456785BR", "RA123456785BT"])
+    assert index.resolve("RA123456785BX") is None
+
+
+def test_folded_tie_without_check_digit_does_not_resolve():
+    index = TrackingIndex(["ABC0", "ABCO"])
+    assert index.resolve("ABCD") is None
+
+
+def test_no_match():
+    index = TrackingIndex([S10])
+    assert index.resolve("XX999999999XX") is None
+    assert index.resolve("") is None
+
+
+def test_helpers():
+    assert fold(" mel0o1 ") == "ME1001"
+    assert deletions("abc", 1) == {"abc", "bc", "ac", "ab"}
+    assert edit_distance("abcd", "abd", 1) == 1
+    assert edit_distance("abcd", "xbcy", 1) == 2
+    assert edit_distance("kitten", "sitting", 3) == 3
+    assert edit_distance("kitten", "sitting", 2) == 3
+
+
+def test_index_for_plain_mapping():
+    index = index_for({S10: []})
+    assert index.resolve(S10) == S10
@@ -0,0 +1,46 @@
+from validators import canonical_s10, is_valid_chave, is_valid_s10, nfe_check_digit, s10_check_digit
+
+# Exemplo do Manual de Orientação do Contribuinte da NF-e (DV = 5)
+CHAVE = "52060433009911002506550120000007800267301615"
+
+
+def test_s10_check_digit():
+    # 1*8 + 2*6 + 3*4 + 4*2 + 5*3 + 6*5 + 7*9 + 8*7 = 204; 11 - 204 % 11 = 5
+    assert s10_check_digit("12345678") == 5
+
+
+def test_s10_check_digit_special_rests():
+    # Resto 1 (11 - 1 = 10) vira 0 e resto 0 (11 - 0 = 11) vira 5
+    assert s10_check_digit("00000008") == 0
+    assert s10_check_digit("00000000") == 5
+
+
+def test_is_valid_s10():
+    assert is_valid_s10("RA123456785BR")
+    assert not is_valid_s10("RA123456784BR")
+    assert not is_valid_s10("RA12345678BR")
+    assert not is_valid_s10("ra123456785br")
+    assert not is_valid_s10("")
+
+
+def test_canonical_s10_fixes_ocr_swaps_by_position():
+    assert canonical_s10(" ra12345678sbr ") == "RA123456785BR"
+    assert canonical_s10("RAI2345678SBR") == "RA123456785BR"
+    assert canonical_s10("8A123456785BR") == "BA123456785BR"
+
+
+def test_canonical_s10_rejects_wrong_check_digit():
+    assert canonical_s10("RA123456784BR") is None
+    assert canonical_s10("RA1234567") is None
+
+
+def test_nfe_check_digit():
+    assert nfe_check_digit(CHAVE[:43]) == 5
+
+
+def test_is_valid_chave():
+    assert is_valid_chave(CHAVE)
+    assert not is_valid_chave(CHAVE[:43] + "4")
+    assert not is_valid_chave(CHAVE[:43])
+    assert not is_valid_chave("x" * 44)
+    assert not is_valid_chave(None)
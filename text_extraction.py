@@ -0,0 +1,99 @@
+# text_extraction.py
+"""Extração de texto por página, com o PyMuPDF como caminho rápido.
+
+O pdfplumber (Python puro) é várias vezes mais lento que o PyMuPDF e era a
+primeira etapa de toda requisição. Agora o texto sai das palavras do PyMuPDF,
+agrupadas em linhas como o extract_text do pdfplumber faz (mesma tolerância
+vertical, palavras da esquerda para a direita). O pdfplumber só é aberto para
+as páginas em que o PyMuPDF não decodifica o texto: glifos sem mapeamento
+Unicode (U+FFFD) ou página com fontes e nenhuma palavra extraída.
+
+As duas saídas passam pela mesma normalização, para que as heurísticas de
+rastreio e DANFE vejam o mesmo texto qualquer que seja o backend.
+
+TEXT_BACKEND=pdfplumber força o backend antigo em todas as páginas.
+"""
+import os
+import re
+import unicodedata
+from pathlib import Path
+from typing import List, Optional, Union
+
+import fitz
+import pdfplumber
+
+from pdf_writer import fitz_lock
+from progress import ProgressCallback
+
+TEXT_BACKEND = os.environ.get('TEXT_BACKEND', 'pymupdf').lower()
+# Mesma tolerância vertical (pontos) do agrupamento de linhas do pdfplumber
+LINE_TOLERANCE = 3.0
+# Fração de caracteres não decodificados a partir da qual a página vai para o pdfplumber
+MAX_UNDECODED = 0.02
+
+# Ligaduras e espaços especiais que cada backend entrega de um jeito
+LIGATURES = str.maketrans({'ﬀ': 'ff', 'ﬁ': 'fi', 'ﬂ': 'fl', 'ﬃ': 'ffi',
+                           'ﬄ': 'ffl', 'ﬅ': 'st', 'ﬆ': 'st'})
+SPACES_RE = re.compile(r"[ \t\u00a0\u2000-\u200b\u202f\u205f\u3000]+")
+
+
+def normalize_text(text: str) -> str:
+    """NFC, ligaduras expandidas, espaços colapsados e sem linhas vazias."""
+    text = unicodedata.normalize('NFC', text).translate(LIGATURES)
+    lines = (SPACES_RE.sub(' ', line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def words_to_text(words: list) -> str:
+    """Texto de page.get_text("words") em linhas de cima para baixo, como o pdfplumber."""
+    lines: List[list] = []
+    last_top = None
+    for w in sorted(words, key=lambda w: (w[1], w[0])):
+        # Como o cluster do pdfplumber: a tolerância vale a partir da palavra anterior
+        if last_top is None or w[1] - last_top > LINE_TOLERANCE:
+            lines.append([])
+        lines[-1].append(w)
+        last_top = w[1]
+    return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
+
+
+def needs_fallback(page: fitz.Page, text: str) -> bool:
+    """True se o PyMuPDF não conseguiu decodificar o texto da página."""
+    if text:
+        return text.count('\ufffd') > MAX_UNDECODED * len(text)
+    # Sem palavras mas com fontes: texto que o PyMuPDF não mapeou (não é digitalizado)
+    return bool(page.get_fonts())
+
+
+def page_text(page: fitz.Page) -> str:
+    """Texto normalizado de uma página pelo caminho rápido (sem fallback)."""
+    return normalize_text(words_to_text(page.get_text("words", sort=False)))
+
+
+def extract_pages(path: Union[str, Path], progress: Optional[ProgressCallback] = None,
+                  max_pages: Optional[int] = None) -> List[str]:
+    """Texto normalizado por página (sem OCR), com fallback para o pdfplumber por página."""
+    texts: List[str] = []
+    fallback: List[int] = []
+    with fitz_lock, fitz.open(str(path)) as doc:
+        total = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+        for i in range(total):
+            page = doc[i]
+            text = "" if TEXT_BACKEND == 'pdfplumber' else page_text(page)
+            if TEXT_BACKEND == 'pdfplumber' or needs_fallback(page, text):
+                fallback.append(i)
+            texts.append(text)
+            if progress:
+                progress("leitura", len(texts), total)
+
+    if fallback:
+        if TEXT_BACKEND != 'pdfplumber':
+            print(f"Texto: {len(fallback)} página(s) de {os.path.basename(str(path))} lidas com o pdfplumber")
+        with pdfplumber.open(str(path)) as pdf:
+            for i in fallback:
+                plumber = normalize_text(pdf.pages[i].extract_text() or "")
+                # Só substitui se o pdfplumber de fato recuperou mais texto
+                if TEXT_BACKEND == 'pdfplumber' or plumber.count('\ufffd') < texts[i].count('\ufffd') \
+                        or not texts[i]:
+                    texts[i] = plumber
+    return texts
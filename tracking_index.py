@@ -0,0 +1,150 @@
+# tracking_index.py
+"""Resolução de códigos de rastreio lidos por OCR contra as chaves do catálogo.
+
+O OCR confunde caracteres parecidos (O/0, I/1, B/8...). O índice guarda as
+chaves "dobradas" (cada grupo de confusão vira um único caractere), então a
+maioria das leituras erradas resolve com uma consulta a dicionário. O que
+sobra (caracteres perdidos, inseridos ou trocados) é buscado por distância de
+edição limitada num índice de deleções: as chaves são indexadas por todas as
+variantes com até max_distance caracteres removidos, e a busca consulta as
+deleções do código lido, sem percorrer o catálogo.
+
+A busca aproximada só vale para chaves S10, em que o dígito verificador
+protege o número de série. Códigos sem dígito verificador (MEL) só resolvem
+pela forma dobrada: MEL...621 e MEL...620 são pedidos diferentes, não um erro
+de leitura. Resultado ambíguo não resolve.
+"""
+from typing import Dict, Iterable, List, Mapping, Optional, Set
+
+from validators import DIGIT_FOR_LETTER, canonical_s10, is_valid_s10
+
+
+def fold(code: str) -> str:
+    """Forma canônica para comparação: cada grupo de confusão vira o dígito."""
+    return code.strip().upper().translate(DIGIT_FOR_LETTER)
+
+
+def _distance_at_most_one(a: str, b: str) -> int:
+    # Caso comum (max_distance=1) em tempo linear: 0, 1 ou 2 (= mais que 1)
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > 1:
+        return 2
+    i = 0
+    while i < len(b) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return 1 if a[i + 1:] == b[i + 1:] else 2
+    return 1 if a[i + 1:] == b[i:] else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein com corte: retorna limit + 1 assim que a distância o ultrapassa."""
+    if limit == 1:
+        return _distance_at_most_one(a, b)
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def deletions(word: str, depth: int) -> Set[str]:
+    """Todas as variantes de word com até depth caracteres removidos."""
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+class TrackingIndex:
+    """Índice das chaves de um catálogo para resolução tolerante a erros de OCR."""
+
+    def __init__(self, keys: Iterable[str], max_distance: int = 1):
+        self.max_distance = max_distance
+        self._exact = set()
+        self._folded: Dict[str, List[str]] = {}
+        # variante com deleções -> chaves dobradas que a geram; só chaves S10,
+        # as únicas aceitas pela busca aproximada
+        self._deletions: Dict[str, Set[str]] = {}
+        for key in keys:
+            self._exact.add(key)
+            folded = fold(key)
+            self._folded.setdefault(folded, []).append(key)
+            if is_valid_s10(key):
+                for variant in deletions(folded, max_distance):
+                    self._deletions.setdefault(variant, set()).add(folded)
+
+    def __len__(self) -> int:
+        return len(self._exact)
+
+    def resolve(self, code: str) -> Optional[str]:
+        """Chave do catálogo correspondente ao código lido, ou None.
+
+        Só resolve quando há um único candidato. Empates da forma dobrada são
+        desfeitos pelo dígito verificador S10; os da busca aproximada, não.
+        """
+        code = (code or "").strip().upper()
+        if code in self._exact:
+            return code
+        # Correção posicional do S10 antes de qualquer busca aproximada
+        s10 = canonical_s10(code)
+        if s10 in self._exact:
+            return s10
+        folded = fold(code)
+        candidates = self._folded.get(folded)
+        approximate = False
+        if not candidates and self.max_distance:
+            matches = self._search(folded)
+            if matches:
+                best = min(d for d, _ in matches)
+                # Sem dígito verificador nada distingue um erro de leitura de
+                # outro pedido (por isso o índice de deleções só tem chaves S10)
+                candidates = [key for d, f in matches if d == best
+                              for key in self._folded[f] if is_valid_s10(key)]
+                approximate = True
+        if candidates and s10:
+            # Um S10 com dígito verificador válido só pode divergir fora do
+            # número de série: outro número é outro objeto, não erro de leitura
+            candidates = [key for key in candidates if key[2:11] == s10[2:11]]
+        if approximate:
+            return candidates[0] if len(candidates) == 1 else None
+        return _pick(candidates)
+
+    def _search(self, folded: str) -> List[tuple]:
+        near = set()
+        for variant in deletions(folded, self.max_distance):
+            near |= self._deletions.get(variant, set())
+        matches = []
+        for candidate in near:
+            d = edit_distance(folded, candidate, self.max_distance)
+            if d <= self.max_distance:
+                matches.append((d, candidate))
+        return matches
+
+
+def _pick(candidates: Optional[List[str]]) -> Optional[str]:
+    if not candidates:
+        return None
+    if len(candidates) == 1:
+        return candidates[0]
+    valid = [c for c in candidates if is_valid_s10(c)]
+    return valid[0] if len(valid) == 1 else None
+
+
+def index_for(produtos_map: Mapping) -> TrackingIndex:
+    """Índice do catálogo (reaproveitado pelo ProductCatalog entre versões iguais)."""
+    tracking_index = getattr(produtos_map, 'tracking_index', None)
+    if tracking_index is not None:
+        return tracking_index()
+    return TrackingIndex(produtos_map.keys())
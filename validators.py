@@ -0,0 +1,59 @@
+# validators.py
+"""Validação de dígitos verificadores dos códigos lidos das etiquetas (S10 e chave NF-e)."""
+import re
+from typing import Optional
+
+S10_RE = re.compile(r"^[A-Z]{2}\d{9}[A-Z]{2}$")
+S10_WEIGHTS = (8, 6, 4, 2, 3, 5, 9, 7)
+CHAVE_RE = re.compile(r"^\d{44}$")
+
+# Trocas comuns do OCR, conforme o tipo esperado em cada posição do S10
+DIGIT_FOR_LETTER = str.maketrans({'O': '0', 'Q': '0', 'D': '0', 'I': '1', 'L': '1',
+                                  'B': '8', 'S': '5', 'Z': '2', 'G': '6'})
+LETTER_FOR_DIGIT = str.maketrans({'0': 'O', '1': 'I', '8': 'B', '5': 'S', '2': 'Z', '6': 'G'})
+
+
+def s10_check_digit(serial: str) -> int:
+    """Dígito verificador UPU S10 para os 8 dígitos do número de série."""
+    total = sum(int(d) * w for d, w in zip(serial, S10_WEIGHTS))
+    check = 11 - total % 11
+    if check == 10:
+        return 0
+    if check == 11:
+        return 5
+    return check
+
+
+def is_valid_s10(code: str) -> bool:
+    """Código no formato AA999999999AA com dígito verificador correto."""
+    if not code or not S10_RE.match(code):
+        return False
+    return s10_check_digit(code[2:10]) == int(code[10])
+
+
+def canonical_s10(code: str) -> Optional[str]:
+    """Corrige as trocas do OCR pela posição (letras nas pontas, dígitos no meio).
+
+    Retorna o código corrigido se ele tiver dígito verificador válido.
+    """
+    code = (code or "").strip().upper()
+    if len(code) != 13:
+        return None
+    fixed = (code[:2].translate(LETTER_FOR_DIGIT)
+             + code[2:11].translate(DIGIT_FOR_LETTER)
+             + code[11:].translate(LETTER_FOR_DIGIT))
+    return fixed if is_valid_s10(fixed) else None
+
+
+def nfe_check_digit(key43: str) -> int:
+    """Dígito verificador (módulo 11, pesos 2 a 9 da direita) da chave de acesso NF-e."""
+    total = sum(int(d) * (2 + i % 8) for i, d in enumerate(reversed(key43)))
+    rest = total % 11
+    return 0 if rest < 2 else 11 - rest
+
+
+def is_valid_chave(chave: str) -> bool:
+    """Chave de acesso de 44 dígitos com dígito verificador correto."""
+    if not chave or not CHAVE_RE.match(chave):
+        return False
+    return nfe_check_digit(chave[:43]) == int(chave[43])
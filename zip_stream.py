@@ -0,0 +1,92 @@
+# zip_stream.py
+"""ZIP transmitido entrada por entrada, sem montar o arquivo inteiro.
+
+Usado na saída separada (um PDF por rastreio ou por pedido): os PDFs já estão
+no disco e cada um é copiado em blocos para dentro do ZIP enquanto a resposta
+é enviada. O zipfile escreve num destino sem seek (tamanhos e CRC vão no
+descritor de dados depois de cada entrada), então só o bloco atual fica na
+memória. O índice JSON vai como primeira entrada.
+"""
+import os
+import re
+import json
+import zipfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+INDEX_NAME = 'indice.json'
+ENTRY_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class _StreamSink:
+    """Destino do zipfile: guarda o que foi escrito até o gerador repassar."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def entry_names(labels: Iterable[str], ext: str = '.pdf') -> List[str]:
+    """Nomes de entrada na ordem de saída (001_<rótulo>.pdf), seguros para qualquer sistema."""
+    names = []
+    for n, label in enumerate(labels, 1):
+        label = ENTRY_NAME_RE.sub('_', str(label)).strip('._') or 'item'
+        names.append(f"{n:03d}_{label}{ext}")
+    return names
+
+
+def stream_zip(files: Iterable[Tuple[str, str]], index: Dict[str, Any],
+               cleanup: Optional[Callable[[], None]] = None,
+               chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Gera o ZIP com o índice e os arquivos (nome no ZIP, caminho no disco).
+
+    Os PDFs já vêm comprimidos, então as entradas vão sem recompressão.
+    cleanup é chamado ao final, também se o cliente desconectar.
+    """
+    sink = _StreamSink()
+    try:
+        with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr(INDEX_NAME, json.dumps(index, ensure_ascii=False, indent=2),
+                        compress_type=zipfile.ZIP_DEFLATED)
+            for name, path in files:
+                with open(path, 'rb') as src, zf.open(zipfile.ZipInfo.from_file(path, name), 'w') as dst:
+                    for chunk in iter(lambda: src.read(chunk_size), b''):
+                        dst.write(chunk)
+                        yield sink.take()
+        # Descritor da última entrada e diretório central
+        yield sink.take()
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+
+def stream_directory(split_dir: str, cleanup: Optional[Callable[[], None]] = None) -> Iterator[bytes]:
+    """ZIP de um diretório de saída separada, na ordem do índice INDEX_NAME gravado nele."""
+    with open(os.path.join(split_dir, INDEX_NAME), encoding='utf-8') as f:
+        index = json.load(f)
+    files = [(a['arquivo'], os.path.join(split_dir, a['arquivo'])) for a in index['arquivos']]
+    return stream_zip(files, index, cleanup)
+
+
+def zip_response_headers(filename: str) -> Dict[str, str]:
+    """Cabeçalhos da resposta: sem Content-Length, o ZIP é gerado durante o envio."""
+    return {
+        'Content-Disposition': f'attachment; filename={os.path.basename(filename)}',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    }